@@ -4,7 +4,10 @@
 
 import yaml
 
+import openapi_core
+import openapi_spec_validator
 from openapi_core import create_spec
+from tools import filecache
 from tools.config import Config
 
 BaseRoute = "/api/v1"  # Common prefix for all endpoints
@@ -14,13 +17,32 @@ apiVersion = None  # API specification version. Extracted from the OpenAPI docum
 backendVersion = "0.15.12"  # Backend version number
 
 
-def _loadOpenApiSpec():
-    global apiVersion, apiSpec
-    with open("res/openapi.yaml", "r") as file:
-        openapi_defs = yaml.load(file, Loader=yaml.SafeLoader)
+def _parseOpenApiSpec(data):
+    """Parse and validate OpenAPI document.
+
+    Parameters
+    ----------
+    data : bytes
+        Content of the OpenAPI document
+
+    Returns
+    -------
+    dict
+        Validated OpenAPI definitions, including additional servers from the configuration
+    """
+    openapi_defs = yaml.load(data, Loader=getattr(yaml, "CSafeLoader", yaml.SafeLoader))
     if "servers" in Config["openapi"]:
         openapi_defs["servers"] += Config["openapi"]["servers"]
-    apiSpec = create_spec(openapi_defs)
+    openapi_spec_validator.openapi_v3_spec_validator.validate(openapi_defs)
+    return openapi_defs
+
+
+def _loadOpenApiSpec():
+    global apiVersion, apiSpec
+    openapi_defs = filecache.load("openapi", "res/openapi.yaml", _parseOpenApiSpec,
+                                  (Config["openapi"].get("servers"), yaml.__version__, openapi_core.__version__,
+                                   getattr(openapi_spec_validator, "__version__", None)))
+    apiSpec = create_spec(openapi_defs, validate_spec=False)
     apiVersion = openapi_defs["info"]["version"]
 
 
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# SPDX-FileCopyrightText: 2021 grammm GmbH
+"""
+ASGI adapter for the API.
+
+Requests are dispatched to the regular (WSGI) application, so authentication, validation and error handling are the
+same as in WSGI mode. The application runs in one of two bounded thread pools:
+    - requests matching one of the `asgi.blockingRoutes` (LDAP and exmdb bound endpoints) use a large pool of
+      `asgi.blockingThreads` threads, as they spend most of their time waiting for the backend
+    - all other requests use a pool of `asgi.threads` threads
+
+Slow backend calls therefore only occupy a cheap thread, while the event loop keeps accepting connections and fast
+requests are not starved by slow ones.
+"""
+
+import asyncio
+import logging
+import re
+import sys
+
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from tools.config import Config
+
+
+class _ResponseWriter:
+    """Forward WSGI response to the ASGI send channel from a worker thread."""
+
+    def __init__(self, loop, send):
+        self.loop = loop
+        self.send = send
+        self.status = None
+        self.headers = None
+        self.started = False
+        self.finished = False
+
+    def _send(self, message):
+        asyncio.run_coroutine_threadsafe(self.send(message), self.loop).result()
+
+    def startResponse(self, status, headers, exc_info=None):
+        if exc_info is not None:
+            try:
+                if self.started:
+                    raise exc_info[1].with_traceback(exc_info[2])
+            finally:
+                exc_info = None
+        elif self.status is not None:
+            raise RuntimeError("start_response called twice")
+        self.status = int(status.split(" ", 1)[0])
+        self.headers = [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in headers]
+        return self.write
+
+    def _start(self):
+        if not self.started:
+            self.started = True
+            self._send({"type": "http.response.start", "status": self.status, "headers": self.headers})
+
+    def write(self, data):
+        if not data:
+            return
+        self._start()
+        self._send({"type": "http.response.body", "body": bytes(data), "more_body": True})
+
+    def finish(self):
+        self._start()
+        self._send({"type": "http.response.body", "body": b"", "more_body": False})
+        self.finished = True
+
+
+def _environ(scope, body):
+    """Create WSGI environment from ASGI connection scope.
+
+    Parameters
+    ----------
+    scope : dict
+        ASGI connection scope
+    body : bytes
+        Request body
+
+    Returns
+    -------
+    dict
+        WSGI environment
+    """
+    server = scope.get("server") or ("localhost", 80)
+    environ = {"REQUEST_METHOD": scope["method"],
+               "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+               "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+               "QUERY_STRING": scope["query_string"].decode("latin-1"),
+               "SERVER_NAME": server[0],
+               "SERVER_PORT": str(server[1]),
+               "SERVER_PROTOCOL": "HTTP/"+scope.get("http_version", "1.1"),
+               "REMOTE_ADDR": scope["client"][0] if scope.get("client") else "",
+               "wsgi.version": (1, 0),
+               "wsgi.url_scheme": scope.get("scheme", "http"),
+               "wsgi.input": BytesIO(body),
+               "wsgi.errors": sys.stderr,
+               "wsgi.multithread": True,
+               "wsgi.multiprocess": True,
+               "wsgi.run_once": False}
+    for name, value in scope.get("headers", ()):
+        name = name.decode("latin-1").upper().replace("-", "_")
+        value = value.decode("latin-1")
+        if name in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+            environ[name] = value
+            continue
+        key = "HTTP_"+name
+        if key in environ:
+            value = environ[key]+("; " if name == "COOKIE" else ",")+value
+        environ[key] = value
+    return environ
+
+
+class AsgiAdapter:
+    """ASGI application running a WSGI application in bounded thread pools."""
+
+    def __init__(self, app):
+        """Initialize adapter.
+
+        Parameters
+        ----------
+        app : Callable
+            WSGI application to run
+        """
+        config = Config["asgi"]
+        self.app = app
+        self.executor = ThreadPoolExecutor(config["threads"], "asgi")
+        self.blockingExecutor = ThreadPoolExecutor(config["blockingThreads"], "asgi-blocking")
+        routes = [route for route in config["blockingRoutes"].values() if route]
+        self.blockingRoutes = re.compile("|".join("(?:{})".format(route) for route in routes)) if routes else None
+
+    def _executor(self, path):
+        return self.blockingExecutor if self.blockingRoutes is not None and self.blockingRoutes.search(path) \
+            else self.executor
+
+    def _run(self, environ, writer):
+        """Run WSGI application and forward the response. Executed in a worker thread."""
+        result = self.app(environ, writer.startResponse)
+        try:
+            for data in result:
+                writer.write(data)
+            writer.finish()
+        finally:
+            if hasattr(result, "close"):
+                result.close()
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                self.executor.shutdown(wait=False)
+                self.blockingExecutor.shutdown(wait=False)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            return await self._lifespan(receive, send)
+        if scope["type"] != "http":
+            raise ValueError("Unsupported connection type '{}'".format(scope["type"]))
+        body = []
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            body.append(message.get("body", b""))
+            if not message.get("more_body", False):
+                break
+        loop = asyncio.get_event_loop()
+        writer = _ResponseWriter(loop, send)
+        try:
+            await loop.run_in_executor(self._executor(scope["path"]), self._run, _environ(scope, b"".join(body)), writer)
+        except Exception:
+            logging.exception("Unhandled exception in ASGI request")
+            try:
+                if not writer.started:
+                    await send({"type": "http.response.start", "status": 500,
+                                "headers": [(b"content-type", b"text/plain")]})
+                    await send({"type": "http.response.body", "body": b"Internal server error"})
+                elif not writer.finished:  # Response cannot be changed anymore, but it must be terminated
+                    await send({"type": "http.response.body", "body": b"", "more_body": False})
+            except Exception:  # Client already disconnected
+                pass
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# SPDX-FileCopyrightText: 2021 grammm GmbH
+"""
+Response compression.
+
+Responses are compressed with gzip or, if the brotli module is installed, brotli, depending on the encodings accepted by
+the client. Buffered responses are only compressed if they exceed `compression.minSize` bytes, streamed responses are
+compressed chunk by chunk.
+"""
+
+import gzip
+import logging
+import zlib
+
+from flask import g, request
+from time import perf_counter
+
+from tools.config import Config
+from tools.timing import nullTimer
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+_compressibleTypes = {"application/json", "application/x-pem-file"}
+
+
+class _GzipCompressor:
+    def __init__(self, level):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 16+zlib.MAX_WBITS)
+
+    def compress(self, data):
+        return self._compressor.compress(data)+self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._compressor.flush()
+
+
+class _BrotliCompressor:
+    def __init__(self, level):
+        self._compressor = brotli.Compressor(quality=level)
+
+    def compress(self, data):
+        return self._compressor.process(data)+self._compressor.flush()
+
+    def finish(self):
+        return self._compressor.finish()
+
+
+def _encodings():
+    """Return list of (encoding, buffered compression function, stream compressor factory) tuples in order of preference."""
+    config = Config["compression"]
+    encodings = []
+    if brotli is not None and config["brotli"]:
+        encodings.append(("br", lambda data: brotli.compress(data, quality=config["brotliLevel"]),
+                          lambda: _BrotliCompressor(config["brotliLevel"])))
+    encodings.append(("gzip", lambda data: gzip.compress(data, config["gzipLevel"]),
+                      lambda: _GzipCompressor(config["gzipLevel"])))
+    return encodings
+
+
+def _compressStream(chunks, compressor, charset):
+    """Compress streamed response chunks."""
+    try:
+        for chunk in chunks:
+            data = compressor.compress(chunk.encode(charset) if isinstance(chunk, str) else chunk)
+            if data:
+                yield data
+        yield compressor.finish()
+    finally:
+        if hasattr(chunks, "close"):
+            chunks.close()
+
+
+def _weakenETag(response):
+    """Mark entity tag as weak, as the compressed representation is not byte-identical."""
+    etag, weak = response.get_etag()
+    if etag is not None and not weak:
+        response.set_etag(etag, weak=True)
+
+
+def _matchClientETag(response):
+    """Send the entity tag of a 304 response in the form the client holds.
+
+    Whether the full response would have been compressed is not known, as the body is not generated. The client sent the
+    weak tag only if its cached representation was compressed.
+    """
+    etag, weak = response.get_etag()
+    if etag is not None and not weak and request.if_none_match.is_weak(etag) and \
+       not request.if_none_match.contains(etag):
+        response.set_etag(etag, weak=True)
+
+
+def compressResponse(response):
+    """Compress response if supported by the client.
+
+    Parameters
+    ----------
+    response : flask.Response
+        Response to compress
+
+    Returns
+    -------
+    flask.Response
+        The (modified) response
+    """
+    if not Config["compression"]["enabled"] or response.status_code < 200 or response.status_code == 204 or\
+       response.direct_passthrough or "Content-Encoding" in response.headers:
+        return response
+    notModified = response.status_code == 304
+    if not notModified and not (response.mimetype in _compressibleTypes or response.mimetype.startswith("text/")):
+        return response
+    response.vary.add("Accept-Encoding")
+    if notModified:
+        _matchClientETag(response)
+        return response
+    encodings = _encodings()
+    encoding = request.accept_encodings.best_match([encoding for encoding, _, _ in encodings])
+    if encoding is None:
+        return response
+    _, compress, compressor = next(entry for entry in encodings if entry[0] == encoding)
+    start = perf_counter()
+    if response.is_streamed:
+        response.response = _compressStream(response.response, compressor(), response.charset)
+        response.headers.pop("Content-Length", None)
+    else:
+        data = response.get_data()
+        if len(data) < Config["compression"]["minSize"]:
+            return response
+        try:
+            response.set_data(compress(data))
+        except Exception as err:
+            logging.warn("Failed to compress response: {}".format(err))
+            return response
+    response.headers["Content-Encoding"] = encoding
+    _weakenETag(response)
+    g.get("timer", nullTimer).add("compress", perf_counter()-start)
+    return response
@@ -2,28 +2,51 @@
 # SPDX-License-Identifier: AGPL-3.0-or-later
 # SPDX-FileCopyrightText: 2020 grammm GmbH
 
-from flask import Flask, jsonify, request, make_response
+from flask import Flask, jsonify, request, make_response, g
 
 import yaml
 from sqlalchemy.exc import DatabaseError
+from collections import Counter
 from functools import wraps
+import hashlib
+import json
+import math
+import random
+import re
+import threading
+import time
 import traceback
+from time import perf_counter
 
+from tools import changes, metrics, ratelimit, tracing
 from tools.config import Config
+from tools.timing import PhaseTimer, nullTimer
 
 import openapi_core
-from openapi_core.shortcuts import RequestValidator, ResponseValidator
 if openapi_core.__version__.split(".") < ["0", "13", "0"]:
     from openapi_core.wrappers.flask import FlaskOpenAPIRequest, FlaskOpenAPIResponse
 else:
     from openapi_core.contrib.flask import FlaskOpenAPIRequest, FlaskOpenAPIResponse
 
-from . import apiSpec
+from . import apiSpec, sqlaudit
+from .compression import compressResponse
+from .jsonenc import JSONEncoder
+from .validators import CachedRequestValidator, CachedResponseValidator
 
 
 API = Flask("grammm Admin API")  # Core API object
 API.config["JSON_SORT_KEYS"] = False  # Do not sort response fields. Crashes when returning lists...
-requestValidator, responseValidator = RequestValidator(apiSpec), ResponseValidator(apiSpec)
+API.json_encoder = JSONEncoder
+requestValidator, responseValidator = CachedRequestValidator(apiSpec), CachedResponseValidator(apiSpec)
+
+
+def precompileValidators():
+    """Prepare request and response validators for all operations.
+
+    Optional, validators are otherwise prepared on first use of an operation.
+    """
+    requestValidator.precompile()
+    responseValidator.precompile()
 
 
 def validateRequest(flask_request):
@@ -46,46 +69,298 @@ def validateRequest(flask_request):
     return True, None, None
 
 
-def secure(requireDB=False, requireAuth=True, authLevel="basic"):
+responseValidationErrors = Counter()  # Number of failed response validations per endpoint
+responseValidationMetric = metrics.Counter("grammm_admin_response_validation_failures_total",
+                                           "Number of responses that failed validation", ("endpoint",))
+requestMetric = metrics.Histogram("grammm_admin_http_request_duration_seconds",
+                                  "Duration of HTTP requests", ("endpoint", "method", "status"))
+inFlightMetric = metrics.Gauge("grammm_admin_http_requests_in_flight", "Number of requests currently processed")
+rateLimitMetric = metrics.Counter("grammm_admin_rate_limited_requests_total", "Number of requests rejected by rate limiting",
+                                  ("class",))
+_validationLock = threading.Lock()
+_validationPool = None
+_validationSlots = None
+
+
+def checkResponse(openapiRequest, openapiResponse, endpoint):
+    """Validate a response and count failures.
+
+    Parameters
+    ----------
+    openapiRequest : OpenAPIRequest
+        Request the response was generated for
+    openapiResponse : OpenAPIResponse
+        Response to validate
+    endpoint : str
+        Name of the endpoint that generated the response
+
+    Returns
+    -------
+    list
+        List of validation errors, or None if the response is valid
+    """
+    try:
+        result = responseValidator.validate(openapiRequest, openapiResponse)
+    except AttributeError:
+        return None
+    if not result.errors:
+        return None
+    with _validationLock:
+        responseValidationErrors[endpoint] += 1
+    responseValidationMetric.inc(endpoint)
+    return result.errors
+
+
+def _checkResponseAsync(openapiRequest, openapiResponse, endpoint):
+    """Validate response in a worker thread and log any errors."""
+    try:
+        errors = checkResponse(openapiRequest, openapiResponse, endpoint)
+        if errors:
+            API.logger.warn("Response validation failed ({}): {}".format(endpoint, errors))
+    except:
+        API.logger.error(traceback.format_exc())
+    finally:
+        _validationSlots.release()
+
+
+def _validateResponseAsync(response):
+    """Schedule response validation in the worker pool.
+
+    If all workers are busy and the queue is full, the response is not validated.
+    """
+    global _validationPool, _validationSlots
+    if _validationPool is None:
+        with _validationLock:
+            if _validationPool is None:
+                from concurrent.futures import ThreadPoolExecutor
+                workers = Config["openapi"]["validateResponseWorkers"]
+                _validationSlots = threading.BoundedSemaphore(workers*Config["openapi"]["validateResponseQueue"])
+                _validationPool = ThreadPoolExecutor(workers, "response-validation")
+    if not _validationSlots.acquire(False):
+        API.logger.debug("Response validation queue full - skipping")
+        return
+    _validationPool.submit(_checkResponseAsync, FlaskOpenAPIRequest(request), FlaskOpenAPIResponse(response), request.endpoint)
+
+
+permissionTables = ("admin_roles", "admin_role_permission_relation", "admin_user_role_relation")
+
+
+def entityTag(tables):
+    """Compute entity tag for the current request.
+
+    The tag is derived from the request path and query, the current user and the change counters of the given tables
+    and the tables defining user permissions. If `options.etagLifetime` is set, the tag also changes after that many
+    seconds to limit the effect of modifications not tracked by the change counters.
+
+    Parameters
+    ----------
+    tables : Iterable of str
+        Names of the tables the response is generated from
+
+    Returns
+    -------
+    str
+        Entity tag or None if change counters are not available
+    """
+    counters = changes.get(*tables, *permissionTables)
+    if counters is None:
+        return None
+    lifetime = Config["options"]["etagLifetime"]
+    auth = getattr(request, "auth", {})
+    key = (request.endpoint, request.full_path, auth.get("claims", {}).get("usr"), counters,
+           int(time.time()//lifetime) if lifetime else None)
+    return hashlib.blake2b(repr(key).encode("utf-8"), digest_size=16).hexdigest()
+
+
+class _Flight:
+    """In-flight computation shared by identical requests."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None  # (data, status, headers) of the response, if it can be shared
+
+
+_flights = {}
+_flightLock = threading.Lock()
+
+
+def flightKey(requireAuth):
+    """Create key identifying identical requests.
+
+    Requests are considered identical if method, endpoint, path, query string and the user are the same.
+    The user is taken from the already verified token, so no additional authentication is required.
+
+    Parameters
+    ----------
+    requireAuth : bool
+        Whether the request is authenticated.
+
+    Returns
+    -------
+    tuple
+        Request key
+    """
+    user = request.auth["claims"].get("usr") if requireAuth else None
+    return request.method, request.endpoint, request.full_path, user
+
+
+def singleFlight(key, func):
+    """Execute function once for concurrent identical requests.
+
+    The first request executes the function, while identical requests arriving in the meantime wait for its result.
+    Waiting requests receive a copy of the response without the entity tag and cookies, which must be set per request
+    if needed. If the first request fails, or generates a streamed response, the waiting requests execute the function
+    themselves.
+
+    Parameters
+    ----------
+    key : tuple
+        Key identifying identical requests
+    func : Callable
+        Function generating the response
+
+    Returns
+    -------
+    Response
+        Flask response object
+    """
+    with _flightLock:
+        flight = _flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = _flights[key] = _Flight()
+    if not leader:
+        flight.done.wait(Config["options"]["singleFlightTimeout"])
+        if flight.result is None:
+            return make_response(func())
+        data, status, headers = flight.result
+        return API.response_class(data, status, headers)
+    try:
+        response = make_response(func())
+        if not response.is_streamed:
+            flight.result = (response.get_data(), response.status_code,
+                             [(name, value) for name, value in response.headers
+                              if name.lower() not in ("set-cookie", "etag")])
+        return response
+    finally:
+        with _flightLock:
+            _flights.pop(key, None)
+        flight.done.set()
+
+
+def rateLimited(routeClass, requireAuth):
+    """Check rate limit of the current request.
+
+    Authenticated requests are limited per user, others per client address.
+
+    Parameters
+    ----------
+    routeClass : str
+        Name of the route class
+    requireAuth : bool
+        Whether the request is authenticated
+
+    Returns
+    -------
+    Response
+        HTTP 429 response if the request exceeds the limit, None otherwise
+    """
+    client = request.auth["claims"].get("usr") if requireAuth else None
+    retry = ratelimit.acquire(routeClass, client or "@"+str(request.remote_addr))
+    if not retry:
+        return None
+    rateLimitMetric.inc(routeClass)
+    response = jsonify(message="Too many requests. Please try again later.")
+    response.status_code = 429
+    response.headers["Retry-After"] = str(math.ceil(retry))
+    return response
+
+
+def secure(requireDB=False, requireAuth=True, authLevel="basic", etag=None, coalesce=False, rateLimit="default"):
     """Decorator securing API functions.
 
        Arguments:
            - requireDB (boolean)
                Whether the database is needed for the call. If set to True and the database is not configured,
                and error message is returned without invoking the endpoint.
+           - etag (Iterable of str)
+               Names of the tables the response of GET requests depends on. If set, an entity tag is sent with successful
+               responses and requests with a matching `If-None-Match` header are answered with 304 without invoking the
+               endpoint. See `entityTag` for details.
+           - coalesce (boolean)
+               Whether concurrent identical GET requests should share a single execution of the endpoint. Only
+               applicable to endpoints whose response depends on nothing but the request and the user's permissions.
+               Can be disabled globally with `options.singleFlight`. See `singleFlight` for details.
+           - rateLimit (str)
+               Route class used for rate limiting (see `rateLimit.classes` configuration), or None to disable rate
+               limiting for the endpoint. If the limit is exceeded, a HTTP 429 is returned without invoking the endpoint.
 
        Automatically validates the request using the OpenAPI specification and returns a HTTP 400 to the client if validation
        fails. Also validates the response generated by the endpoint and returns a HTTP 500 on error. This behavior can be
        deactivated in the configuration.
+       Response validation can be restricted to a random sample of responses (`openapi.validateResponseSampleRate`) or be
+       moved to a background thread pool (`openapi.validateResponseAsync`), in which case errors are only logged.
+       Streamed responses are not validated.
+
+       If `options.requestTiming` is enabled, the duration of each processing phase is reported in the `Server-Timing`
+       header and logged.
 
        If an exception is raised during execution, a HTTP 500 message is returned to the client and a short description of the
        error is sent in the 'error' field of the response.
        """
-    from .security import getSecurityContext
+    from .security import getSecurityContext, getUser
     from .errors import InsufficientPermissions
     def inner(func):
         @wraps(func)
         def wrapper(*args, **kwargs):
             def call():
                 ret = func(*args, **kwargs)
+                timer.mark("endpoint")
+                if tag is not None:
+                    ret = make_response(ret)
+                    if ret.status_code == 200:
+                        ret.set_etag(tag)
+                sampleRate = Config["openapi"]["validateResponseSampleRate"]
+                if sampleRate < 1 and random.random() >= sampleRate:
+                    timer.mark("validateResponse")
+                    return ret
                 response = make_response(ret)
-                try:
-                    result = responseValidator.validate(FlaskOpenAPIRequest(request), FlaskOpenAPIResponse(response))
-                except AttributeError:
-                    result = None
-                if result is not None and result.errors:
+                if response.is_streamed:  # Validation would consume the response
+                    timer.mark("validateResponse")
+                    return response
+                if Config["openapi"]["validateResponseAsync"]:
+                    _validateResponseAsync(response)
+                    timer.mark("validateResponse")
+                    return ret
+                errors = checkResponse(FlaskOpenAPIRequest(request), FlaskOpenAPIResponse(response), request.endpoint)
+                timer.mark("validateResponse")
+                if errors:
                     if Config["openapi"]["validateResponse"]:
-                        API.logger.error("Response validation failed: "+str(result.errors))
+                        API.logger.error("Response validation failed: "+str(errors))
                         return jsonify(message="The server generated an invalid response."), 500
                     else:
-                        API.logger.warn("Response validation failed: "+str(result.errors))
+                        API.logger.warn("Response validation failed: "+str(errors))
                 return ret
 
+            if Config["options"]["requestTiming"] or Config["options"]["slowRequestThreshold"] is not None:
+                timer = g.timer = PhaseTimer()
+            else:
+                timer = nullTimer
             if requireAuth:
-                error = getSecurityContext(authLevel)
+                error = getSecurityContext("basic")
+                timer.mark("auth")
+                if error is None and authLevel == "user":
+                    error = getUser()
+                    timer.mark("user")
                 if error is not None:
                     return jsonify(message="Access denied", error=error), 401
+            if rateLimit is not None and Config["rateLimit"]["enabled"]:
+                response = rateLimited(rateLimit, requireAuth)
+                timer.mark("rateLimit")
+                if response is not None:
+                    return response
             valid, message, errors = validateRequest(request)
+            timer.mark("validateRequest")
             if not valid:
                 if Config["openapi"]["validateRequest"]:
                     API.logger.info("Request validation failed: {}".format(errors))
@@ -97,7 +372,17 @@ def secure(requireDB=False, requireAuth=True, authLevel="basic"):
                 from orm import DB
                 if DB is None:
                     return jsonify(message="Database not available."), 503
+            tag = entityTag(etag) if etag is not None and request.method in ("GET", "HEAD") else None
+            if tag is not None and request.if_none_match.contains_weak(tag):
+                response = API.response_class(status=304)
+                response.set_etag(tag)
+                return response
             try:
+                if coalesce and request.method in ("GET", "HEAD") and Config["options"]["singleFlight"]:
+                    response = singleFlight(flightKey(requireAuth), call)
+                    if tag is not None and response.status_code == 200:
+                        response.set_etag(tag)
+                    return response
                 return call()
             except DatabaseError as err:
                 API.logger.error("Database query failed: {}".format(err))
@@ -111,13 +396,118 @@ def secure(requireDB=False, requireAuth=True, authLevel="basic"):
     return inner
 
 
+@API.before_request
+def startRequest():
+    """Record request start for metrics and enable statement log for slow request logging."""
+    g.requestStart = perf_counter()
+    inFlightMetric.inc()
+    if tracing.enabled:
+        g.traceSpan = tracing.startTrace("{} {}".format(request.method, request.url_rule.rule if request.url_rule
+                                                          else request.path),
+                                         request.headers.get("traceparent"),
+                                         attributes={"http.method": request.method, "http.target": request.path})
+    if Config["options"]["slowRequestThreshold"] is not None or sqlaudit.enabled():
+        g.sqlLog = {"count": 0, "duration": 0, "statements": [], "shapes": Counter() if sqlaudit.enabled() else None}
+
+
+@API.after_request
+def recordRequest(response):
+    """Record request duration and status code."""
+    start = g.get("requestStart")
+    if start is not None:
+        requestMetric.observe(perf_counter()-start, request.endpoint or "", request.method, str(response.status_code))
+    span = g.get("traceSpan")
+    if span is not None:
+        span.setAttribute("http.status_code", response.status_code)
+        if response.status_code >= 500:
+            span.status = tracing.STATUS_ERROR
+    return response
+
+
+@API.teardown_request
+def finishRequest(exc):
+    """Update in-flight gauge, write metrics file if necessary and end request span."""
+    if g.pop("requestStart", None) is not None:
+        inFlightMetric.dec()
+    metrics.flush()
+    span = g.pop("traceSpan", None)
+    if span is not None:
+        tracing.endTrace(span, exc)
+
+
 @API.after_request
 def noCache(response):
-    """Add no-cache headers to the response"""
+    """Add no-cache headers to the response.
+
+    Responses with an entity tag may be stored by the client, but must be revalidated before use.
+    """
     response.cache_control.no_cache = True
-    response.cache_control.no_store = True
-    response.cache_control.max_age = 1
+    if response.get_etag()[0] is None:
+        response.cache_control.no_store = True
+        response.cache_control.max_age = 1
+    else:
+        response.cache_control.private = True
+    return response
+
+
+@API.after_request
+def reportTiming(response):
+    """Add Server-Timing header and log phase durations if request timing is enabled."""
+    timer = g.get("timer")
+    if timer is not None and Config["options"]["requestTiming"]:
+        response.headers["Server-Timing"] = timer.serverTiming()
+        API.logger.info("Request timing: "+json.dumps({"endpoint": request.endpoint, "method": request.method,
+                                                       "path": request.path, "status": response.status_code,
+                                                       "timing": timer.todict()}))
     return response
 
 
+_secretRe = re.compile(r"pass|secret|token|key|jwt|auth", re.IGNORECASE)
+
+
+def redact(data):
+    """Replace values of keys that look like secrets.
+
+    Parameters
+    ----------
+    data : Any
+        JSON-like data to redact
+
+    Returns
+    -------
+    Any
+        Copy of the data with secret values replaced by "***"
+    """
+    if isinstance(data, dict):
+        return {key: "***" if isinstance(key, str) and _secretRe.search(key) else redact(value)
+                for key, value in data.items()}
+    if isinstance(data, list):
+        return [redact(value) for value in data]
+    return data
+
+
+@API.after_request
+def logSlowRequest(response):
+    """Log requests exceeding `options.slowRequestThreshold`."""
+    threshold = Config["options"]["slowRequestThreshold"]
+    start = g.get("requestStart")
+    if threshold is None or start is None or perf_counter()-start < threshold:
+        return response
+    timer = g.get("timer")
+    sqlLog = g.get("sqlLog") or {"count": 0, "duration": 0, "statements": []}
+    entry = {"endpoint": request.endpoint, "method": request.method, "path": request.path,
+             "status": response.status_code, "duration": round((perf_counter()-start)*1000, 3),
+             "args": redact(request.args.to_dict(flat=False)), "viewArgs": request.view_args,
+             "body": redact(request.get_json(silent=True)) if request.is_json else None,
+             "timing": timer.todict() if timer is not None else None,
+             "sql": {"count": sqlLog["count"], "duration": round(sqlLog["duration"]*1000, 3),
+                     "statements": sqlLog["statements"]}}
+    API.logger.warn("Slow request: "+json.dumps(entry, default=str))
+    return response
+
+
+API.after_request(sqlaudit.auditRequest)
+API.after_request(compressResponse)  # Registered last to run before timing is reported
+
+
 from . import errors
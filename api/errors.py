@@ -5,6 +5,8 @@
 from api.core import API
 from flask import jsonify, request
 
+from tools.passwords import PasswordHashBusy
+
 
 class InsufficientPermissions(RuntimeError):
     pass
@@ -15,6 +17,13 @@ def insufficient_permissions(error):
     return jsonify(message="Insufficient permissions for this operation"), 403
 
 
+@API.errorhandler(PasswordHashBusy)
+def password_hash_busy(error):
+    response = jsonify(message="Server busy, please try again later")
+    response.headers["Retry-After"] = "1"
+    return response, 503
+
+
 @API.errorhandler(404)
 def not_found(error):
     """Return JSON object with 404 message."""
@@ -0,0 +1,307 @@
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# SPDX-FileCopyrightText: 2021 grammm GmbH
+"""
+Background jobs for long-running operations.
+
+Jobs are executed by a pool of `jobs.workers` threads in the process that submitted them, inside an application
+context. Job records are stored as JSON files in `jobs.directory` (default: `<options.cacheDir>/jobs`), so the status
+can be queried from any worker process. If neither is configured, records are only kept in memory.
+
+A job function receives the `Job` object as first argument. It should report progress with `Job.progress` and stop
+early if `Job.cancelled` returns True. The return value must be JSON serializable and is stored as the job result.
+"""
+
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import traceback
+import uuid
+
+from concurrent.futures import ThreadPoolExecutor
+
+from tools import tracing
+from tools.config import Config
+
+from . import BaseRoute
+from .core import API
+from .jsonenc import jsonify
+
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+_executor = None
+_lock = threading.Lock()
+_jobs = {}  # Jobs submitted by this process
+_lastCleanup = 0
+
+
+def _afterFork():
+    global _executor, _lock, _jobs
+    _executor = None
+    _lock = threading.Lock()
+    _jobs = {}
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_afterFork)
+
+
+def _jobDir():
+    config = Config["jobs"]
+    if config.get("directory"):
+        return config["directory"]
+    cacheDir = Config["options"].get("cacheDir")
+    return os.path.join(cacheDir, "jobs") if cacheDir else None
+
+
+def _path(jobID, suffix=".json"):
+    jobDir = _jobDir()
+    return None if jobDir is None else os.path.join(jobDir, jobID+suffix)
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class Job:
+    """Handle of a background job, passed to the job function."""
+
+    def __init__(self, jobType, owner):
+        self.record = {"ID": uuid.uuid4().hex, "type": jobType, "owner": owner, "status": QUEUED, "pid": os.getpid(),
+                       "created": time.time(), "started": None, "finished": None,
+                       "progress": {"done": 0, "total": None}, "message": None, "result": None}
+        self._cancelled = False
+        self._lastSave = 0
+
+    @property
+    def ID(self):
+        return self.record["ID"]
+
+    def _save(self):
+        """Write job record. Must be called with the module lock held."""
+        path = _path(self.ID)
+        if path is None:
+            return
+        try:
+            os.makedirs(os.path.dirname(path), mode=0o750, exist_ok=True)
+            fd, tmpPath = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            try:
+                with os.fdopen(fd, "w") as file:
+                    json.dump(self.record, file, separators=(",", ":"))
+                os.replace(tmpPath, path)
+            except:
+                os.unlink(tmpPath)
+                raise
+        except Exception as err:
+            logging.warn("Could not save job record: {}".format(err))
+        self._lastSave = time.monotonic()
+
+    def _update(self, force=True, **fields):
+        with _lock:
+            self.record.update(fields)
+            if force or time.monotonic()-self._lastSave >= 1:
+                self._save()
+
+    def progress(self, done, total=None, message=None):
+        """Report progress.
+
+        The record is written at most once per second.
+
+        Parameters
+        ----------
+        done : int
+            Number of processed items
+        total : int, optional
+            Total number of items. The default is None (unchanged).
+        message : str, optional
+            Status message. The default is None (unchanged).
+        """
+        progress = {"done": done, "total": self.record["progress"]["total"] if total is None else total}
+        fields = {"progress": progress}
+        if message is not None:
+            fields["message"] = message
+        self._update(False, **fields)
+
+    def cancelled(self):
+        """Check whether cancellation of the job was requested.
+
+        Returns
+        -------
+        bool
+            True if the job should stop
+        """
+        if not self._cancelled:
+            path = _path(self.ID, ".cancel")
+            self._cancelled = path is not None and os.path.exists(path)
+        return self._cancelled
+
+
+def _cleanup():
+    """Remove records of jobs finished more than `jobs.retention` seconds ago."""
+    global _lastCleanup
+    now = time.time()
+    if now-_lastCleanup < 3600:
+        return
+    _lastCleanup = now
+    retention = Config["jobs"]["retention"]
+    for jobID, job in list(_jobs.items()):
+        if job.record["finished"] is not None and now-job.record["finished"] > retention:
+            _jobs.pop(jobID, None)
+    jobDir = _jobDir()
+    if jobDir is None:
+        return
+    try:
+        entries = list(os.scandir(jobDir))
+    except FileNotFoundError:
+        return
+    for entry in entries:
+        try:
+            if now-entry.stat().st_mtime > retention:
+                os.unlink(entry.path)
+        except OSError:
+            pass
+
+
+def _run(job, func, args, kwargs):
+    """Execute job function. Runs in a pool thread."""
+    if job.cancelled():
+        job._update(status=CANCELLED, finished=time.time())
+        return
+    job._update(status=RUNNING, started=time.time())
+    try:
+        with API.app_context(), tracing.span("Job "+job.record["type"]):
+            result = func(job, *args, **kwargs)
+        status = CANCELLED if job.cancelled() else COMPLETED
+        job._update(status=status, result=result, finished=time.time())
+    except BaseException as err:
+        API.logger.error(traceback.format_exc())
+        job._update(status=FAILED, message="Job failed: "+" - ".join(str(arg) for arg in err.args),
+                    finished=time.time())
+    finally:
+        path = _path(job.ID, ".cancel")
+        if path is not None and os.path.exists(path):
+            os.unlink(path)
+
+
+def submit(jobType, func, *args, owner=None, **kwargs):
+    """Submit background job.
+
+    Parameters
+    ----------
+    jobType : str
+        Name of the job type
+    func : Callable
+        Job function. Called with the job object and all additional arguments.
+    owner : str, optional
+        Name of the user submitting the job. The default is None.
+
+    Returns
+    -------
+    Job
+        The job object
+    """
+    global _executor
+    job = Job(jobType, owner)
+    with _lock:
+        _cleanup()
+        _jobs[job.ID] = job
+        job._save()
+        if _executor is None:
+            _executor = ThreadPoolExecutor(Config["jobs"]["workers"], "job")
+    _executor.submit(_run, job, func, args, kwargs)
+    return job
+
+
+def get(jobID):
+    """Load job record.
+
+    Parameters
+    ----------
+    jobID : str
+        ID of the job
+
+    Returns
+    -------
+    dict
+        Job record or None if the job does not exist
+    """
+    with _lock:
+        job = _jobs.get(jobID)
+        if job is not None:
+            return dict(job.record)
+    path = _path(jobID)
+    if path is None or not jobID.isalnum():
+        return None
+    try:
+        with open(path) as file:
+            record = json.load(file)
+    except (FileNotFoundError, ValueError):
+        return None
+    if record["status"] in (QUEUED, RUNNING) and not _alive(record["pid"]):
+        record["status"] = FAILED
+        record["message"] = "Job was interrupted"
+    return record
+
+
+def cancel(jobID):
+    """Request cancellation of a job.
+
+    The job stops at the next cancellation check of the job function.
+
+    Parameters
+    ----------
+    jobID : str
+        ID of the job
+
+    Returns
+    -------
+    bool
+        True if cancellation was requested, False if the job is already finished or cancellation is not possible
+    """
+    record = get(jobID)
+    if record is None or record["status"] not in (QUEUED, RUNNING):
+        return False
+    job = _jobs.get(jobID)
+    if job is not None:
+        job._cancelled = True
+        return True
+    path = _path(jobID, ".cancel")
+    if path is None:
+        return False
+    with open(path, "w"):
+        pass
+    return True
+
+
+def accepted(job, message="Job submitted"):
+    """Create response for a submitted job.
+
+    Parameters
+    ----------
+    job : Job
+        The submitted job
+    message : str, optional
+        Message to return. The default is "Job submitted".
+
+    Returns
+    -------
+    flask.Response
+        HTTP 202 response containing the job ID and its status location
+    """
+    response = jsonify(message=message, jobID=job.ID)
+    response.status_code = 202
+    response.headers["Location"] = BaseRoute+"/system/jobs/"+job.ID
+    return response
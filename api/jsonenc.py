@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# SPDX-FileCopyrightText: 2021 grammm GmbH
+"""
+JSON serialization backend for API responses.
+
+If available and enabled by `options.jsonBackend`, orjson is used to serialize responses, otherwise the standard library
+encoder is used. Both backends produce equivalent output:
+    - datetime objects are formatted as `YYYY-MM-DD HH:MM:SS`, date objects as `YYYY-MM-DD`
+    - bytes are base64 encoded
+
+The encoder is installed as Flask JSON encoder, so `flask.jsonify` uses the configured backend as well. `jsonify` from
+this module additionally avoids converting the serialized data to `str` and back, which is preferable for large responses.
+"""
+
+import json
+import logging
+
+from base64 import b64encode
+from datetime import date, datetime
+from flask import current_app, g
+from flask.json import JSONEncoder as FlaskJSONEncoder
+from time import perf_counter
+
+from tools.config import Config
+from tools.timing import nullTimer
+
+orjson = None
+if Config["options"]["jsonBackend"] != "stdlib":
+    try:
+        import orjson
+    except ImportError:
+        if Config["options"]["jsonBackend"] == "orjson":
+            logging.warn("orjson JSON backend requested but not installed - using standard library")
+
+
+def default(obj):
+    """Convert objects not natively supported by the JSON encoder.
+
+    Parameters
+    ----------
+    obj : Any
+        Object to convert
+
+    Returns
+    -------
+    str
+        Serializable representation of the object
+
+    Raises
+    ------
+    TypeError
+        The object type is not supported
+    """
+    if isinstance(obj, datetime):
+        return obj.strftime("%Y-%m-%d %H:%M:%S")
+    if isinstance(obj, date):
+        return obj.strftime("%Y-%m-%d")
+    if isinstance(obj, (bytes, bytearray, memoryview)):
+        return b64encode(obj).decode("ascii")
+    raise TypeError("Object of type {} is not JSON serializable".format(type(obj).__name__))
+
+
+class _StdlibEncoder(FlaskJSONEncoder):
+    def default(self, o):
+        try:
+            return default(o)
+        except TypeError:
+            return super().default(o)
+
+
+if orjson is not None:
+    _orjsonOptions = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+    _orjsonDefault = _StdlibEncoder().default
+
+
+def _encode(obj, indent, sortKeys):
+    if orjson is not None:
+        options = _orjsonOptions
+        if indent:
+            options |= orjson.OPT_INDENT_2
+        if sortKeys:
+            options |= orjson.OPT_SORT_KEYS
+        try:
+            return orjson.dumps(obj, default=_orjsonDefault, option=options)
+        except orjson.JSONEncodeError:  # e.g. integers exceeding 64 bit, retry with standard library
+            pass
+    return json.dumps(obj, cls=_StdlibEncoder, indent=indent, sort_keys=sortKeys, ensure_ascii=False,
+                      separators=None if indent else (",", ":")).encode("utf-8")
+
+
+def dumps(obj, indent=None, sortKeys=False):
+    """Serialize object to UTF-8 encoded JSON.
+
+    The time needed is recorded as `json` phase in the request timer.
+
+    Parameters
+    ----------
+    obj : Any
+        Object to serialize
+    indent : int, optional
+        Pretty print with indentation (orjson always uses 2 spaces). The default is None.
+    sortKeys : bool, optional
+        Whether to sort dictionary keys. The default is False.
+
+    Returns
+    -------
+    bytes
+        JSON document
+    """
+    start = perf_counter()
+    try:
+        return _encode(obj, indent, sortKeys)
+    finally:
+        g.get("timer", nullTimer).add("json", perf_counter()-start)
+
+
+def jsonify(*args, **kwargs):
+    """Create JSON response.
+
+    Drop-in replacement for `flask.jsonify` using the configured JSON backend.
+
+    Returns
+    -------
+    flask.Response
+        Response object containing the serialized data
+    """
+    if args and kwargs:
+        raise TypeError("jsonify() behavior undefined when passed both args and kwargs")
+    data = args[0] if len(args) == 1 else args or kwargs
+    indent = 2 if current_app.config["JSONIFY_PRETTYPRINT_REGULAR"] or current_app.debug else None
+    return current_app.response_class(dumps(data, indent, current_app.config["JSON_SORT_KEYS"])+b"\n",
+                                      mimetype=current_app.config["JSONIFY_MIMETYPE"])
+
+
+class JSONEncoder(_StdlibEncoder):
+    """Flask JSON encoder using the configured backend."""
+
+    def encode(self, o):
+        return dumps(o, self.indent, self.sort_keys).decode("utf-8")
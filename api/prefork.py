@@ -0,0 +1,296 @@
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# SPDX-FileCopyrightText: 2021 grammm GmbH
+"""
+Pre-forking multi-process server.
+
+The master process binds the listening socket, imports all endpoints, compiles the OpenAPI validators and configures
+the ORM mappers before forking the workers. Objects created up to that point are moved to the permanent generation
+(`gc.freeze()`, Python 3.7+), so the garbage collector does not touch them and the memory pages stay shared between
+the processes.
+
+Each worker serves requests with a threaded werkzeug server on the shared socket.
+
+Signals handled by the master:
+    - SIGTERM, SIGINT: graceful shutdown, workers finish their current requests
+    - SIGHUP: rolling restart, workers are replaced one at a time. As the application is loaded by the master,
+      code changes require a full restart.
+"""
+
+import gc
+import logging
+import os
+import select
+import shutil
+import signal
+import socket
+import tempfile
+import threading
+import time
+
+from tools.config import Config
+
+
+def preload():
+    """Import and initialize everything that can be shared between workers."""
+    from api.core import precompileValidators
+    import endpoints
+    import importlib
+    for group in endpoints.__all__:
+        importlib.import_module("endpoints."+group)
+    precompileValidators()
+    try:
+        from sqlalchemy.orm import configure_mappers
+        configure_mappers()
+    except Exception as err:
+        logging.warn("Failed to configure ORM mappers: {}".format(err))
+
+
+def _postFork():
+    """Re-create resources that must not be shared with the parent process."""
+    from orm import DB
+    from tools import ldap
+    if DB is not None:
+        from api.core import API
+        with API.app_context():
+            DB.engine.dispose()
+    if ldap.LDAP_available:
+        error = ldap.reloadConfig(ldap.ldapconf)
+        if error:
+            logging.warn("Failed to reconnect to LDAP: "+error)
+
+
+class _Worker:
+    __slots__ = ("pid", "ready")
+
+    def __init__(self, pid, ready):
+        self.pid = pid
+        self.ready = ready
+
+
+class PreforkServer:
+    """Pre-forking server master."""
+
+    def __init__(self, app, host, port, workers, timeout=30):
+        """Initialize server.
+
+        Parameters
+        ----------
+        app : flask.Flask
+            Application to serve
+        host : str
+            Address to bind to
+        port : int
+            Port to bind to
+        workers : int
+            Number of worker processes
+        timeout : int, optional
+            Seconds to wait for workers to start or finish their requests before they are killed. The default is 30.
+        """
+        self.app = app
+        self.host = host
+        self.port = port
+        self.numWorkers = workers
+        self.timeout = timeout
+        self.workers = {}
+        self.socket = None
+        self._stopping = False
+        self._reload = False
+        self._metricsDir = None
+
+    def _bind(self):
+        family = socket.AF_INET6 if ":" in self.host else socket.AF_INET
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((self.host, self.port))
+        sock.listen(socket.SOMAXCONN)
+        sock.setblocking(False)  # Idle workers must not block in accept() when another worker got the connection
+        self.socket = sock
+
+    def _handleStop(self, signum, frame):
+        self._stopping = True
+
+    def _handleReload(self, signum, frame):
+        self._reload = True
+
+    def _spawn(self):
+        """Fork a new worker.
+
+        Returns
+        -------
+        _Worker
+            The new worker
+        """
+        readFd, writeFd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(readFd)
+            code = 1
+            try:
+                code = self._workerMain(writeFd)
+            except BaseException:
+                logging.exception("Worker failed")
+            finally:
+                logging.shutdown()
+                os._exit(code)
+        os.close(writeFd)
+        worker = _Worker(pid, readFd)
+        self.workers[pid] = worker
+        logging.info("Started worker {}".format(pid))
+        return worker
+
+    def _workerMain(self, readyFd):
+        from werkzeug.serving import make_server
+        stopping = []
+        signal.signal(signal.SIGTERM, lambda signum, frame: stopping.append(signum))
+        signal.signal(signal.SIGINT, signal.SIG_IGN)  # Terminal interrupt is handled by the master
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        _postFork()
+        server = make_server(self.host, self.port, self.app, threaded=True, fd=self.socket.fileno())
+        server.daemon_threads = False  # Finish running requests on shutdown
+        thread = threading.Thread(target=self._serve, args=(server,), daemon=True)
+        thread.start()
+        os.write(readyFd, b"1")
+        os.close(readyFd)
+        while not stopping and thread.is_alive():
+            time.sleep(0.5)
+        if not thread.is_alive():  # Server loop failed, shutdown() would wait for it forever
+            server.server_close()
+            return 1
+        server.shutdown()
+        server.server_close()
+        return 0
+
+    @staticmethod
+    def _serve(server):
+        """Run server loop, logging unexpected errors.
+
+        The poll interval is not passed, as older werkzeug versions do not accept any arguments.
+        """
+        try:
+            server.serve_forever()
+        except BaseException:
+            logging.exception("Server loop failed")
+
+    def _waitReady(self, worker):
+        """Wait until the worker is ready to accept requests.
+
+        Returns
+        -------
+        bool
+            True if the worker became ready, False otherwise
+        """
+        if worker.ready is None:
+            return False
+        try:
+            readable, _, _ = select.select([worker.ready], [], [], self.timeout)
+            return bool(readable) and os.read(worker.ready, 1) == b"1"
+        except OSError:
+            return False
+        finally:
+            os.close(worker.ready)
+            worker.ready = None
+
+    def _reap(self):
+        """Collect terminated workers.
+
+        Returns
+        -------
+        list of int
+            PIDs of the terminated workers
+        """
+        reaped = []
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                break
+            worker = self.workers.pop(pid, None)
+            if worker is not None:
+                if worker.ready is not None:
+                    os.close(worker.ready)
+                    worker.ready = None
+                reaped.append(pid)
+        return reaped
+
+    def _stopWorker(self, pid):
+        """Gracefully stop a worker and wait until it terminated."""
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+        deadline = time.monotonic()+self.timeout
+        while pid in self.workers and time.monotonic() < deadline:
+            self._reap()
+            time.sleep(0.1)
+        if pid in self.workers:
+            logging.warn("Worker {} did not stop in time - killing".format(pid))
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            os.waitpid(pid, 0)
+            self.workers.pop(pid)
+
+    def _rollingRestart(self):
+        """Replace all workers, one at a time."""
+        logging.info("Rolling restart of {} workers".format(len(self.workers)))
+        for pid in list(self.workers):
+            if self._stopping:
+                return
+            worker = self._spawn()
+            if not self._waitReady(worker):
+                logging.error("Replacement worker {} failed to start - aborting restart".format(worker.pid))
+                return
+            self._stopWorker(pid)
+        logging.info("Rolling restart complete")
+
+    def _shutdown(self):
+        logging.info("Shutting down")
+        for pid in list(self.workers):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for pid in list(self.workers):
+            self._stopWorker(pid)
+
+    def _setupMetrics(self):
+        """Use private metrics directory if none is configured, so metrics of all workers are aggregated."""
+        if Config["options"].get("metricsDir") is None:
+            self._metricsDir = Config["options"]["metricsDir"] = tempfile.mkdtemp(prefix="grammm-admin-metrics-")
+
+    def run(self):
+        """Run the server until it is stopped by a signal."""
+        self._bind()
+        self._setupMetrics()
+        gc.collect()
+        if hasattr(gc, "freeze"):
+            gc.freeze()
+        signal.signal(signal.SIGTERM, self._handleStop)
+        signal.signal(signal.SIGINT, self._handleStop)
+        signal.signal(signal.SIGHUP, self._handleReload)
+        logging.info("Listening on {}:{} with {} workers (master pid {})"
+                    .format(self.host, self.port, self.numWorkers, os.getpid()))
+        try:
+            for _ in range(self.numWorkers):
+                self._spawn()
+            for worker in list(self.workers.values()):
+                self._waitReady(worker)
+            while not self._stopping:
+                for pid in self._reap():
+                    logging.warn("Worker {} died unexpectedly".format(pid))
+                if self._reload:
+                    self._reload = False
+                    self._rollingRestart()
+                while len(self.workers) < self.numWorkers and not self._stopping:
+                    if not self._waitReady(self._spawn()):
+                        break  # Retry in the next iteration instead of forking in a tight loop
+                time.sleep(0.5)
+        finally:
+            self._shutdown()
+            self.socket.close()
+            if self._metricsDir is not None:
+                shutil.rmtree(self._metricsDir, ignore_errors=True)
@@ -3,25 +3,338 @@
 # SPDX-FileCopyrightText: 2020 grammm GmbH
 
 from flask import request
-import time
+import hashlib
 import jwt
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
 
-from tools import ldap
+from tools import changes, ldap, passwords
 from tools.config import Config
+from tools.permissions import Permissions, DomainAdminPermission, SystemAdminPermission
+
+_signingKey = None  # (Key ID, algorithm, private key)
+_verificationKeys = {}  # Key ID -> (algorithm, public key)
+_keyStamp = None  # Identity of the loaded key files
+_keyChecked = 0
+_keyCheckInterval = 10
+
+_tokenCache = OrderedDict()  # Token hash -> verified claims
+_tokenCacheLock = threading.Lock()
+
+
+_userCache = OrderedDict()  # Username -> _CachedUser
+_userCacheLock = threading.Lock()
+_roleTables = ("admin_roles", "admin_role_permission_relation", "admin_user_role_relation")
+_userTables = ("users",)+_roleTables
+
+
+def _afterFork():
+    global _tokenCacheLock, _userCacheLock
+    _tokenCacheLock = threading.Lock()
+    _userCacheLock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_afterFork)
+
+def _keyFileStamp():
+    stamp = []
+    for key in ("jwtPrivateKeyFile", "jwtPublicKeyFile", "jwtPreviousPublicKeyFile"):
+        try:
+            stat = os.stat(Config["security"][key])
+            stamp.append((stat.st_ino, stat.st_size, stat.st_mtime))
+        except (KeyError, TypeError, OSError):
+            stamp.append(None)
+    return stamp
+
+
+def _readKey(path, algorithm):
+    """Load key file.
+
+    Parameters
+    ----------
+    path : str
+        Path to the PEM encoded key
+    algorithm : str
+        JWT algorithm the key is used with
+
+    Returns
+    -------
+    str
+        Key ID, derived from the key file content
+    object
+        Key prepared for the algorithm
+    """
+    with open(path, "rb") as file:
+        data = file.read()
+    algorithms = jwt.algorithms.get_default_algorithms()
+    if algorithm not in algorithms:
+        raise ValueError("Unsupported JWT algorithm '{}'".format(algorithm))
+    return hashlib.sha256(data).hexdigest()[:16], algorithms[algorithm].prepare_key(data)
+
+
+def _loadKeys():
+    """Load JWT keys if the key files changed.
+
+    Tokens are signed with the private key (`security.jwtPrivateKeyFile`) using `security.jwtAlgorithm`. Tokens signed
+    with the current public key or, during key rotation, the previous one (`security.jwtPreviousPublicKeyFile`) are
+    accepted.
+
+    The key files are checked at most every 10 seconds. If they changed, the keys are reloaded and the token cache is
+    cleared, so tokens signed with a retired key are no longer accepted.
+    """
+    global _signingKey, _verificationKeys, _keyStamp, _keyChecked
+    now = time.monotonic()
+    if _keyStamp is not None and now-_keyChecked < _keyCheckInterval:
+        return
+    _keyChecked = now
+    stamp = _keyFileStamp()
+    if stamp == _keyStamp:
+        return
+    security = Config["security"]
+    algorithm = security["jwtAlgorithm"]
+    try:
+        _, privkey = _readKey(security["jwtPrivateKeyFile"], algorithm)
+        keyID, pubkey = _readKey(security["jwtPublicKeyFile"], algorithm)
+        verificationKeys = {keyID: (algorithm, pubkey)}
+        if security.get("jwtPreviousPublicKeyFile"):
+            previousID, previous = _readKey(security["jwtPreviousPublicKeyFile"], security["jwtPreviousAlgorithm"])
+            verificationKeys.setdefault(previousID, (security["jwtPreviousAlgorithm"], previous))
+    except Exception as err:
+        if _keyStamp is None:
+            logging.error("Could not load JWT keys, authentication will not work: {}".format(err))
+        else:
+            logging.error("Could not reload JWT keys, keeping current keys: {}".format(err))
+        _keyStamp = stamp
+        return
+    with _tokenCacheLock:
+        _signingKey = (keyID, algorithm, privkey)
+        _verificationKeys = verificationKeys
+        _tokenCache.clear()
+    if _keyStamp is not None:
+        logging.info("JWT keys reloaded")
+    _keyStamp = stamp
+
+
+def _decode(token):
+    """Verify token signature and decode claims.
+
+    The verification key is selected by the `kid` header. Tokens without key ID are checked against all keys using the
+    algorithm of the token.
+
+    Raises
+    ------
+    jwt.InvalidTokenError
+        The token is invalid
+    """
+    header = jwt.get_unverified_header(token)
+    if "kid" in header:
+        keys = [_verificationKeys[header["kid"]]] if header["kid"] in _verificationKeys else []
+    else:
+        keys = [key for key in _verificationKeys.values() if key[0] == header.get("alg")]
+    if not keys:
+        raise jwt.InvalidSignatureError("Unknown signing key")
+    for algorithm, key in keys[:-1]:
+        try:
+            return jwt.decode(token, key, algorithms=[algorithm])
+        except jwt.InvalidSignatureError:
+            pass
+    return jwt.decode(token, keys[-1][1], algorithms=[keys[-1][0]])
+
+
+_loadKeys()
+
+
+class _CachedUser:
+    """Identity and permissions of a user, shared between requests."""
+
+    __slots__ = ("ID", "username", "domainID", "permissions", "counters", "loaded")
+
+    def __init__(self, ID, username, domainID, permissions, counters, age=0):
+        self.ID = ID
+        self.username = username
+        self.domainID = domainID
+        self.permissions = permissions
+        self.counters = counters
+        self.loaded = time.monotonic()-age
+
+
+class AuthUser:
+    """Authenticated user of the current request.
+
+    ID, username, domain ID and permissions are served from the user cache. All other attributes are forwarded to the
+    `Users` object, which is loaded from the database on first access.
+    """
+
+    def __init__(self, cached, user=None):
+        object.__setattr__(self, "_cached", cached)
+        object.__setattr__(self, "_user", user)
+
+    @property
+    def ID(self):
+        return self._cached.ID
+
+    @property
+    def username(self):
+        return self._cached.username
+
+    @property
+    def domainID(self):
+        return self._cached.domainID
+
+    def permissions(self):
+        return self._cached.permissions
+
+    @property
+    def orm(self):
+        """Return the database object of the user."""
+        if self._user is None:
+            from orm.users import Users
+            user = Users.query.filter(Users.ID == self._cached.ID).first()
+            if user is None:
+                raise ValueError("User '{}' does not exist anymore".format(self._cached.username))
+            object.__setattr__(self, "_user", user)
+        return self._user
+
+    def __getattr__(self, name):
+        return getattr(self.orm, name)
+
+    def __setattr__(self, name, value):
+        setattr(self.orm, name, value)
+
+
+def invalidateUserCache():
+    """Remove all users from the user cache of the current process and increment the role version.
+
+    Must be called after modifying users, roles or role assignments. Other processes detect the modification through
+    the change counters or, if these are not available, after `security.userCacheLifetime` seconds.
+    """
+    with _userCacheLock:
+        _userCache.clear()
+    changes.increment("admin_user_role_relation")
 
-try:
-    with open(Config["security"]["jwtPrivateKeyFile"], "rb") as file:  # Private key for JWT signing
-        jwtPrivkey = file.read()
-    with open(Config["security"]["jwtPublicKeyFile"], "rb") as file:  # Public key for JWT signature verification
-        jwtPubkey = file.read()
-except:
-    import logging
-    logging.error("Could not load JWT RSA keys, authentication will not work")
-    jwtPrivkey = jwtPubkey = None
+
+def _roleVersion(counters):
+    return None if counters is None else sum(counters)
+
+
+def roleVersion():
+    """Return version of users, roles and role assignments.
+
+    The version changes whenever users, roles, role permissions or role assignments are modified.
+
+    Returns
+    -------
+    int
+        Current role version or None if change counters are not available
+    """
+    return _roleVersion(changes.get(*_userTables))
+
+
+def _permissionClaims(permissions):
+    """Encode permissions as token claim.
+
+    Returns
+    -------
+    dict
+        Permission claim, or None if the permissions cannot be encoded
+    """
+    if permissions.sysadmin:
+        return {"sa": 1}
+    if any(not isinstance(permission, DomainAdminPermission) for permission in permissions):
+        return None
+    return {"d": "*"} if permissions.wildcard else {"d": sorted(permissions.domains)}
+
+
+def _decodePermissions(claim):
+    if claim.get("sa"):
+        return Permissions(SystemAdminPermission())
+    if claim.get("d") == "*":
+        return Permissions(DomainAdminPermission("*"))
+    return Permissions(*(DomainAdminPermission(domainID) for domainID in claim.get("d", ())))
+
+
+def userClaims(user, version):
+    """Create token claims for a user.
+
+    If `security.jwtPermissions` is enabled, the user's permissions are included, so requests can be authorized without
+    database access as long as users and roles do not change, but at most `security.jwtPermissionsLifetime` seconds
+    after the token was issued. If the role version is not known, the permissions are only used for
+    `security.userCacheLifetime` seconds.
+
+    Parameters
+    ----------
+    user : orm.users.Users
+        User to create claims for
+    version : int
+        Role version, obtained before the permissions of the user were loaded, or None if not available
+
+    Returns
+    -------
+    dict
+        Token claims
+    """
+    claims = {"usr": user.username}
+    if not Config["security"]["jwtPermissions"]:
+        return claims
+    permissions = _permissionClaims(user.permissions())
+    if permissions is not None:
+        claims.update(uid=user.ID, dom=user.domainID, prm=permissions, rv=version, iat=int(time.time()))
+    return claims
+
+
+def _claimsUser(claims, counters):
+    """Create user from the permission claims of a token.
+
+    Returns
+    -------
+    _CachedUser
+        User object or None if the token does not contain permissions, users or roles changed since it was issued or
+        the permissions are expired (`security.jwtPermissionsLifetime`, or `security.userCacheLifetime` if change
+        counters are not available)
+    """
+    if "rv" not in claims or claims["rv"] != _roleVersion(counters):
+        return None
+    lifetime = Config["security"]["userCacheLifetime" if counters is None else "jwtPermissionsLifetime"]
+    try:
+        age = time.time()-claims["iat"]
+        if not 0 <= age <= lifetime:
+            return None
+        return _CachedUser(claims["uid"], claims["usr"], claims["dom"], _decodePermissions(claims["prm"]), counters,
+                           age)
+    except (KeyError, TypeError, ValueError, AttributeError):
+        return None
+
+
+def _cachedUser(username):
+    """Get user from cache.
+
+    Returns
+    -------
+    _CachedUser
+        Cached user or None if the user is not cached or the entry is outdated
+    """
+    with _userCacheLock:
+        cached = _userCache.get(username)
+        if cached is None:
+            return None
+        if time.monotonic()-cached.loaded > Config["security"]["userCacheLifetime"] or \
+           cached.counters != changes.get(*_userTables):
+            _userCache.pop(username)
+            return None
+        _userCache.move_to_end(username)
+        return cached
 
 
 def getUser():
-    """Load currently logged in user from database.
+    """Load currently logged in user.
+
+    Users and their permissions are cached across requests (`security.userCacheSize`) or taken from the token claims
+    if users and roles did not change since the token was recently issued, so an authenticated request usually does not
+    need to access the database.
 
     Returns
     -------
@@ -30,14 +343,30 @@ def getUser():
     """
     if "user" in request.auth:
         return
-    from orm.users import Users
-    try:
-        user = Users.query.filter(Users.username == request.auth["claims"]["usr"]).first()
-    except:
-        return "Database error"
-    if user is None:
-        return "Invalid user"
-    request.auth["user"] = user
+    username = request.auth["claims"]["usr"]
+    cached = _cachedUser(username)
+    if cached is not None:
+        request.auth["user"] = AuthUser(cached)
+        return
+    counters = changes.get(*_userTables)
+    user = None
+    cached = _claimsUser(request.auth["claims"], counters)
+    if cached is None:
+        from orm.users import Users
+        try:
+            user = Users.query.filter(Users.username == username).first()
+            if user is None:
+                return "Invalid user"
+            cached = _CachedUser(user.ID, user.username, user.domainID, user.permissions(), counters)
+        except:
+            return "Database error"
+    cacheSize = Config["security"]["userCacheSize"]
+    if cacheSize > 0:
+        with _userCacheLock:
+            _userCache[username] = cached
+            while len(_userCache) > cacheSize:
+                _userCache.popitem(False)
+    request.auth["user"] = AuthUser(cached, user)
 
 
 def getSecurityContext(authLevel):
@@ -84,12 +413,49 @@ def mkJWT(claims):
     from tools.config import Config
     if "exp" not in claims:
         claims["exp"] = int(time.mktime(time.gmtime())+Config["security"].get("jwtExpiresAfter", 7*24*60*60))
-    return jwt.encode(claims, jwtPrivkey, "RS256")
+    _loadKeys()
+    keyID, algorithm, key = _signingKey
+    token = jwt.encode(claims, key, algorithm, headers={"kid": keyID})
+    return token.encode("ascii") if isinstance(token, str) else token
+
+
+def _cachedClaims(tokenHash):
+    """Get claims of a previously verified token.
+
+    Returns
+    -------
+    dict
+        Copy of the claims, None if the token is not cached
+    str
+        Error message if the cached token has expired
+    """
+    with _tokenCacheLock:
+        claims = _tokenCache.get(tokenHash)
+        if claims is None:
+            return None, None
+        if "exp" in claims and claims["exp"] <= time.time():
+            _tokenCache.pop(tokenHash)
+            return None, "Token has expired"
+        _tokenCache.move_to_end(tokenHash)
+        return dict(claims), None
+
+
+def _cacheClaims(tokenHash, claims):
+    cacheSize = Config["security"]["tokenCacheSize"]
+    if cacheSize <= 0 or "nbf" in claims:
+        return
+    with _tokenCacheLock:
+        _tokenCache[tokenHash] = dict(claims)
+        while len(_tokenCache) > cacheSize:
+            _tokenCache.popitem(False)
 
 
 def checkToken(token):
     """Check jwt validity.
 
+    Verified tokens are kept in an LRU cache (`security.tokenCacheSize`) until they expire, so the signature of a token
+    is only checked once per process. The cache is cleared when the keys are reloaded.
+
     Parameters
     ----------
     token : str
@@ -103,14 +469,22 @@ def checkToken(token):
         Dict containing the JWT claims if successful, error message otherwise
 
     """
+    _loadKeys()
+    tokenHash = hashlib.sha256(token.encode("utf-8") if isinstance(token, str) else token).digest()
+    claims, error = _cachedClaims(tokenHash)
+    if error:
+        return False, error
+    if claims is not None:
+        return True, claims
     try:
-        claims = jwt.decode(token, jwtPubkey, algorithms=["RS256"])
+        claims = _decode(token)
     except jwt.ExpiredSignatureError:
         return False, "Token has expired"
     except jwt.InvalidSignatureError:
         return False, "Invalid token signature"
     except:
         return False, "invalid token"
+    _cacheClaims(tokenHash, claims)
     return True, claims
 
 
@@ -123,6 +497,9 @@ def refreshToken():
     """Refresh user token.
 
     Check if the current token is valid and if the current user is still in the authorized group.
+
+    The user and its permissions are always loaded from the database, so permission claims are never carried over to the
+    new token.
     """
     from orm.users import Users
     if "grammmAuthJwt" not in request.cookies:
@@ -130,12 +507,22 @@ def refreshToken():
     success, claims = checkToken(request.cookies["grammmAuthJwt"])
     if not success:
         return
+    version = roleVersion()
     user = Users.query.filter(Users.username == claims["usr"]).first()
     if not user or not userLoginAllowed(user):
         return
-    if "exp" in claims:
-        claims.pop("exp")
-    return mkJWT(claims)
+    return mkJWT(userClaims(user, version))
+
+
+def _upgradePassword(user, password):
+    """Replace password hash of user by a hash using the configured scheme."""
+    from orm import DB
+    try:
+        user.password = password
+        DB.session.commit()
+    except Exception as err:
+        DB.session.rollback()
+        logging.warn("Could not upgrade password hash of user '{}': {}".format(user.username, err))
 
 
 def loginUser(username, password):
@@ -156,6 +543,7 @@ def loginUser(username, password):
         JWT if successful, error message otherwise.
     """
     from orm.users import Users
+    version = roleVersion()
     user: Users = Users.query.filter(Users.username == username).first()
     if user is None:
         return False, "Invalid username or password"
@@ -167,7 +555,9 @@ def loginUser(username, password):
         return False, "Invalid username or password"
     if not userLoginAllowed(user):
         return False, "Access denied"
-    return True, mkJWT({"usr": user.username})
+    if user.externID is None and passwords.needsUpdate(user.password):
+        _upgradePassword(user, password)
+    return True, mkJWT(userClaims(user, version))
 
 
 def checkPermissions(*requested):
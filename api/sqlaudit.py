@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# SPDX-FileCopyrightText: 2021 grammm GmbH
+"""
+SQL statement budget and N+1 query detection.
+
+Intended for development and testing. If `sqlAudit.mode` is set, the SQL statements of each request are counted and
+grouped by shape (the statement with literals and parameter lists normalized). A request violates the audit if
+    - it executes more statements than its budget (`sqlAudit.budgets[<endpoint>]` or `sqlAudit.budget`), or
+    - the same shape is executed at least `sqlAudit.repeatThreshold` times, which usually indicates lazy loading of
+      a relationship inside a loop (N+1 queries)
+
+In `warn` mode, violations are logged and reported in the `X-SQL-Audit` response header. In `fail` mode, the
+response is replaced by a HTTP 500 error describing the violation.
+
+Statements executed while a streamed response is generated (see `endpoints.streamList`) run after the response headers
+have been sent. They are checked by `auditStream` once the stream is complete, and violations can only be logged.
+"""
+
+import json
+import re
+
+from flask import g, request
+
+from tools.config import Config
+
+from .jsonenc import jsonify
+
+_paramListRe = re.compile(r"\(\s*(?:%s|\?|:\w+)(?:\s*,\s*(?:%s|\?|:\w+))*\s*\)")
+_literalRe = re.compile(r"'(?:[^']|'')*'|\b\d+\b")
+_spaceRe = re.compile(r"\s+")
+
+
+def enabled():
+    """Return whether SQL auditing is enabled."""
+    return Config["sqlAudit"]["mode"] is not None
+
+
+def statementShape(statement):
+    """Normalize statement, so executions differing only in parameters have the same shape.
+
+    Parameters
+    ----------
+    statement : str
+        SQL statement
+
+    Returns
+    -------
+    str
+        Normalized statement
+    """
+    statement = _literalRe.sub("?", statement)
+    statement = _paramListRe.sub("(...)", statement)
+    return _spaceRe.sub(" ", statement).strip()
+
+
+def _violations(sqlLog):
+    config = Config["sqlAudit"]
+    budget = config["budgets"].get(request.endpoint, config["budget"])
+    violations = {}
+    if budget is not None and sqlLog["count"] > budget:
+        violations["budget"] = {"limit": budget, "statements": sqlLog["count"]}
+    repeated = [{"shape": shape, "count": count} for shape, count in sqlLog["shapes"].most_common()
+                if count >= config["repeatThreshold"]]
+    if repeated:
+        violations["repeated"] = repeated
+    return violations
+
+
+def auditRequest(response):
+    """Check SQL statements of the current request against the audit limits.
+
+    Parameters
+    ----------
+    response : flask.Response
+        The response
+
+    Returns
+    -------
+    flask.Response
+        The response, or an error response if the request violates the limits in `fail` mode
+    """
+    sqlLog = g.get("sqlLog")
+    if sqlLog is None or sqlLog.get("shapes") is None:
+        return response
+    sqlLog["audited"] = sqlLog["count"]
+    violations = _violations(sqlLog)
+    if not violations:
+        return response
+    from .core import API
+    message = "SQL audit failed for {} {}: {}".format(request.method, request.endpoint, json.dumps(violations))
+    if Config["sqlAudit"]["mode"] == "fail":
+        API.logger.error(message)
+        error = jsonify(message="SQL audit failed", violations=violations)
+        error.status_code = 500
+        return error
+    API.logger.warn(message)
+    response.headers["X-SQL-Audit"] = ", ".join(violations)
+    return response
+
+
+def auditStream():
+    """Check SQL statements of the current request after a streamed response has been generated.
+
+    Only statements executed after `auditRequest` are considered new. If there are any and the request violates the
+    audit limits, the violation is logged.
+    """
+    sqlLog = g.get("sqlLog")
+    if sqlLog is None or sqlLog.get("shapes") is None or sqlLog["count"] == sqlLog.get("audited"):
+        return
+    sqlLog["audited"] = sqlLog["count"]
+    violations = _violations(sqlLog)
+    if violations:
+        from .core import API
+        message = "SQL audit failed for streamed {} {}: {}".format(request.method, request.endpoint,
+                                                                   json.dumps(violations))
+        (API.logger.error if Config["sqlAudit"]["mode"] == "fail" else API.logger.warn)(message)
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# SPDX-FileCopyrightText: 2021 grammm GmbH
+"""
+OpenAPI validators with per-operation caching.
+
+The stock openapi-core validators resolve the operation by matching the request against every path in the specification
+and build a new schema validator for every (sub-)schema on every call. The validators defined here remember the resolved
+operation for each URL pattern and method and re-use the schema unmarshallers, which can be compiled in advance by calling
+`precompile`.
+
+Schema validators prepare their copy of the schema once instead of on every call.
+
+Validation results, including the types of reported errors, are identical to the stock validators.
+"""
+
+from copy import deepcopy
+from flask import has_request_context, request as flaskRequest
+from urllib.parse import urlsplit
+
+from openapi_core.shortcuts import RequestValidator, ResponseValidator
+
+try:
+    from openapi_schema_validator import OAS30Validator
+    from openapi_core.validation.validators import BaseValidator
+    from openapi_core.unmarshalling.schemas.enums import UnmarshalContext
+    from openapi_core.unmarshalling.schemas.factories import SchemaUnmarshallersFactory
+except ImportError:  # openapi-core < 0.13 does not provide the required hooks
+    BaseValidator = SchemaUnmarshallersFactory = None
+
+
+if SchemaUnmarshallersFactory is not None:
+    class _PreparedValidator(OAS30Validator):
+        """Schema validator copying the schema only once.
+
+        The stock validator copies the schema on every call to protect it from being modified by the validation.
+        """
+
+        def __init__(self, schema, *args, **kwargs):
+            super().__init__(schema, *args, **kwargs)
+            self._prepared = deepcopy(schema)
+            self._prepared.setdefault("nullable", False)
+
+        def iter_errors(self, instance, _schema=None):
+            return super().iter_errors(instance, self._prepared if _schema is None else _schema)
+
+    class _CachingUnmarshallersFactory(SchemaUnmarshallersFactory):
+        """Unmarshaller factory returning the same unmarshaller for repeated requests of the same schema.
+
+        Unmarshallers do not hold any per-call state, so they can be shared safely.
+        """
+
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self._cache = {}
+
+        def create(self, schema, type_override=None):
+            key = (id(schema), type_override)
+            unmarshaller = self._cache.get(key)
+            if unmarshaller is None:
+                unmarshaller = self._cache[key] = super().create(schema, type_override)
+            return unmarshaller
+
+        def get_validator(self, schema):
+            kwargs = {"resolver": self.resolver, "format_checker": self.format_checker}
+            if self.context is not None:
+                kwargs[self.CONTEXT_VALIDATION[self.context]] = True
+            return _PreparedValidator(schema.__dict__, **kwargs)
+
+    class _OperationCache(BaseValidator):
+        """Validator base caching path lookup and schema unmarshallers.
+
+        Must be placed after the concrete validator class in the list of bases, so that the context specific `_unmarshal`
+        implementations of the request and response validators delegate here.
+        """
+
+        maxPaths = 4096  # Maximum number of cached path lookups
+
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self._paths = {}
+            self._factories = {}
+
+        @staticmethod
+        def _pathKey(request):
+            """Return cache key of the request's route or None if the request did not match any route.
+
+            The key must not contain the host, as clients could otherwise fill the cache with arbitrary host names.
+            Outside of a request context (asynchronous response validation), the path pattern of the route is used.
+            """
+            if not has_request_context():
+                return urlsplit(request.full_url_pattern).path, request.method
+            rule = flaskRequest.url_rule
+            return None if rule is None else (rule.rule, request.method)
+
+        def _find_path(self, request):
+            key = self._pathKey(request)
+            result = self._paths.get(key)
+            if result is None:
+                result = super()._find_path(request)
+                if key is not None and len(self._paths) < self.maxPaths:
+                    self._paths[key] = result
+            return result
+
+        def _unmarshallers(self, context):
+            factory = self._factories.get(context)
+            if factory is None:
+                factory = self._factories[context] = _CachingUnmarshallersFactory(self.spec._resolver, self.format_checker,
+                                                                                  self.custom_formatters, context=context)
+            return factory
+
+        def _unmarshal(self, param_or_media_type, value, context):
+            if not param_or_media_type.schema:
+                return value
+            return self._unmarshallers(context).create(param_or_media_type.schema)(value)
+
+        def _compileSchema(self, schema, context, seen):
+            """Recursively create unmarshallers for a schema and all of its sub-schemas."""
+            if schema is None or id(schema) in seen:
+                return
+            seen.add(id(schema))
+            try:
+                self._unmarshallers(context).create(schema)
+            except Exception:  # Unknown formats etc. are reported when the schema is actually used
+                pass
+            subschemas = list(schema.properties.values())+schema.one_of+schema.all_of+[schema.items]
+            if not isinstance(schema.additional_properties, bool):
+                subschemas.append(schema.additional_properties)
+            for subschema in subschemas:
+                self._compileSchema(subschema, context, seen)
+
+    class CachedRequestValidator(RequestValidator, _OperationCache):
+        def precompile(self):
+            """Create unmarshallers for all request parameters and bodies in the specification."""
+            seen = set()
+            for path in self.spec.paths.values():
+                for operation in path.operations.values():
+                    for param in list(path.parameters.values())+list(operation.parameters.values()):
+                        self._compileSchema(param.schema, UnmarshalContext.REQUEST, seen)
+                    if operation.request_body is not None:
+                        for mediaType in (operation.request_body.content or {}).values():
+                            self._compileSchema(mediaType.schema, UnmarshalContext.REQUEST, seen)
+
+    class CachedResponseValidator(ResponseValidator, _OperationCache):
+        def precompile(self):
+            """Create unmarshallers for all response bodies in the specification."""
+            seen = set()
+            for path in self.spec.paths.values():
+                for operation in path.operations.values():
+                    for response in operation.responses.values():
+                        for mediaType in (response.content or {}).values():
+                            self._compileSchema(mediaType.schema, UnmarshalContext.RESPONSE, seen)
+else:
+    class CachedRequestValidator(RequestValidator):
+        def precompile(self):
+            pass
+
+    class CachedResponseValidator(ResponseValidator):
+        def precompile(self):
+            pass
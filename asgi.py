@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# SPDX-FileCopyrightText: 2021 grammm GmbH
+"""
+ASGI entry point.
+
+Provides the API as ASGI application `application`, to be used with an ASGI server, e.g.
+    uvicorn asgi:application
+"""
+
+from api.asgi import AsgiAdapter
+from api.core import API, precompileValidators
+from endpoints import *
+from tools import config
+
+error = config.validate()
+if error:
+    raise TypeError("Invalid configuration found - aborting ({})".format(error))
+precompileValidators()
+
+application = AsgiAdapter(API)
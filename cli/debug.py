@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# SPDX-FileCopyrightText: 2021 grammm GmbH
+
+from . import Cli, ArgumentParser
+
+_importTargets = {"server": "from api.core import API\nfrom endpoints import *",
+                  "cli": "from cli import Cli"}
+
+
+def _parseImportTimes(output):
+    """Parse output of `python -X importtime`.
+
+    Parameters
+    ----------
+    output : str
+        Standard error output of the profiled interpreter
+
+    Returns
+    -------
+    list of tuple
+        (self time [us], cumulative time [us], depth, module name) for each imported module
+    list of str
+        Lines not belonging to the import time report
+    """
+    entries, other = [], []
+    for line in output.splitlines():
+        if not line.startswith("import time:"):
+            other.append(line)
+            continue
+        fields = line[12:].split("|")
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue
+        name = fields[2].rstrip()
+        depth = (len(name)-len(name.lstrip()))//2
+        entries.append((int(fields[0]), int(fields[1]), depth, name.strip()))
+    return entries, other
+
+
+def _cliImportProfile(args):
+    import subprocess
+    import sys
+    if sys.version_info < (3, 7):
+        print(Cli.col("Import profiling requires Python 3.7 or later", "red"))
+        return 1
+    code = "\n".join("import "+module for module in args.module) if args.module else _importTargets[args.target]
+    result = subprocess.run((sys.executable, "-X", "importtime", "-c", code), stdout=subprocess.DEVNULL,
+                            stderr=subprocess.PIPE, universal_newlines=True)
+    entries, other = _parseImportTimes(result.stderr)
+    if result.returncode != 0:
+        print(Cli.col("Import failed:", "red"))
+        print("\n".join(other))
+    if not entries:
+        return result.returncode or 1
+    if args.top_level:
+        entries = [entry for entry in entries if entry[2] == 0]
+    entries.sort(key=lambda entry: entry[0 if args.sort == "self" else 1], reverse=True)
+    print("{:>10} {:>10}  {}".format("self [ms]", "cumul [ms]", "module"))
+    for selfTime, cumulative, _, name in entries[:args.number]:
+        print("{:>10.1f} {:>10.1f}  {}".format(selfTime/1000, cumulative/1000, name))
+    totalTime = sum(entry[1] for entry in entries if entry[2] == 0) if args.top_level else\
+        sum(entry[0] for entry in entries)
+    print(Cli.col("Total: {:.1f} ms for {} modules".format(totalTime/1000, len(entries)), attrs=["bold"]))
+    return result.returncode
+
+
+def _benchmark(func, clients, number):
+    """Call function concurrently and measure its latency.
+
+    Parameters
+    ----------
+    func : callable
+        Function to benchmark. Must return True on success.
+    clients : int
+        Number of threads calling the function
+    number : int
+        Total number of calls
+
+    Returns
+    -------
+    list of float
+        Sorted latencies in seconds, or None if a call failed
+    float
+        Total duration in seconds
+    list of Exception
+        Exceptions raised by the function
+    """
+    import threading
+    import time
+    latencies, errors = [], []
+    lock = threading.Lock()
+
+    def client(count):
+        for _ in range(count):
+            start = time.perf_counter()
+            try:
+                success = func()
+            except Exception as err:
+                success = False
+                with lock:
+                    errors.append(err)
+            duration = time.perf_counter()-start
+            with lock:
+                latencies.append(duration if success else None)
+
+    counts = [number//clients+(1 if i < number % clients else 0) for i in range(clients)]
+    threads = [threading.Thread(target=client, args=(count,)) for count in counts]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    total = time.perf_counter()-start
+    if None in latencies:
+        return None, total, errors
+    latencies.sort()
+    return latencies, total, errors
+
+
+def _cliPasswordBenchmark(args):
+    from tools import passwords
+    from tools.config import Config
+    if args.clients < 1 or args.number < 1 or (args.workers is not None and args.workers < 1):
+        print(Cli.col("Number of clients, logins and workers must be at least 1", "red"))
+        return 1
+    config = Config["passwords"]
+    if args.workers:
+        config["workers"] = args.workers
+    config["queue"] = max(config["queue"], args.clients)
+    if args.login:
+        if args.scheme:
+            print(Cli.col("--scheme cannot be used with --login", "red"))
+            return 1
+        from getpass import getpass
+        from api.security import loginUser
+        from orm import DB
+        password = getpass("Password: ")
+
+        def func():
+            try:
+                return loginUser(args.login, password)[0]
+            finally:
+                if DB is not None:
+                    DB.session.remove()
+        what = "logins"
+        print("Login as {} ({} workers)".format(args.login, config["workers"]))
+    else:
+        if args.scheme:
+            config["scheme"] = args.scheme
+        config["maxLength"] = 255  # Nothing is stored
+        hashed = passwords.hash("benchmark")
+
+        def func():
+            return passwords.verify("benchmark", hashed)
+        what = "verifications"
+        print("Scheme {} ({} workers): {}".format(config["scheme"], config["workers"], hashed))
+    latencies, total, errors = _benchmark(func, args.clients, args.number)
+    if latencies is None:
+        print(Cli.col("Login failed" if args.login else "Password verification failed", "red"))
+        if errors:
+            print("{} errors, first: {}".format(len(errors), errors[0]))
+        return 1
+    print("{} {} by {} clients in {:.2f} s: {:.1f} {}/s, latency median {:.1f} ms, 95% {:.1f} ms, max {:.1f} ms"
+          .format(len(latencies), what, args.clients, total, len(latencies)/total, what,
+                  latencies[len(latencies)//2]*1000, latencies[int(len(latencies)*0.95)]*1000, latencies[-1]*1000))
+    return 0
+
+
+def _setupCliDebugParser(subp: ArgumentParser):
+    sub = subp.add_subparsers()
+    importProfile = sub.add_parser("import-profile", help="Measure module import times")
+    importProfile.set_defaults(_handle=_cliImportProfile)
+    importProfile.add_argument("target", nargs="?", choices=_importTargets.keys(), default="server",
+                               help="Startup to profile: 'server' imports the API and all endpoints (default), "
+                                    "'cli' imports the command line interface")
+    importProfile.add_argument("--module", "-m", action="append", help="Profile import of module instead of target")
+    importProfile.add_argument("--number", "-n", type=int, default=25, help="Number of modules to show (default: 25)")
+    importProfile.add_argument("--sort", "-s", choices=("cumulative", "self"), default="cumulative",
+                               help="Sort by cumulative (default) or self time")
+    importProfile.add_argument("--top-level", "-t", action="store_true",
+                               help="Only show modules imported directly by the target")
+    passwordBenchmark = sub.add_parser("password-benchmark", help="Measure password verification or login throughput")
+    passwordBenchmark.set_defaults(_handle=_cliPasswordBenchmark)
+    passwordBenchmark.add_argument("--login", "-l", metavar="USERNAME",
+                                   help="Measure complete logins (database, LDAP, password check and token creation) "
+                                        "of an existing user instead of password verification. The password is read "
+                                        "interactively.")
+    passwordBenchmark.add_argument("--scheme", "-s", choices=("md5", "sha512", "bcrypt", "argon2"),
+                                   help="Hashing scheme to use instead of the configured one")
+    passwordBenchmark.add_argument("--workers", "-w", type=int, help="Number of hashing threads")
+    passwordBenchmark.add_argument("--clients", "-c", type=int, default=16,
+                                   help="Number of concurrent clients (default: 16)")
+    passwordBenchmark.add_argument("--number", "-n", type=int, default=500,
+                                   help="Total number of operations (default: 500)")
+
+
+@Cli.command("debug", _setupCliDebugParser)
+def cliDebugStub(args):
+    pass
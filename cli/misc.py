@@ -10,6 +10,10 @@ def _runParserSetup(subp: ArgumentParser):
     subp.add_argument("--port", "-p", default=5001, type=int, help="Host port to bind to")
     subp.add_argument("--debug", "-d", action="store_true", help="Run in debug mode")
     subp.add_argument("--no-config-check", action="store_true", help="Skip configuration check")
+    subp.add_argument("--workers", "-w", type=int, default=0,
+                      help="Run pre-forking server with the given number of worker processes")
+    subp.add_argument("--timeout", "-t", type=int, default=30,
+                      help="Seconds to wait for workers to start or stop before they are killed (default: 30)")
 
 
 @Cli.command("run", _runParserSetup)
@@ -20,11 +24,23 @@ def cliRun(args):
         if error:
             print("Invalid configuration found: "+error)
             return 1
-    from api.core import API
+    if args.workers > 0:
+        if args.debug:
+            print("Debug mode is not supported with multiple workers")
+            return 1
+        import logging
+        from api.core import API
+        from api.prefork import PreforkServer, preload
+        logging.basicConfig(level=logging.INFO)
+        preload()
+        PreforkServer(API, args.ip, args.port, args.workers, args.timeout).run()
+        return
+    from api.core import API, precompileValidators
     import endpoints
     import importlib
     for group in endpoints.__all__:
         importlib.import_module("endpoints."+group)
+    precompileValidators()
     API.run(host=args.ip, port=args.port, debug=args.debug)
 
 
@@ -4,7 +4,7 @@
 
 __all__ = ["domain", "system", "misc"]
 
-from flask import request, jsonify
+from flask import current_app, request, stream_with_context
 from orm import DB
 from tools.DataModel import MissingRequiredAttributeError, InvalidAttributeError, MismatchROError
 from jellyfish import damerau_levenshtein_distance as dldist
@@ -12,7 +12,21 @@ import re
 
 from sqlalchemy.exc import IntegrityError
 
+from api import sqlaudit
+from api.jsonenc import dumps, jsonify
+from tools import metrics, tracing
+from tools.config import Config
+
 matchStringRe = re.compile(r"([\w\-]*)")
+streamBatchSize = 500  # Number of objects to load and serialize at once when streaming lists
+
+exmdbMetric = metrics.Histogram("grammm_admin_exmdb_call_duration_seconds", "Duration of exmdb requests", ("operation",))
+try:
+    from tools.pyexmdb import pyexmdb
+    metrics.instrument(pyexmdb.ExmdbQueries, exmdbMetric)
+    tracing.instrument(pyexmdb.ExmdbQueries, "exmdb")
+except ImportError:
+    pass
 
 
 def defaultListQuery(Model, filters=(), order=None, result="response", automatch=True, autofilter=True, autosort=True,
@@ -23,6 +37,8 @@ def defaultListQuery(Model, filters=(), order=None, result="response", automatch
 
     The return value can be influenced by `result`: `list` will return a list ob objects, while the default `response`
     will return the complete JSON encoded flask response.
+    Responses for more than `options.streamListThreshold` (or unlimited) results are streamed, unless results are ranked
+    (see below).
 
     If `automatch` is enabled, the results are filtered by prefix-matching each word against the configured columns. If no
     other sorting is active (`order` is None and no "sort" query parameter is given), the results are ranked by the
@@ -74,9 +90,12 @@ def defaultListQuery(Model, filters=(), order=None, result="response", automatch
     count = query.count() if include_count else None
     if result == "query":
         return query, limit, offset, count
+    rank = order is None and "sort" not in request.args and automatch and "match" in request.args
+    if result == "response" and not rank and streamingRequested(limit):
+        return streamList(Model, query, limit, offset, verbosity, count, include_count)
     query = query.limit(limit).offset(offset)
     objects = query.all()
-    if order is None and "sort" not in request.args and automatch and "match" in request.args:
+    if rank:
         scored = ((min(dldist(str(field).lower(), matchStr) for field in obj.matchvalues() if field is not None), obj)
                   for obj in objects)
         objects = [so[1] for so in sorted(scored, key=lambda entry: entry[0])]
@@ -91,6 +110,96 @@ def defaultListQuery(Model, filters=(), order=None, result="response", automatch
     return jsonify(resp)
 
 
+def streamingRequested(limit):
+    """Check whether a list response should be streamed.
+
+    Parameters
+    ----------
+    limit : str or int
+        Maximum number of results requested or None if unlimited
+
+    Returns
+    -------
+    bool
+        True if the limit exceeds `options.streamListThreshold`
+    """
+    threshold = Config["options"]["streamListThreshold"]
+    try:
+        return threshold is not None and (limit is None or int(limit) > threshold)
+    except ValueError:
+        return False
+
+
+def streamList(Model, query, limit, offset, verbosity, count=None, include_count="count", process=None):
+    """Create streamed JSON list response.
+
+    The primary keys of the result are fetched incrementally using a server side cursor and the objects are loaded and
+    serialized in batches of `streamBatchSize`, so memory usage does not depend on the number of results.
+    The response has the same structure as the one created by defaultListQuery.
+
+    Parameters
+    ----------
+    Model : SQLAlchemy model with DataModel extension
+        Model to perform the query on. Must have a single column primary key.
+    query : SQLAlchemy Query
+        Query returning the objects to list, including ordering
+    limit : int
+        Maximum number of objects or None
+    offset : int
+        Number of objects to skip or None
+    verbosity : int
+        Level of detail
+    count : int, optional
+        Total number of results. The default is None.
+    include_count : str, optional
+        Name of the property containing the count or None to disable. The default is "count".
+    process : Callable, optional
+        Function called with each list of serialized objects before sending. The default is None.
+
+    Returns
+    -------
+    Response
+        Flask response streaming the list data
+    """
+    column = Model.__mapper__.primary_key[0]
+    key = Model.__mapper__.get_property_by_column(column).key
+
+    def batches():
+        # Server side cursors block the connection, so keys are streamed over a separate one
+        # Joins can return a key multiple times. As with ORM queries, only the first occurrence is kept (a DISTINCT
+        # query is not possible when ordering by columns of joined tables).
+        seen = set()
+        with DB.engine.connect() as conn:
+            statement = query.with_entities(column).limit(limit).offset(offset).statement
+            result = conn.execution_options(stream_results=True).execute(statement)
+            rows = result.fetchmany(streamBatchSize)
+            while rows:
+                IDs = []
+                for row in rows:
+                    if row[0] not in seen:
+                        seen.add(row[0])
+                        IDs.append(row[0])
+                if IDs:
+                    yield IDs
+                rows = result.fetchmany(streamBatchSize)
+
+    def generate():
+        yield b'{"data":['
+        separator = b""
+        for IDs in batches():
+            objects = {getattr(obj, key): obj for obj in Model.optimize_query(Model.query.filter(column.in_(IDs)), verbosity)}
+            data = [objects[ID].todict(verbosity) for ID in IDs if ID in objects]
+            if process is not None:
+                process(data)
+            if data:
+                yield separator+dumps(data)[1:-1]
+                separator = b","
+        yield b"]"+(b","+dumps(include_count)+b":"+dumps(count) if include_count else b"")+b"}\n"
+        sqlaudit.auditStream()
+
+    return current_app.response_class(stream_with_context(generate()), mimetype=current_app.config["JSONIFY_MIMETYPE"])
+
+
 def defaultDetailQuery(Model, ID, errName, filters=()):
     """Process a detail query for specified model.
 
@@ -5,17 +5,19 @@
 import shutil
 import traceback
 
-from flask import jsonify, request
+from flask import request
 
 import api
+from api import jobs
 from api.core import API, secure
-from api.security import checkPermissions
+from api.jsonenc import jsonify
+from api.security import checkPermissions, invalidateUserCache
 
 from tools import ldap, mconf
 from tools.config import Config
 from tools.constants import ExmdbCodes
 from tools.DataModel import InvalidAttributeError, MismatchROError
-from tools.permissions import SystemAdminPermission, DomainAdminPermission
+from tools.permissions import DomainAdminPermission
 from tools.pyexmdb import pyexmdb
 from tools.storage import UserSetup
 
@@ -27,44 +29,32 @@ if DB is not None:
 
 
 @API.route(api.BaseRoute+"/ldap/search", methods=["GET"])
-@secure(requireDB=True, authLevel="user")
+@secure(requireDB=True, authLevel="user", rateLimit="ldap")
 def searchLdap():
     checkPermissions(DomainAdminPermission("*"))
     if not ldap.LDAP_available:
         return jsonify(message="LDAP is not available"), 503
     if "query" not in request.args or len(request.args["query"]) < 3:
         return jsonify(message="Missing or too short query"), 400
-    permissions = request.auth["user"].permissions()
-    if SystemAdminPermission() in permissions:
-        domainFilters = ()
-    else:
-        domainIDs = {permission.domainID for permission in permissions if isinstance(permission, DomainAdminPermission)}
-        if len(domainIDs) == 0:
-            return jsonify(data=[])
-        domainFilters = () if "*" in domainIDs else (Domains.ID.in_(domainIDs),)
+    domainIDs = request.auth["user"].permissions().domainIDs()
+    if domainIDs is not None and len(domainIDs) == 0:
+        return jsonify(data=[])
+    domainFilters = () if domainIDs is None else (Domains.ID.in_(domainIDs),)
     domainNames = [d[0] for d in Domains.query.filter(*domainFilters).with_entities(Domains.domainname).all()]\
         if len(domainFilters) else None
     ldapusers = ldap.searchUsers(request.args["query"], domainNames)
     return jsonify(data=[{"ID": ldap.escape_filter_chars(u.ID), "name": u.name, "email": u.email} for u in ldapusers])
 
 
-@API.route(api.BaseRoute+"/ldap/downsync", methods=["POST"])
-@secure(requireDB=True, authLevel="user")
-def ldapDownsyncAll():
-    checkPermissions(DomainAdminPermission("*"))
-    if not ldap.LDAP_available:
-        return jsonify(message="LDAP is not available"), 503
-    permissions = request.auth["user"].permissions()
-    if SystemAdminPermission() in permissions:
-        domainFilters = ()
-    else:
-        domainIDs = {permission.domainID for permission in permissions if isinstance(permission, DomainAdminPermission)}
-        if len(domainIDs) == 0:
-            return jsonify(data=[])
-        domainFilters = () if "*" in domainIDs else (Domains.ID.in_(domainIDs),)
+def _downsyncAll(job, domainIDs):
+    """Synchronize all LDAP imported users of the given domains (or all domains if domainIDs is None)."""
+    domainFilters = () if domainIDs is None else (Users.domainID.in_(domainIDs),)
     users = Users.optimized_query(2).filter(Users.externID != None, *domainFilters).all()
     syncStatus = []
-    for user in users:
+    for index, user in enumerate(users):
+        if job.cancelled():
+            break
+        job.progress(index, len(users))
         userdata = ldap.downsyncUser(user.externID)
         if userdata is None:
             syncStatus.append({"ID": user.ID, "username": user.username, "code": 404, "message": "LDAP object not found"})
@@ -81,11 +71,25 @@ def ldapDownsyncAll():
             API.logger.error(traceback.format_exc())
             syncStatus.append({"ID": user.ID, "username": user.username, "code": 503, "message": "Database error"})
             DB.session.rollback()
-    return jsonify(data=syncStatus)
+    job.progress(len(syncStatus), len(users))
+    return {"data": syncStatus}
+
+
+@API.route(api.BaseRoute+"/ldap/downsync", methods=["POST"])
+@secure(requireDB=True, authLevel="user", rateLimit="ldap")
+def ldapDownsyncAll():
+    checkPermissions(DomainAdminPermission("*"))
+    if not ldap.LDAP_available:
+        return jsonify(message="LDAP is not available"), 503
+    domainIDs = request.auth["user"].permissions().domainIDs()
+    if domainIDs is not None and len(domainIDs) == 0:
+        return jsonify(data=[])
+    job = jobs.submit("ldapDownsync", _downsyncAll, domainIDs, owner=request.auth["claims"]["usr"])
+    return jobs.accepted(job, "Synchronization started")
 
 
 @API.route(api.BaseRoute+"/ldap/importUser", methods=["POST"])
-@secure(requireDB=True, authLevel="user")
+@secure(requireDB=True, authLevel="user", rateLimit="ldap")
 def downloadLdapUser():
     checkPermissions(DomainAdminPermission("*"))
     if not ldap.LDAP_available:
@@ -139,7 +143,7 @@ def downloadLdapUser():
 
 
 @API.route(api.BaseRoute+"/domains/<int:domainID>/users/<int:userID>/downsync", methods=["PUT"])
-@secure(requireDB=True, authLevel="user")
+@secure(requireDB=True, authLevel="user", rateLimit="ldap")
 def updateLdapUser(domainID, userID):
     checkPermissions(DomainAdminPermission(domainID))
     if not ldap.LDAP_available:
@@ -159,30 +163,28 @@ def updateLdapUser(domainID, userID):
     return jsonify(user.fulldesc())
 
 
-@API.route(api.BaseRoute+"/ldap/check", methods=["GET", "DELETE"])
-@secure(requireDB=True, authLevel="user")
-def checkLdapUsers():
-    checkPermissions(DomainAdminPermission("*"))
-    if not ldap.LDAP_available:
-        return jsonify(message="LDAP is not available"), 503
-    permissions = request.auth["user"].permissions()
-    if SystemAdminPermission in permissions:
-        domainFilter = ()
-    else:
-        domainIDs = {permission.domainID for permission in permissions if isinstance(permission, DomainAdminPermission)}
-        domainFilter = (Users.domainID == domainID for domainID in domainIDs)
-    users = Users.query.filter(Users.externID != None, *domainFilter)\
-                       .with_entities(Users.ID, Users.username, Users.externID, Users.maildir)\
-                       .all()
-    if len(users) == 0:
-        return jsonify(message="No LDAP users found", **{"orphaned" if request.method == "GET" else "deleted": []})
-    orphaned = [user for user in users if ldap.getUserInfo(user.externID) is None]
-    if len(orphaned) == 0:
-        return jsonify(message="All LDAP users are valid", **{"orphaned" if request.method == "GET" else "deleted": []})
+def _findOrphaned(users, job=None):
+    """Return users whose LDAP object does not exist anymore."""
+    orphaned = []
+    for index, user in enumerate(users):
+        if job is not None:
+            if job.cancelled():
+                return orphaned
+            job.progress(index, len(users), "Checking users")
+        if ldap.getUserInfo(user.externID) is None:
+            orphaned.append(user)
+    return orphaned
+
+
+def _deleteOrphaned(job, users, deleteMaildirs):
+    """Delete users whose LDAP object does not exist anymore."""
+    orphaned = _findOrphaned(users, job)
+    if job.cancelled():
+        return {"deleted": []}
     orphanedData = [{"ID": user.ID, "username": user.username} for user in orphaned]
-    if request.method == "GET":
-        return jsonify(orphaned=orphanedData)
-    deleteMaildirs = request.args.get("deleteFiles") == "true"
+    if len(orphaned) == 0:
+        return {"deleted": orphanedData}
+    job.progress(0, len(orphaned), "Deleting users")
     try:
         options = Config["options"]
         client = pyexmdb.ExmdbQueries(options["exmdbHost"], options["exmdbPort"], options["domainPrefix"], True)
@@ -192,16 +194,42 @@ def checkLdapUsers():
         API.logger.error("Could not unload exmdb store: "+ExmdbCodes.lookup(err.code, hex(err.code)))
     except RuntimeError as err:
         API.logger.error("Could not unload exmdb store: "+err.args[0])
-    if deleteMaildirs:
-        for user in orphaned:
-            shutil.rmtree(user.maildir, ignore_errors=True)
     Users.query.filter(Users.ID.in_(user.ID for user in orphaned)).delete(synchronize_session=False)
     DB.session.commit()
-    return jsonify(deleted=orphanedData)
+    invalidateUserCache()
+    if deleteMaildirs:
+        for index, user in enumerate(orphaned):
+            job.progress(index, len(orphaned), "Deleting files")
+            shutil.rmtree(user.maildir, ignore_errors=True)
+    job.progress(len(orphaned), len(orphaned), "Done")
+    return {"deleted": orphanedData}
+
+
+@API.route(api.BaseRoute+"/ldap/check", methods=["GET", "DELETE"])
+@secure(requireDB=True, authLevel="user", rateLimit="ldap")
+def checkLdapUsers():
+    checkPermissions(DomainAdminPermission("*"))
+    if not ldap.LDAP_available:
+        return jsonify(message="LDAP is not available"), 503
+    domainIDs = request.auth["user"].permissions().domainIDs()
+    domainFilter = () if domainIDs is None else (Users.domainID.in_(domainIDs),)
+    users = Users.query.filter(Users.externID != None, *domainFilter)\
+                       .with_entities(Users.ID, Users.username, Users.externID, Users.maildir)\
+                       .all()
+    if len(users) == 0:
+        return jsonify(message="No LDAP users found", **{"orphaned" if request.method == "GET" else "deleted": []})
+    if request.method == "DELETE":
+        job = jobs.submit("ldapCheck", _deleteOrphaned, users, request.args.get("deleteFiles") == "true",
+                          owner=request.auth["claims"]["usr"])
+        return jobs.accepted(job, "Check started")
+    orphaned = _findOrphaned(users)
+    if len(orphaned) == 0:
+        return jsonify(message="All LDAP users are valid", orphaned=[])
+    return jsonify(orphaned=[{"ID": user.ID, "username": user.username} for user in orphaned])
 
 
 @API.route(api.BaseRoute+"/ldap/dump", methods=["GET"])
-@secure(requireDB=True, authLevel="user")
+@secure(requireDB=True, authLevel="user", rateLimit="ldap")
 def dumpLdapUsers():
     checkPermissions(DomainAdminPermission("*"))
     if not ldap.LDAP_available:
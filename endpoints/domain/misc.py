@@ -7,8 +7,6 @@ from .. import defaultListHandler
 import api
 from api.core import API, secure
 
-from tools.permissions import SystemAdminPermission, DomainAdminPermission
-
 from flask import request, jsonify
 
 from orm import DB
@@ -17,14 +15,10 @@ if DB is not None:
 
 
 @API.route(api.BaseRoute+"/domains", methods=["GET"])
-@secure(requireDB=True, authLevel="user")
+@secure(requireDB=True, authLevel="user", etag=("domains",), coalesce=True)
 def getAvailableDomains():
-    permissions = request.auth["user"].permissions()
-    if SystemAdminPermission() in permissions:
-        domainFilters = ()
-    else:
-        domainIDs = {permission.domainID for permission in permissions if isinstance(permission, DomainAdminPermission)}
-        if len(domainIDs) == 0:
-            return jsonify(data=[])
-        domainFilters = () if "*" in domainIDs else (Domains.ID.in_(domainIDs),)
+    domainIDs = request.auth["user"].permissions().domainIDs()
+    if domainIDs is not None and len(domainIDs) == 0:
+        return jsonify(data=[])
+    domainFilters = () if domainIDs is None else (Domains.ID.in_(domainIDs),)
     return defaultListHandler(Domains, filters=domainFilters)
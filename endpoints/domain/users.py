@@ -3,14 +3,16 @@
 # SPDX-FileCopyrightText: 2020-2021 grammm GmbH
 
 import api
+from api import jobs
 from api.core import API, secure
-from api.security import checkPermissions
+from api.jsonenc import jsonify
+from api.security import checkPermissions, invalidateUserCache
 
-from flask import request, jsonify
+from flask import request
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import aliased
 
-from .. import defaultListHandler, defaultObjectHandler, defaultPatch
+from .. import defaultListHandler, defaultObjectHandler, defaultPatch, streamingRequested, streamList
 
 from tools.misc import AutoClean, createMapping
 from tools.storage import UserSetup
@@ -29,7 +31,7 @@ if DB is not None:
 
 
 @API.route(api.BaseRoute+"/domains/<int:domainID>/users", methods=["GET"])
-@secure(requireDB=True)
+@secure(requireDB=True, rateLimit="list")
 def getUsers(domainID):
     checkPermissions(DomainAdminPermission(domainID))
     verbosity = int(request.args.get("level", 1))
@@ -41,8 +43,8 @@ def getUsers(domainID):
             up = aliased(UserProperties)
             query = query.join(up, (up.userID == Users.ID) & (up.tag == getattr(PropTags, sprop.upper())))\
                          .order_by(up._propvalstr.desc() if sorder == "desc" else up._propvalstr.asc())
-    data = [user.todict(verbosity) for user in query.limit(limit).offset(offset).all()]
-    if verbosity < 2 and "properties" in request.args:
+
+    def addProperties(data):
         tags = [getattr(PropTags, prop.upper(), None) for prop in request.args["properties"].split(",")]
         for user in data:
             user["properties"] = {}
@@ -50,6 +52,13 @@ def getUsers(domainID):
         properties = UserProperties.query.filter(UserProperties.userID.in_(usermap.keys()), UserProperties.tag.in_(tags)).all()
         for prop in properties:
             usermap[prop.userID]["properties"][prop.name] = prop.val
+
+    process = addProperties if verbosity < 2 and "properties" in request.args else None
+    if streamingRequested(limit):
+        return streamList(Users, query, limit, offset, verbosity, count, process=process)
+    data = [user.todict(verbosity) for user in query.limit(limit).offset(offset).all()]
+    if process is not None:
+        process(data)
     return jsonify(count=count, data=data)
 
 
@@ -155,6 +164,7 @@ def deleteUser(user):
         DB.session.commit()
     except:
         return jsonify(message="Cannot delete user: Database commit failed."), 500
+    invalidateUserCache()
     try:
         options = Config["options"]
         client = pyexmdb.ExmdbQueries(options["exmdbHost"], options["exmdbPort"], options["domainPrefix"], True)
@@ -164,10 +174,15 @@ def deleteUser(user):
     except RuntimeError as err:
         API.logger.error("Could not unload exmdb store: "+err.args[0])
     if request.args.get("deleteFiles") == "true":
-        shutil.rmtree(maildir, ignore_errors=True)
+        job = jobs.submit("deleteFiles", _deleteMaildir, maildir, owner=request.auth["claims"]["usr"])
+        return jobs.accepted(job, "User deleted, removing files")
     return jsonify(message="isded")
 
 
+def _deleteMaildir(job, maildir):
+    shutil.rmtree(maildir, ignore_errors=True)
+
+
 @API.route(api.BaseRoute+"/domains/<int:domainID>/users/<int:userID>/password", methods=["PUT"])
 @secure(requireDB=True, authLevel="user")
 def setUserPassword(domainID, userID):
@@ -206,6 +221,7 @@ def updateUserRoles(domainID, userID):
         DB.session.commit()
     except IntegrityError as err:
         return jsonify(message="Invalid data", error=err.orig.args[1]), 400
+    invalidateUserCache()
     roles = AdminRoles.query.join(AdminUserRoleRelation).filter(AdminUserRoleRelation.userID == userID).all()
     return jsonify(data=[role.ref() for role in roles])
 
@@ -214,7 +230,7 @@ def updateUserRoles(domainID, userID):
 
 
 @API.route(api.BaseRoute+"/domains/<int:domainID>/groups", methods=["GET"])
-@secure(requireDB=True)
+@secure(requireDB=True, etag=("groups",))
 def getGroups(domainID):
     checkPermissions(DomainAdminPermission(domainID))
     return defaultListHandler(Groups, filters=(Groups.domainID == domainID,))
@@ -245,7 +261,7 @@ def deleteGroup(domainID, ID):
 
 
 @API.route(api.BaseRoute+"/domains/<int:domainID>/groups/<int:ID>", methods=["GET"])
-@secure(requireDB=True)
+@secure(requireDB=True, etag=("groups",))
 def getGroup(domainID, ID):
     checkPermissions(DomainAdminPermission(domainID))
     return defaultObjectHandler(Groups, ID, "Group", filters=(Groups.domainID == domainID,))
@@ -1 +1 @@
-from . import domains, mconf, misc, roles
+from . import domains, jobs, mconf, misc, roles
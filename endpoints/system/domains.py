@@ -23,7 +23,7 @@ if DB is not None:
 
 
 @API.route(api.BaseRoute+"/system/domains", methods=["GET"])
-@secure(requireDB=True)
+@secure(requireDB=True, etag=("domains",), coalesce=True)
 def domainListEndpoint():
     checkPermissions(SystemAdminPermission())
     return defaultListHandler(Domains)
@@ -59,7 +59,7 @@ def domainCreate():
 
 
 @API.route(api.BaseRoute+"/system/domains/<int:domainID>", methods=["GET"])
-@secure(requireDB=True)
+@secure(requireDB=True, etag=("domains",))
 def getDomain(domainID):
     checkPermissions(SystemAdminPermission())
     return defaultObjectHandler(Domains, domainID, "Domain")
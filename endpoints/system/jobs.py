@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# SPDX-FileCopyrightText: 2021 grammm GmbH
+
+from flask import request
+
+import api
+from api import jobs
+from api.core import API, secure
+from api.jsonenc import jsonify
+from api.security import checkPermissions
+
+from tools.permissions import SystemAdminPermission
+
+
+def _loadJob(jobID):
+    """Load job record, if the user may access it.
+
+    Jobs are visible to the user who submitted them and to system administrators.
+    """
+    record = jobs.get(jobID)
+    if record is not None and record["owner"] != request.auth["claims"]["usr"]:
+        checkPermissions(SystemAdminPermission())
+    return record
+
+
+@API.route(api.BaseRoute+"/system/jobs/<jobID>", methods=["GET"])
+@secure()
+def getJob(jobID):
+    record = _loadJob(jobID)
+    if record is None:
+        return jsonify(message="Job not found"), 404
+    return jsonify({key: record[key] for key in ("ID", "type", "status", "created", "started", "finished", "progress",
+                                                 "message", "result")})
+
+
+@API.route(api.BaseRoute+"/system/jobs/<jobID>", methods=["DELETE"])
+@secure()
+def cancelJob(jobID):
+    record = _loadJob(jobID)
+    if record is None:
+        return jsonify(message="Job not found"), 404
+    if not jobs.cancel(jobID):
+        return jsonify(message="Job cannot be cancelled"), 409
+    return jsonify(message="Cancellation requested")
@@ -6,15 +6,13 @@ import api
 from api.core import API, secure
 from api.security import checkPermissions
 
+from tools import metrics
 from tools.config import Config
 from tools.license import getLicense, updateCertificate
 from tools.permissions import SystemAdminPermission
-from tools.systemd import Systemd
 
 import os
-import psutil
 from datetime import datetime
-from dbus import DBusException
 from flask import jsonify, make_response, request
 
 from orm import DB
@@ -23,9 +21,10 @@ if DB is not None:
 
 
 @API.route(api.BaseRoute+"/system/dashboard", methods=["GET"])
-@secure()
+@secure(coalesce=True)
 def getDashboard():
     checkPermissions(SystemAdminPermission())
+    import psutil
     disks = []
     for disk in psutil.disk_partitions():
         try:
@@ -54,11 +53,13 @@ def getDashboard():
 
 
 @API.route(api.BaseRoute+"/system/dashboard/services", methods=["GET"])
-@secure()
+@secure(coalesce=True)
 def getDashboardServices():
     checkPermissions(SystemAdminPermission())
     if len(Config["options"]["dashboard"]["services"]) == 0:
         return jsonify(services=[])
+    from dbus import DBusException
+    from tools.systemd import Systemd
     sysd = Systemd(system=True)
     services = []
     for service in Config["options"]["dashboard"]["services"]:
@@ -74,7 +75,7 @@ def getDashboardServices():
 
 
 @API.route(api.BaseRoute+"/system/dashboard/services/<unit>", methods=["GET"])
-@secure()
+@secure(coalesce=True)
 def getDashboardService(unit):
     checkPermissions(SystemAdminPermission())
     for service in Config["options"]["dashboard"]["services"]:
@@ -82,6 +83,8 @@ def getDashboardService(unit):
             break
     else:
         return jsonify(message="Unknown unit '{}'".format(unit)), 400
+    from dbus import DBusException
+    from tools.systemd import Systemd
     sysd = Systemd(system=True)
     try:
         unit = sysd.getService(service["unit"])
@@ -97,6 +100,8 @@ def getDashboardService(unit):
 @secure()
 def signalDashboardService(unit, action):
     checkPermissions(SystemAdminPermission())
+    from dbus import DBusException
+    from tools.systemd import Systemd
     if action == "start":
         command = Systemd.startService
     elif action == "stop":
@@ -152,3 +157,12 @@ def updateLicense():
     if error:
         return jsonify(message=error), 400
     return dumpLicense()
+
+
+@API.route(api.BaseRoute+"/system/metrics", methods=["GET"])
+@secure()
+def getMetrics():
+    checkPermissions(SystemAdminPermission())
+    response = make_response(metrics.exposition())
+    response.headers.set("Content-Type", metrics.CONTENT_TYPE)
+    return response
@@ -6,7 +6,7 @@ from flask import jsonify, request
 
 import api
 from api.core import API, secure
-from api.security import checkPermissions
+from api.security import checkPermissions, invalidateUserCache
 
 from tools.permissions import Permissions, SystemAdminPermission
 
@@ -17,6 +17,8 @@ if DB is not None:
     from orm.users import Users
     from orm.roles import AdminRoles, AdminUserRoleRelation
 
+roleTables = ("admin_roles", "admin_role_permission_relation", "admin_user_role_relation", "users")
+
 
 @API.route(api.BaseRoute+"/system/users", methods=["GET"])
 @secure(requireDB=True)
@@ -33,16 +35,22 @@ def getAdminPermissions():
 
 
 @API.route(api.BaseRoute+"/system/roles", methods=["GET", "POST"])
-@secure(requireDB=True, authLevel="user")
+@secure(requireDB=True, authLevel="user", etag=roleTables)
 def adminRolesListEndpoint():
     checkPermissions(SystemAdminPermission())
-    return defaultListHandler(AdminRoles)
+    response = defaultListHandler(AdminRoles)
+    if request.method == "POST":
+        invalidateUserCache()
+    return response
 
 
 @API.route(api.BaseRoute+"/system/roles/<int:ID>", methods=["GET", "PATCH", "DELETE"])
-@secure(requireDB=True, authLevel="user")
+@secure(requireDB=True, authLevel="user", etag=roleTables)
 def adminRolesObjectEndpoint(ID):
     checkPermissions(SystemAdminPermission())
     if request.method == "DELETE" and AdminUserRoleRelation.query.filter(AdminUserRoleRelation.roleID == ID).count() > 0:
         return jsonify(message="Das kannste so nicht machen."), 400
-    return defaultObjectHandler(AdminRoles, ID, "Role")
+    response = defaultObjectHandler(AdminRoles, ID, "Role")
+    if request.method in ("PATCH", "DELETE"):
+        invalidateUserCache()
+    return response
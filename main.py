@@ -16,9 +16,10 @@ if __name__ == '__main__':
     from cli import Cli
     sys.exit(Cli.execute())
 else:
-    from api.core import API
+    from api.core import API, precompileValidators
     from endpoints import *
     from tools import config
     error = config.validate()
     if error:
         raise TypeError("Invalid configuration found - aborting ({})".format(error))
+    precompileValidators()
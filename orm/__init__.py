@@ -4,11 +4,20 @@
 
 __all__ = ["domains", "misc", "users", "ext"]
 
+from api import sqlaudit
 from api.core import API
+from flask import g, has_app_context
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+from time import perf_counter
 
+from tools import changes, metrics, tracing
 from tools.config import Config
 
+sqlMetric = metrics.Histogram("grammm_admin_sql_statement_duration_seconds", "Duration of SQL statements", ("statement",))
+
 
 def _loadDBConfig():
     """Load database parameters from configuration.
@@ -42,6 +51,86 @@ def _loadDBConfig():
                                                                          db=DBconf["database"])
 
 
+@event.listens_for(Engine, "before_cursor_execute")
+def _statementStart(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._metricsStart = perf_counter()
+        if tracing.enabled:
+            context._traceSpan = tracing.startSpan("SQL "+(statement.lstrip().split(None, 1)[0].upper() if statement else ""),
+                                                   tracing.KIND_CLIENT,
+                                                   {"db.system": conn.engine.dialect.name, "db.statement": statement})
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _statementEnd(conn, cursor, statement, parameters, context, executemany):
+    start = getattr(context, "_metricsStart", None)
+    if start is not None:
+        duration = perf_counter()-start
+        sqlMetric.observe(duration, statement.lstrip().split(None, 1)[0].upper() if statement else "")
+        if has_app_context():
+            _logStatement(statement, duration, cursor.rowcount)
+    span = getattr(context, "_traceSpan", None)
+    if span is not None:
+        span.setAttribute("db.rows", cursor.rowcount)
+        span.finish()
+
+
+@event.listens_for(Engine, "handle_error")
+def _statementError(exceptionContext):
+    span = getattr(exceptionContext.execution_context, "_traceSpan", None)
+    if span is not None:
+        span.finish(exceptionContext.original_exception)
+
+
+def _logStatement(statement, duration, rowcount):
+    """Record statement in the statement log of the current request, if enabled (see `api.core.startRequest`).
+
+    Statements are also counted by shape for SQL auditing (see `api.sqlaudit`).
+    """
+    log = g.get("sqlLog")
+    if log is None:
+        return
+    log["count"] += 1
+    log["duration"] += duration
+    if len(log["statements"]) < Config["options"]["slowRequestMaxStatements"]:
+        log["statements"].append({"statement": statement, "duration": round(duration*1000, 3), "rows": rowcount})
+    if log["shapes"] is not None:
+        log["shapes"][sqlaudit.statementShape(statement)] += 1
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _recordChanges(conn, cursor, statement, parameters, context, executemany):
+    changes.recordStatement(conn.info, statement)
+
+
+@event.listens_for(Engine, "commit")
+def _prepareChanges(conn):
+    changes.prepareCommit(conn.info)
+
+
+@event.listens_for(Engine, "rollback")
+def _rollbackChanges(conn):
+    changes.rollback(conn.info)
+
+
+@event.listens_for(Session, "after_begin")
+def _trackConnection(session, transaction, conn):
+    session.info.setdefault("changeConnections", set()).add(conn)
+
+
+@event.listens_for(Session, "after_commit")
+def _commitChanges(session):
+    """Increment change counters once the database has confirmed the commit (see `tools.changes`)."""
+    for conn in session.info.get("changeConnections", ()):
+        changes.commit(conn.info)
+
+
+@event.listens_for(Session, "after_transaction_end")
+def _releaseConnections(session, transaction):
+    if transaction.parent is None:
+        session.info.pop("changeConnections", None)
+
+
 if Config["options"]["disableDB"]:
     DB = None
     API.logger.warn("Database disabled in configuration")
@@ -70,7 +70,7 @@ class AdminUserRoleRelation(DataModel, DB.Model):
     userID = DB.Column("user_id", INTEGER(10, unsigned=True), ForeignKey(Users.ID, ondelete="cascade"), primary_key=True)
     roleID = DB.Column("role_id", INTEGER(10, unsigned=True), ForeignKey(AdminRoles.ID), primary_key=True)
 
-    user = relationship("Users")
+    user = relationship("Users", lazy="selectin")
     role = relationship(AdminRoles)
 
     _dictmapping_ = ((RefProp("user"),),
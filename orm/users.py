@@ -6,6 +6,7 @@ from . import DB
 from tools.constants import PropTags, PropTypes
 from tools.rop import ntTime, nxTime
 from tools.DataModel import DataModel, Id, Text, Int, Date, BoolP, RefProp
+from tools import passwords
 from tools.misc import createMapping
 
 from sqlalchemy import func, ForeignKey
@@ -14,12 +15,10 @@ from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy.orm import relationship, selectinload
 from sqlalchemy.orm.collections import attribute_mapped_collection
 
-import crypt
 import re
 import time
 from base64 import b64decode, b64encode
 from datetime import datetime
-from ldap3.utils.conv import escape_filter_chars
 
 
 class Groups(DataModel, DB.Model):
@@ -208,10 +207,10 @@ class Users(DataModel, DB.Model):
 
     @password.setter
     def password(self, pw):
-        self._password = crypt.crypt(pw, crypt.mksalt(crypt.METHOD_MD5))
+        self._password = passwords.hash(pw)
 
     def chkPw(self, pw):
-        return crypt.crypt(pw, self.password) == self.password
+        return passwords.verify(pw, self.password)
 
     @property
     def propmap(self):
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# SPDX-FileCopyrightText: 2021 grammm GmbH
+"""
+Test configuration.
+
+Tests run from the repository root with a temporary cache directory, so shared state files (change counters, rate limit
+buckets) do not interfere with an installed instance. The configuration must be adjusted before any module using it is
+imported.
+"""
+
+import os
+import pytest
+import sys
+import tempfile
+
+_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+os.chdir(_root)
+sys.path.insert(0, _root)
+
+from tools.config import Config
+
+Config["options"]["cacheDir"] = tempfile.mkdtemp(prefix="grammm-admin-test-")
+
+
+def _writeKeys(directory):
+    from cryptography.hazmat.backends import default_backend
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+    key = rsa.generate_private_key(65537, 2048, default_backend())
+    with open(os.path.join(directory, "jwt-privkey.pem"), "wb") as file:
+        file.write(key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                     serialization.NoEncryption()))
+    with open(os.path.join(directory, "jwt-pubkey.pem"), "wb") as file:
+        file.write(key.public_key().public_bytes(serialization.Encoding.PEM,
+                                                 serialization.PublicFormat.SubjectPublicKeyInfo))
+
+
+@pytest.fixture(scope="session")
+def api():
+    """Set up the API with an SQLite database.
+
+    The database contains the system administrator (`admin`). Endpoints requiring the exmdb bindings (tools.pyexmdb)
+    are only available if the bindings are built.
+
+    Returns
+    -------
+    flask.Flask
+        The API application
+    """
+    directory = tempfile.mkdtemp(prefix="grammm-admin-test-")
+    _writeKeys(directory)
+    Config["options"]["disableDB"] = True  # Database is set up below
+    Config["security"].update(jwtPrivateKeyFile=os.path.join(directory, "jwt-privkey.pem"),
+                              jwtPublicKeyFile=os.path.join(directory, "jwt-pubkey.pem"),
+                              jwtAlgorithm="RS256")
+    Config["sqlAudit"]["mode"] = "warn"
+
+    from flask_sqlalchemy import SQLAlchemy
+    from sqlalchemy.dialects.mysql import TINYINT
+    from sqlalchemy.ext.compiler import compiles
+
+    @compiles(TINYINT, "sqlite")
+    def _tinyint(type_, compiler, **kwargs):
+        return "INTEGER"
+
+    from api.core import API
+    import orm
+    API.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///"+os.path.join(directory, "test.db")
+    API.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    orm.DB = SQLAlchemy(API)
+    import endpoints.misc
+    import endpoints.system
+    try:
+        import endpoints.domain
+    except ImportError:
+        pass
+    orm.DB.create_all()
+    orm.DB.session.execute("INSERT INTO users (id, username, password, group_id, domain_id, privilege_bits, max_size) "
+                           "VALUES (0, 'admin', '', 0, 0, 0, 0)")
+    orm.DB.session.commit()
+    return API
+
+
+@pytest.fixture
+def client(api):
+    """Test client logged in as system administrator."""
+    from api.security import mkJWT
+    client = api.test_client()
+    client.set_cookie("localhost", "grammmAuthJwt", mkJWT({"usr": "admin"}).decode("ascii"))
+    return client
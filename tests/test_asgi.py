@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# SPDX-FileCopyrightText: 2021 grammm GmbH
+
+import asyncio
+
+from api.asgi import AsgiAdapter
+from tools.config import Config
+
+
+def _request(app, path="/"):
+    """Run a GET request through the ASGI adapter and return the sent messages."""
+    sent = []
+
+    async def receive():
+        return {"type": "http.request", "body": b""}
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"type": "http", "method": "GET", "path": path, "query_string": b"", "headers": []}
+    loop = asyncio.new_event_loop()
+    try:
+        asyncio.set_event_loop(loop)
+        loop.run_until_complete(AsgiAdapter(app)(scope, receive, send))
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
+    return sent
+
+
+def test_response():
+    def app(environ, startResponse):
+        startResponse("200 OK", [("Content-Type", "text/plain")])
+        return [b"data"]
+
+    sent = _request(app)
+    assert sent[0]["status"] == 200
+    assert b"".join(message.get("body", b"") for message in sent[1:]) == b"data"
+    assert sent[-1]["more_body"] is False
+
+
+def test_error_after_start():
+    """A response that fails after it was started must still be terminated."""
+    def app(environ, startResponse):
+        startResponse("200 OK", [("Content-Type", "text/plain")])
+        yield b"partial"
+        raise RuntimeError("failed")
+
+    sent = _request(app)
+    assert sent[0]["status"] == 200
+    assert sent[-1] == {"type": "http.response.body", "body": b"", "more_body": False}
+
+
+def test_blocking_routes(monkeypatch):
+    monkeypatch.setitem(Config["asgi"], "blockingRoutes", dict(Config["asgi"]["blockingRoutes"], ldap=None, test="^/slow"))
+    adapter = AsgiAdapter(None)
+    assert adapter._executor("/slow/path") is adapter.blockingExecutor
+    assert adapter._executor("/api/v1/domains/ldap/search") is adapter.executor
+    assert adapter._executor("/api/v1/domains/1/folders") is adapter.blockingExecutor
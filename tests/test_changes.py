@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# SPDX-FileCopyrightText: 2021 grammm GmbH
+
+import pytest
+
+from tools import changes
+
+
+@pytest.fixture(autouse=True)
+def available():
+    if not changes.available:
+        pytest.skip("Change counters not available")
+
+
+def test_increment():
+    before = changes.get("users", "domains")
+    changes.increment("users")
+    after = changes.get("users", "domains")
+    assert after[0] == before[0]+1
+    if changes._slot("users") != changes._slot("domains"):
+        assert after[1] == before[1]
+
+
+def test_increment_once_per_slot():
+    before, = changes.get("groups")
+    changes.increment("groups", "groups")
+    assert changes.get("groups") == (before+1,)
+
+
+@pytest.mark.parametrize("statement, table", (
+    ("INSERT INTO users (id) VALUES (1)", "users"),
+    ("insert ignore into `domains` (id) values (1)", "domains"),
+    ("REPLACE INTO aliases VALUES (1)", "aliases"),
+    ("  UPDATE `users` SET maildir=''", "users"),
+    ("DELETE FROM admin_roles WHERE id=1", "admin_roles"),
+    ("SELECT * FROM users", None),
+))
+def test_record_statement(statement, table):
+    info = {}
+    changes.recordStatement(info, statement)
+    assert info.get("changedTables") == ({table} if table else None)
+
+
+def test_commit_and_rollback():
+    before, = changes.get("classes")
+    info = {}
+    changes.recordStatement(info, "UPDATE classes SET classname='x'")
+    changes.rollback(info)
+    changes.prepareCommit(info)
+    changes.commit(info)
+    assert changes.get("classes") == (before,)
+    changes.recordStatement(info, "UPDATE classes SET classname='x'")
+    changes.recordStatement(info, "DELETE FROM classes")
+    changes.prepareCommit(info)
+    assert changes.get("classes") == (before,)
+    changes.commit(info)
+    assert changes.get("classes") == (before+1,)
+    assert info == {}
+
+
+def test_failed_commit():
+    before, = changes.get("classes")
+    info = {}
+    changes.recordStatement(info, "UPDATE classes SET classname='x'")
+    changes.prepareCommit(info)
+    changes.rollback(info)
+    changes.commit(info)
+    assert changes.get("classes") == (before,)
+
+
+def test_session_commit(api, monkeypatch):
+    from orm import DB
+    before, = changes.get("users")
+    DB.session.execute("UPDATE users SET max_size=0 WHERE id=0")
+    DB.session.commit()
+    assert changes.get("users") == (before+1,)
+
+    def fail(*args, **kwargs):
+        raise RuntimeError("commit failed")
+    monkeypatch.setattr(DB.engine.dialect, "do_commit", fail)
+    DB.session.execute("UPDATE users SET max_size=0 WHERE id=0")
+    with pytest.raises(RuntimeError):
+        DB.session.commit()
+    DB.session.rollback()
+    assert changes.get("users") == (before+1,)
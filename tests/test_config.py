@@ -0,0 +1,10 @@
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# SPDX-FileCopyrightText: 2021 grammm GmbH
+
+from tools.config import validate
+
+
+def test_default_config_valid():
+    assert validate() is None
+
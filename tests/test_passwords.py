@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# SPDX-FileCopyrightText: 2021 grammm GmbH
+
+import crypt
+import pytest
+
+from tools import passwords
+from tools.config import Config
+
+
+@pytest.fixture
+def scheme():
+    """Return function setting the password scheme, restoring the configuration afterwards."""
+    config = Config["passwords"]
+    saved = dict(config)
+
+    def setScheme(scheme, **kwargs):
+        config.update(scheme=scheme, maxLength=255, **kwargs)
+        passwords._schemeUsable = None
+
+    yield setScheme
+    config.clear()
+    config.update(saved)
+    passwords._schemeUsable = None
+
+
+def _md5(password):
+    return crypt.crypt(password, crypt.mksalt(crypt.METHOD_MD5))
+
+
+def _sha512(password, rounds=5000):
+    return crypt.crypt(password, crypt.mksalt(crypt.METHOD_SHA512, rounds=rounds))
+
+
+@pytest.mark.parametrize("name", ("md5", "sha512"))
+def test_hash_verify(scheme, name):
+    scheme(name)
+    hashed = passwords.hash("secret")
+    assert hashed.startswith({"md5": "$1$", "sha512": "$6$"}[name])
+    assert passwords.verify("secret", hashed)
+    assert not passwords.verify("wrong", hashed)
+    assert not passwords.needsUpdate(hashed)
+
+
+def test_verify_independent_of_scheme(scheme):
+    scheme("md5")
+    assert passwords.verify("secret", _sha512("secret"))
+    scheme("sha512")
+    assert passwords.verify("secret", _md5("secret"))
+
+
+def test_verify_invalid():
+    assert not passwords.verify("secret", "")
+    assert not passwords.verify("secret", None)
+
+
+def test_fallback_to_md5(scheme):
+    scheme("sha512")
+    Config["passwords"]["maxLength"] = 40
+    hashed = passwords.hash("secret")
+    assert hashed.startswith("$1$") and len(hashed) <= 40
+    assert not passwords.needsUpdate(hashed)
+
+
+def test_no_downgrade(scheme):
+    scheme("md5")
+    assert not passwords.needsUpdate(_sha512("secret"))
+    assert not passwords.needsUpdate("$2b$12$"+22*"a"+31*"b")
+    assert not passwords.needsUpdate("$argon2id$v=19$m=65536,t=2,p=1$c2FsdA$aGFzaA")
+    assert not passwords.needsUpdate("$7$unknown")
+    assert passwords.needsUpdate(crypt.crypt("secret", "ab"))  # DES
+
+
+def test_upgrade(scheme):
+    scheme("sha512", sha512Rounds=5000)
+    assert passwords.needsUpdate(_md5("secret"))
+    assert not passwords.needsUpdate(_sha512("secret"))
+    Config["passwords"]["sha512Rounds"] = 10000
+    assert passwords.needsUpdate(_sha512("secret"))
+    assert not passwords.needsUpdate(_sha512("secret", 20000))
+    assert not passwords.needsUpdate("")
+
+
+def test_busy(scheme, monkeypatch):
+    scheme("md5")
+    monkeypatch.setattr(passwords, "_executor", None)
+    monkeypatch.setattr(passwords, "_slots", None)
+    monkeypatch.setitem(Config["passwords"], "workers", 1)
+    monkeypatch.setitem(Config["passwords"], "queue", 0)
+    passwords.hash("secret")  # Create pool
+    assert passwords._slots.acquire(False)
+    try:
+        with pytest.raises(passwords.PasswordHashBusy):
+            passwords.verify("secret", _md5("secret"))
+    finally:
+        passwords._slots.release()
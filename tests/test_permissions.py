@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# SPDX-FileCopyrightText: 2021 grammm GmbH
+
+from tools.permissions import Permissions, DomainAdminPermission, SystemAdminPermission
+
+
+def test_sysadmin():
+    permissions = Permissions.sysadmin()
+    assert permissions.sysadmin
+    assert SystemAdminPermission() in permissions
+    assert DomainAdminPermission(1) in permissions
+    assert DomainAdminPermission("*") in permissions
+    assert permissions.domainIDs() is None
+    assert permissions.capabilities() == {"SystemAdmin"}
+
+
+def test_domain_admin():
+    permissions = Permissions(DomainAdminPermission(1), DomainAdminPermission(7))
+    assert not permissions.sysadmin and not permissions.wildcard
+    assert SystemAdminPermission() not in permissions
+    assert DomainAdminPermission(1) in permissions
+    assert DomainAdminPermission(7) in permissions
+    assert DomainAdminPermission(2) not in permissions
+    assert DomainAdminPermission("*") in permissions
+    assert permissions.domainIDs() == {1, 7}
+    assert permissions.capabilities() == {"DomainAdmin"}
+
+
+def test_wildcard_domain_admin():
+    permissions = Permissions(DomainAdminPermission("*"))
+    assert permissions.wildcard
+    assert DomainAdminPermission(42) in permissions
+    assert DomainAdminPermission("*") in permissions
+    assert SystemAdminPermission() not in permissions
+    assert permissions.domainIDs() is None
+
+
+def test_no_permissions():
+    permissions = Permissions()
+    assert DomainAdminPermission(1) not in permissions
+    assert DomainAdminPermission("*") not in permissions
+    assert SystemAdminPermission() not in permissions
+    assert permissions.domainIDs() == frozenset()
+    assert permissions.capabilities() == set()
+
+
+def test_compiled_matches_permits():
+    """Compiled checks must give the same results as checking each held permission."""
+    held = [(), (DomainAdminPermission(3),), (DomainAdminPermission(3), DomainAdminPermission(5)),
+            (DomainAdminPermission("*"),), (DomainAdminPermission(3), DomainAdminPermission("*"))]
+    requested = [DomainAdminPermission(3), DomainAdminPermission(4), DomainAdminPermission("*")]
+    for permissions in held:
+        compiled = Permissions(*permissions)
+        for permission in requested:
+            assert (permission in compiled) == any(perm.permits(permission) for perm in permissions)
+
+
+def test_from_db():
+    class Data:
+        def __init__(self, permission, params):
+            self.permission, self.params = permission, params
+
+    permissions = Permissions.fromDB([Data("DomainAdmin", 2), Data("Unknown", None), Data("DomainAdmin", 9)])
+    assert permissions.domainIDs() == {2, 9}
+    assert Permissions.fromDB([Data("SystemAdmin", None)]).sysadmin
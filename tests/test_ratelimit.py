@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# SPDX-FileCopyrightText: 2021 grammm GmbH
+
+import pytest
+
+from tools import ratelimit
+from tools.config import Config
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Use per process buckets with a controlled clock."""
+    clock = Clock()
+    monkeypatch.setattr(ratelimit, "_file", None)
+    monkeypatch.setattr(ratelimit, "_map", bytearray(ratelimit._slots*ratelimit._slotFormat.size))
+    monkeypatch.setattr(ratelimit.time, "monotonic", clock)
+    monkeypatch.setitem(Config["rateLimit"], "classes", {"default": {"rate": 2, "burst": 3},
+                                                         "off": {"rate": 0, "burst": 1}})
+    return clock
+
+
+def test_burst(clock):
+    assert [ratelimit.acquire("default", "alice") for _ in range(3)] == [0, 0, 0]
+    assert ratelimit.acquire("default", "alice") == pytest.approx(0.5)
+
+
+def test_refill(clock):
+    for _ in range(3):
+        ratelimit.acquire("default", "alice")
+    clock.now += 0.5
+    assert ratelimit.acquire("default", "alice") == 0
+    assert ratelimit.acquire("default", "alice") > 0
+    clock.now += 60
+    assert [ratelimit.acquire("default", "alice") for _ in range(3)] == [0, 0, 0]
+    assert ratelimit.acquire("default", "alice") > 0
+
+
+def test_clients_and_classes_are_separate(clock):
+    for _ in range(3):
+        ratelimit.acquire("default", "alice")
+    assert ratelimit.acquire("default", "alice") > 0
+    assert ratelimit.acquire("default", "bob") == 0
+    assert ratelimit.acquire("unknown", "alice") == 0  # Separate bucket with default limits
+
+
+def test_unlimited(clock):
+    assert all(ratelimit.acquire("off", "alice") == 0 for _ in range(100))
+
+
+def test_clock_reset(clock):
+    for _ in range(3):
+        ratelimit.acquire("default", "alice")
+    clock.now = 1
+    assert ratelimit.acquire("default", "alice") == 0
+
+
+def test_slot_replacement(clock):
+    """Buckets sharing a slot pair replace the least recently used one."""
+    keyHash = 1
+    other = keyHash+ratelimit._slots//2
+    third = keyHash+ratelimit._slots
+    assert ratelimit._take(keyHash, 2, 1, clock.now) == 0
+    clock.now += 0.1
+    assert ratelimit._take(other, 2, 1, clock.now) == 0
+    clock.now += 0.1
+    assert ratelimit._take(keyHash, 2, 1, clock.now) > 0  # Still stored
+    clock.now += 0.1
+    assert ratelimit._take(third, 2, 1, clock.now) == 0  # Replaces other
+    assert ratelimit._take(other, 2, 1, clock.now) == 0  # Was replaced, starts with full bucket
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# SPDX-FileCopyrightText: 2021 grammm GmbH
+
+import pytest
+
+from tools import changes
+from tools.config import Config
+from tools.permissions import Permissions, DomainAdminPermission
+
+
+@pytest.fixture
+def security(api, monkeypatch):
+    from api import security
+    if not changes.available:
+        pytest.skip("Change counters not available")
+    monkeypatch.setitem(Config["security"], "jwtPermissions", True)
+    return security
+
+
+class User:
+    ID = 5
+    username = "user@d1.test"
+    domainID = 1
+
+    def permissions(self):
+        return Permissions(DomainAdminPermission(1))
+
+
+def _claims(security):
+    return security.checkToken(security.mkJWT(security.userClaims(User(), security.roleVersion())))[1]
+
+
+def test_claims_trusted(security):
+    claims = _claims(security)
+    user = security._claimsUser(claims, changes.get(*security._userTables))
+    assert user is not None and user.permissions.domainIDs() == {1}
+
+
+def test_claims_invalidated_by_user_change(security):
+    claims = _claims(security)
+    changes.increment("users")  # e.g. user deleted, removing role assignments by cascade
+    assert security._claimsUser(claims, changes.get(*security._userTables)) is None
+
+
+def test_claims_invalidated_by_role_change(security):
+    claims = _claims(security)
+    security.invalidateUserCache()
+    assert security._claimsUser(claims, changes.get(*security._userTables)) is None
+
+
+def test_claims_expire(security, monkeypatch):
+    claims = _claims(security)
+    monkeypatch.setitem(Config["security"], "userCacheLifetime", 60)
+    monkeypatch.setitem(Config["security"], "jwtPermissionsLifetime", 3600)
+    claims["iat"] -= 120
+    assert security._claimsUser(claims, changes.get(*security._userTables)) is not None
+    claims["iat"] -= 3600
+    assert security._claimsUser(claims, changes.get(*security._userTables)) is None
+
+
+def test_claims_without_counters(security, monkeypatch):
+    """Without change counters, claims are only trusted for the user cache lifetime."""
+    monkeypatch.setitem(Config["security"], "userCacheLifetime", 60)
+    claims = security.checkToken(security.mkJWT(security.userClaims(User(), None)))[1]
+    assert security._claimsUser(claims, None) is not None
+    assert security._claimsUser(claims, changes.get(*security._userTables)) is None
+    claims["iat"] -= 61
+    assert security._claimsUser(claims, None) is None
+
+
+def test_refresh_checks_database(security):
+    """Refreshing a token of a user that does not exist (anymore) must fail."""
+    from api.core import API
+    token = security.mkJWT(security.userClaims(User(), security.roleVersion())).decode("ascii")
+    with API.test_request_context(headers={"Cookie": "grammmAuthJwt="+token}):
+        assert security.refreshToken() is None
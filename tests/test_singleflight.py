@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# SPDX-FileCopyrightText: 2021 grammm GmbH
+
+import threading
+import time
+
+from flask import make_response
+
+
+def test_follower_headers(api):
+    """Waiting requests must not receive the entity tag or cookies of the first request."""
+    from api import core
+    key = ("GET", "test", "/test?", "user")
+    release = threading.Event()
+
+    def leader():
+        def func():
+            release.wait(5)
+            response = make_response("data")
+            response.set_etag("leader")
+            response.set_cookie("session", "leader")
+            return response
+        with api.test_request_context():
+            core.singleFlight(key, func)
+
+    thread = threading.Thread(target=leader)
+    thread.start()
+    while key not in core._flights:
+        time.sleep(0.01)
+    flight = core._flights[key]
+    release.set()
+    thread.join()
+    assert flight.result is not None
+    core._flights[key] = flight
+    try:
+        with api.test_request_context():
+            response = core.singleFlight(key, lambda: "unused")
+    finally:
+        core._flights.pop(key, None)
+    assert response.get_data() == b"data"
+    assert "ETag" not in response.headers and "Set-Cookie" not in response.headers
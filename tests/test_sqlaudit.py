@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# SPDX-FileCopyrightText: 2021 grammm GmbH
+
+import logging
+import pytest
+
+from flask import g
+
+from api.sqlaudit import statementShape
+from tools.config import Config
+
+# Maximum number of statements of each endpoint, independent of the number of listed objects.
+# Endpoints requiring the exmdb bindings (domain specific endpoints) are not covered.
+_budgets = {"/api/v1/status": 0,
+            "/api/v1/about": 0,
+            "/api/v1/profile": 4,
+            "/api/v1/system/dashboard": 1,
+            "/api/v1/system/license": 2,
+            "/api/v1/system/domains": 3,
+            "/api/v1/system/domains?level=2": 3,
+            "/api/v1/system/domains?sort=domainname,desc": 3,
+            "/api/v1/system/domains/1": 2,
+            "/api/v1/system/domains/1?level=2": 2,
+            "/api/v1/system/roles": 3,
+            "/api/v1/system/roles?level=2": 4,
+            "/api/v1/system/roles/1": 3,
+            "/api/v1/system/roles/1?level=2": 3,
+            "/api/v1/system/roles/permissions": 1,
+            "/api/v1/system/users": 3,
+            "/api/v1/system/users?level=2": 6,
+            "/api/v1/system/users?sort=username": 3}
+
+
+def test_statement_shape():
+    assert statementShape("SELECT * FROM users WHERE id = 5 AND name = 'x'") == \
+        "SELECT * FROM users WHERE id = ? AND name = ?"
+    assert statementShape("SELECT * FROM users WHERE id IN (%s, %s, %s)") == \
+        statementShape("SELECT * FROM users WHERE id IN (%s)") == "SELECT * FROM users WHERE id IN (...)"
+    assert statementShape("SELECT  a\n  FROM b") == "SELECT a FROM b"
+
+
+def _populate(DB, domains, usersPerDomain, roles):
+    """Add domains, users and roles with IDs from 1 to the given number."""
+    for domainID in range(1, domains+1):
+        DB.session.execute("INSERT INTO domains (id, org_id, domainname, max_user, end_day) "
+                           "VALUES (:ID, 0, :name, 100, '3333-03-03')", {"ID": domainID, "name": "d{}.test".format(domainID)})
+        for index in range(usersPerDomain):
+            userID = domainID*1000+index
+            DB.session.execute("INSERT INTO users (id, username, password, group_id, domain_id, privilege_bits, "
+                               "max_size) VALUES (:ID, :name, '', 0, :domainID, 0, 0)",
+                               {"ID": userID, "name": "u{}@d{}.test".format(index, domainID), "domainID": domainID})
+    for roleID in range(1, roles+1):
+        DB.session.execute("INSERT INTO admin_roles (id, name) VALUES (:ID, :name)",
+                           {"ID": roleID, "name": "role{}".format(roleID)})
+        for domainID in range(1, domains+1):
+            DB.session.execute("INSERT INTO admin_role_permission_relation (role_id, permission, parameters) "
+                               "VALUES (:roleID, 'DomainAdmin', :domainID)", {"roleID": roleID, "domainID": domainID})
+            DB.session.execute("INSERT INTO admin_user_role_relation (user_id, role_id) VALUES (:userID, :roleID)",
+                               {"userID": domainID*1000, "roleID": roleID})
+    DB.session.commit()
+
+
+def _clear(DB):
+    for table in ("admin_user_role_relation", "admin_role_permission_relation", "admin_roles", "domains"):
+        DB.session.execute("DELETE FROM "+table)
+    DB.session.execute("DELETE FROM users WHERE id != 0")
+    DB.session.commit()
+
+
+@pytest.fixture
+def data(api):
+    """Return function populating the database, removing the data afterwards."""
+    from orm import DB
+
+    def populate(domains, usersPerDomain, roles):
+        _clear(DB)
+        _populate(DB, domains, usersPerDomain, roles)
+
+    yield populate
+    _clear(DB)
+
+
+def _get(client, path):
+    """Execute request and return the response and the SQL statement log of the request."""
+    with client:
+        response = client.get(path)
+        response.get_data()  # Consume streamed responses
+        return response, g.sqlLog
+
+
+@pytest.mark.parametrize("path", sorted(_budgets))
+def test_statement_budget(client, data, path, monkeypatch):
+    """Statement count of list and detail endpoints must not depend on the amount of data."""
+    monkeypatch.setitem(Config["security"], "userCacheSize", 0)  # Always count loading the user
+    counts = []
+    for size in (2, 6):
+        data(size, size, size)
+        response, sqlLog = _get(client, path)
+        assert response.status_code == 200, response.get_data(as_text=True)
+        assert "X-SQL-Audit" not in response.headers
+        assert sqlLog["count"] <= _budgets[path], sqlLog["statements"]
+        counts.append(sqlLog["count"])
+    assert counts[0] == counts[1]
+
+
+def test_repeated_statements_reported(client, data, monkeypatch):
+    data(3, 1, 1)
+    monkeypatch.setitem(Config["sqlAudit"], "repeatThreshold", 1)
+    response, _ = _get(client, "/api/v1/system/domains")
+    assert response.headers["X-SQL-Audit"] == "repeated"
+
+
+def test_budget_exceeded_fails(client, data, monkeypatch):
+    data(3, 1, 1)
+    monkeypatch.setitem(Config["sqlAudit"], "mode", "fail")
+    monkeypatch.setitem(Config["sqlAudit"], "budgets", {"domainListEndpoint": 1})
+    response, _ = _get(client, "/api/v1/system/domains")
+    assert response.status_code == 500
+    assert response.get_json()["violations"]["budget"]["limit"] == 1
+
+
+def test_streamed_statements_counted(client, data, monkeypatch, caplog):
+    """Statements executed while streaming are counted and audited after the stream is complete."""
+    data(2, 10, 0)
+    monkeypatch.setitem(Config["options"], "streamListThreshold", 5)
+    monkeypatch.setitem(Config["sqlAudit"], "budgets", {"userListEndpointUnrestricted": 2})
+    with caplog.at_level(logging.WARNING):
+        response, sqlLog = _get(client, "/api/v1/system/users?limit=15")
+    assert "X-SQL-Audit" not in response.headers
+    assert len(response.get_json()["data"]) == 15
+    assert sqlLog["count"] > 2
+    assert any("streamed" in record.getMessage() for record in caplog.records)
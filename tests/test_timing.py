@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# SPDX-FileCopyrightText: 2021 grammm GmbH
+
+import pytest
+
+from tools.config import Config
+
+
+@pytest.mark.parametrize("options", ({"validateResponseAsync": True},
+                                     {"validateResponseAsync": False, "validateResponseSampleRate": 0},
+                                     {"validateResponseAsync": False, "validateResponseSampleRate": 1}))
+def test_validation_timed(client, monkeypatch, options):
+    """Response validation is reported, whether it is executed synchronously, asynchronously or skipped."""
+    monkeypatch.setitem(Config["options"], "requestTiming", True)
+    for name, value in options.items():
+        monkeypatch.setitem(Config["openapi"], name, value)
+    response = client.get("/api/v1/system/roles/permissions")
+    assert response.status_code == 200
+    assert "validateResponse;dur=" in response.headers["Server-Timing"]
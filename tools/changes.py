@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# SPDX-FileCopyrightText: 2021 grammm GmbH
+"""
+Per-table change counters.
+
+Data modifying SQL statements are recorded per connection and the counters of the affected tables are incremented after
+the transaction was committed successfully. Incrementing earlier would allow concurrent readers to cache data from before
+the commit under the new counter values. The counters are stored in a memory mapped file in `options.cacheDir`, so all processes
+using the same configuration (API workers and CLI) share them.
+
+Tables are mapped to a fixed number of slots by a hash of their name. Collisions only cause unnecessary invalidations.
+
+If the counter file cannot be used, `available` is False and no counters are provided.
+"""
+
+import fcntl
+import logging
+import mmap
+import os
+import re
+import struct
+import threading
+import zlib
+
+from .config import Config
+
+_slots = 256
+_slotSize = struct.calcsize("Q")
+_modifyRe = re.compile(r"^\s*(?:INSERT\s+(?:IGNORE\s+)?INTO|REPLACE\s+INTO|UPDATE|DELETE\s+FROM)\s+`?(\w+)`?", re.IGNORECASE)
+_lock = threading.Lock()
+
+available = False
+_file = None
+_map = None
+
+
+def _slot(table):
+    return zlib.crc32(table.encode("utf-8")) % _slots*_slotSize
+
+
+def _afterFork():
+    global _lock
+    _lock = threading.Lock()
+
+
+def _init():
+    """Open and map counter file."""
+    global available, _file, _map
+    cacheDir = Config["options"].get("cacheDir")
+    if cacheDir is None:
+        logging.info("No cache directory configured - change counters disabled")
+        return
+    try:
+        os.makedirs(cacheDir, mode=0o755, exist_ok=True)
+        _file = os.open(os.path.join(cacheDir, "changes.counters"), os.O_RDWR | os.O_CREAT, 0o644)
+        fcntl.lockf(_file, fcntl.LOCK_EX)
+        try:
+            if os.fstat(_file).st_size < _slots*_slotSize:
+                os.ftruncate(_file, _slots*_slotSize)
+        finally:
+            fcntl.lockf(_file, fcntl.LOCK_UN)
+        _map = mmap.mmap(_file, _slots*_slotSize)
+        available = True
+    except Exception as err:
+        logging.warn("Could not initialize change counters: {}".format(err))
+        return
+    if hasattr(os, "register_at_fork"):
+        os.register_at_fork(after_in_child=_afterFork)
+
+
+def get(*tables):
+    """Get current counter values.
+
+    Parameters
+    ----------
+    *tables : str
+        Names of the tables
+
+    Returns
+    -------
+    tuple of int
+        Counter values or None if counters are not available
+    """
+    if not available:
+        return None
+    return tuple(struct.unpack_from("Q", _map, _slot(table))[0] for table in tables)
+
+
+def increment(*tables):
+    """Increment counters of the given tables.
+
+    Parameters
+    ----------
+    *tables : str
+        Names of the tables
+    """
+    if not available:
+        return
+    offsets = {_slot(table) for table in tables}
+    with _lock:
+        fcntl.lockf(_file, fcntl.LOCK_EX)
+        try:
+            for offset in offsets:
+                struct.pack_into("Q", _map, offset, struct.unpack_from("Q", _map, offset)[0]+1)
+        finally:
+            fcntl.lockf(_file, fcntl.LOCK_UN)
+
+
+def recordStatement(info, statement):
+    """Record tables modified by a statement.
+
+    Parameters
+    ----------
+    info : dict
+        Connection info dictionary to store pending changes in
+    statement : str
+        SQL statement
+    """
+    match = _modifyRe.match(statement)
+    if match:
+        info.setdefault("changedTables", set()).add(match.group(1))
+
+
+def prepareCommit(info):
+    """Mark pending changes as committing.
+
+    Must be called before the transaction is committed. Changes recorded afterwards belong to the next transaction.
+
+    Parameters
+    ----------
+    info : dict
+        Connection info dictionary pending changes were recorded in
+    """
+    tables = info.pop("changedTables", None)
+    if tables:
+        info.setdefault("committedTables", set()).update(tables)
+
+
+def commit(info):
+    """Increment counters of all committed changes.
+
+    Must be called after the transaction has been committed successfully (see `prepareCommit`).
+
+    Parameters
+    ----------
+    info : dict
+        Connection info dictionary pending changes were recorded in
+    """
+    tables = info.pop("committedTables", None)
+    if tables:
+        increment(*tables)
+
+
+def rollback(info):
+    """Discard pending changes.
+
+    Parameters
+    ----------
+    info : dict
+        Connection info dictionary pending changes were recorded in
+    """
+    info.pop("changedTables", None)
+    info.pop("committedTables", None)
+
+
+_init()
@@ -10,7 +10,11 @@ from os import scandir
 
 _defaultConfig_ = {"openapi": {
                      "validateRequest": True,
-                     "validateResponse": True
+                     "validateResponse": True,
+                     "validateResponseSampleRate": 1.0,
+                     "validateResponseAsync": False,
+                     "validateResponseWorkers": 2,
+                     "validateResponseQueue": 16
                    },
                    "options": {
                      "disableDB": False,
@@ -26,13 +30,89 @@ _defaultConfig_ = {"openapi": {
                      "userStorageLevels": 2,
                      "domainAcceleratedStorage": None,
                      "userAcceleratedStorage": None,
+                     "cacheDir": "/var/cache/grammm/admin-api",
+                     "requestTiming": False,
+                     "metricsDir": None,
+                     "metricsFlushInterval": 5,
+                     "jsonBackend": "auto",
+                     "streamListThreshold": 1000,
+                     "etagLifetime": 300,
+                     "singleFlight": False,
+                     "singleFlightTimeout": 30,
+                     "slowRequestThreshold": None,
+                     "slowRequestMaxStatements": 200,
                      "dashboard": {
                        "services": []
                      }
                    },
+                   "compression": {
+                     "enabled": False,
+                     "minSize": 1024,
+                     "gzipLevel": 6,
+                     "brotli": True,
+                     "brotliLevel": 4
+                   },
+                   "asgi": {
+                     "threads": 32,
+                     "blockingThreads": 256,
+                     "blockingRoutes": {"ldap": "/ldap/",
+                                        "folders": "/domains/\\d+/folders",
+                                        "downsync": "/domains/\\d+/users/\\d+/downsync$"}
+                   },
+                   "sqlAudit": {
+                     "mode": None,
+                     "budget": 50,
+                     "repeatThreshold": 10,
+                     "budgets": {}
+                   },
+                   "tracing": {
+                     "enabled": False,
+                     "exporter": "file",
+                     "file": None,
+                     "endpoint": "http://localhost:4318/v1/traces",
+                     "serviceName": "grammm-admin-api",
+                     "sampleRate": 1.0,
+                     "flushInterval": 5,
+                     "maxQueueSize": 10000
+                   },
+                   "jobs": {
+                     "workers": 2,
+                     "retention": 86400
+                   },
+                   "passwords": {
+                     "scheme": "md5",
+                     "workers": 4,
+                     "queue": 64,
+                     "maxLength": 40,
+                     "sha512Rounds": 5000,
+                     "bcryptRounds": 12,
+                     "argon2TimeCost": 2,
+                     "argon2MemoryCost": 65536,
+                     "argon2Parallelism": 1
+                   },
+                   "ldapPool": {
+                     "size": 8,
+                     "idleTimeout": 300,
+                     "acquireTimeout": 10
+                   },
+                   "rateLimit": {
+                     "enabled": False,
+                     "classes": {
+                       "default": {"rate": 20, "burst": 100},
+                       "ldap": {"rate": 0.5, "burst": 5},
+                       "list": {"rate": 5, "burst": 20}
+                     }
+                   },
                    "security": {
                      "jwtPrivateKeyFile": "res/jwt-privkey.pem",
-                     "jwtPublicKeyFile": "res/jwt-pubkey.pem"
+                     "jwtPublicKeyFile": "res/jwt-pubkey.pem",
+                     "jwtAlgorithm": "RS256",
+                     "jwtPreviousAlgorithm": "RS256",
+                     "tokenCacheSize": 4096,
+                     "userCacheSize": 1024,
+                     "userCacheLifetime": 60,
+                     "jwtPermissions": True,
+                     "jwtPermissionsLifetime": 3600
                    },
                    "mconf": {}
                    }
@@ -89,6 +169,8 @@ def _loadConfig_():
         logging.warn("Request validation is disabled!")
     if not config["openapi"]["validateResponse"]:
         logging.warn("Response validation is disabled!")
+    elif config["openapi"]["validateResponseAsync"]:
+        logging.warn("Asynchronous response validation enabled - invalid responses are only logged")
     return config
 
 
@@ -105,9 +187,11 @@ def validate():
     """
     from openapi_schema_validator import OAS30Validator
     from openapi_spec_validator.exceptions import ValidationError
+    from . import filecache
     try:
-        with open("res/config.yaml") as file:
-            configSchema = yaml.load(file, yaml.loader.SafeLoader)
+        configSchema = filecache.load("config-schema", "res/config.yaml",
+                                      lambda data: yaml.load(data, getattr(yaml, "CSafeLoader", yaml.SafeLoader)),
+                                      (yaml.__version__,))
     except:
         return "Could not open schema file"
     validator = OAS30Validator(configSchema)
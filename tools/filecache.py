@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# SPDX-FileCopyrightText: 2021 grammm GmbH
+"""
+Persistent cache for processed resource files.
+
+Each cached object is stored together with a key derived from the file content and any additional context (e.g. library
+versions) that influence the result. If the key does not match, the file is processed again and the cache entry replaced.
+
+Any error during cache access is ignored and causes the file to be processed without caching.
+"""
+
+import hashlib
+import logging
+import os
+import pickle
+import sys
+import tempfile
+
+from .config import Config
+
+
+def _cacheFile(name):
+    cacheDir = Config["options"].get("cacheDir")
+    return None if cacheDir is None else os.path.join(cacheDir, name+".cache")
+
+
+def _read(path, key):
+    """Read cache entry.
+
+    Only files owned by the current user (or root) and not writable by others are accepted.
+
+    Returns
+    -------
+    bool
+        Whether a matching entry was found
+    Any
+        Cached object
+    """
+    try:
+        with open(path, "rb") as file:
+            stat = os.fstat(file.fileno())
+            if stat.st_uid not in (0, os.getuid()) or stat.st_mode & 0o022:
+                logging.warn("Ignoring cache file '{}' with unsafe permissions".format(path))
+                return False, None
+            cachedKey, obj = pickle.load(file)
+        return cachedKey == key, obj
+    except FileNotFoundError:
+        pass
+    except Exception as err:
+        logging.debug("Could not read cache file '{}': {}".format(path, err))
+    return False, None
+
+
+def _write(path, key, obj):
+    """Atomically replace cache entry."""
+    try:
+        os.makedirs(os.path.dirname(path), mode=0o755, exist_ok=True)
+        fd, tmpPath = tempfile.mkstemp(dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, "wb") as file:
+                pickle.dump((key, obj), file, pickle.HIGHEST_PROTOCOL)
+            os.chmod(tmpPath, 0o644)
+            os.replace(tmpPath, path)
+        except:
+            os.unlink(tmpPath)
+            raise
+    except Exception as err:
+        logging.debug("Could not write cache file '{}': {}".format(path, err))
+
+
+def load(name, path, loader, context=()):
+    """Load file using cached results if possible.
+
+    Parameters
+    ----------
+    name : str
+        Name of the cache entry
+    path : str
+        Path of the file to load
+    loader : Callable
+        Function creating the object from the file content (bytes). The result must be picklable.
+    context : Iterable, optional
+        Additional values influencing the result. The default is ().
+
+    Returns
+    -------
+    Any
+        Object returned by the loader
+    """
+    with open(path, "rb") as file:
+        data = file.read()
+    digest = hashlib.sha256(data)
+    for value in (sys.version,)+tuple(context):
+        digest.update(repr(value).encode("utf-8"))
+    key = digest.hexdigest()
+    cacheFile = _cacheFile(name)
+    if cacheFile is not None:
+        found, obj = _read(cacheFile, key)
+        if found:
+            return obj
+    obj = loader(data)
+    if cacheFile is not None:
+        _write(cacheFile, key, obj)
+    return obj
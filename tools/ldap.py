@@ -8,11 +8,18 @@ import re
 from ldap3.utils.conv import escape_filter_chars
 
 import logging
+import os
+import threading
 import yaml
+from contextlib import contextmanager
+from time import monotonic, perf_counter
 
-from . import mconf
+from . import mconf, metrics, tracing
+from .config import Config
 from .misc import GenericObject
 
+ldapMetric = metrics.Histogram("grammm_admin_ldap_call_duration_seconds", "Duration of LDAP operations", ("operation",))
+
 
 class LDAPGuard:
     """LDAP connection proxy class."""
@@ -31,14 +38,19 @@ class LDAPGuard:
         attr = getattr(self.__obj, name)
         if callable(attr):
             def proxyfunc(*args, **kwargs):
+                start = perf_counter()
                 try:
-                    return attr(*args, **kwargs)
-                except (exc.LDAPSocketOpenError, exc.LDAPSocketSendError, exc.LDAPSessionTerminatedByServerError):
-                    logging.warn("LDAP socket error - reconnecting")
-                    if not self.__connect(True):
-                        raise self.error
-                    nattr = getattr(self.__obj, name)
-                    return nattr(*args, **kwargs)
+                    with tracing.span("LDAP "+name, tracing.KIND_CLIENT, **{"db.system": "ldap"}):
+                        try:
+                            return attr(*args, **kwargs)
+                        except (exc.LDAPSocketOpenError, exc.LDAPSocketSendError, exc.LDAPSessionTerminatedByServerError):
+                            logging.warn("LDAP socket error - reconnecting")
+                            if not self.__connect(True):
+                                raise self.error
+                            nattr = getattr(self.__obj, name)
+                            return nattr(*args, **kwargs)
+                finally:
+                    ldapMetric.observe(perf_counter()-start, name)
             return proxyfunc
         return attr
 
@@ -58,6 +70,167 @@ class LDAPGuard:
         return repr(self.__obj)
 
 
+class BindPool:
+    """Pool of LDAP connections used for searches and user authentication.
+
+    Connections are bound as the service account while idle. For an authentication, the connection is re-bound as the
+    user and back to the service account afterwards, so logins do not need to establish new TCP/TLS connections.
+    Each borrowed connection is used by a single thread only, so concurrent searches do not see each other's results.
+
+    Connections idle for more than `ldapPool.idleTimeout` seconds, closed connections and connections that failed to
+    return to the service account are discarded.
+    """
+
+    _socketErrors = (exc.LDAPSocketOpenError, exc.LDAPSocketSendError, exc.LDAPSocketReceiveError,
+                     exc.LDAPSessionTerminatedByServerError)
+
+    def __init__(self, size):
+        self.size = size
+        self._idle = []  # (connection, time returned to pool)
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(size)
+
+    @staticmethod
+    def _connect():
+        connection = ldapconf["connection"]
+        return _createConnection(connection.get("server"), connection.get("bindUser"), connection.get("bindPass"),
+                                 connection.get("starttls", False))
+
+    def _get(self):
+        """Get idle connection or create a new one. Must be called with a slot acquired."""
+        idleTimeout = Config["ldapPool"]["idleTimeout"]
+        now = monotonic()
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                conn, since = self._idle.pop()
+            if now-since <= idleTimeout and not conn.closed and conn.bound:
+                return conn
+            self._close(conn)
+        return self._connect()
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn.unbind()
+        except Exception:
+            pass
+
+    @contextmanager
+    def connection(self):
+        """Borrow connection from the pool.
+
+        The connection is returned to the pool when the context is left without exception.
+
+        Raises
+        ------
+        ldap3.core.exceptions.LDAPException
+            No connection could be established or the pool is exhausted
+        """
+        if not self._slots.acquire(timeout=Config["ldapPool"]["acquireTimeout"]):
+            raise exc.LDAPExceptionError("LDAP connection pool exhausted")
+        conn = None
+        try:
+            conn = self._get()
+            yield conn
+        except BaseException:
+            if conn is not None:
+                self._close(conn)
+            conn = None
+            raise
+        finally:
+            if conn is not None:
+                with self._lock:
+                    self._idle.append((conn, monotonic()))
+            self._slots.release()
+
+    def clear(self):
+        """Close all idle connections."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            self._close(conn)
+
+    def authenticate(self, userDN, password):
+        """Check user credentials by binding as the user.
+
+        Parameters
+        ----------
+        userDN : str
+            DN of the user
+        password : str
+            Password of the user
+
+        Returns
+        -------
+        bool
+            True if the bind was successful, False otherwise
+        """
+        with self.connection() as conn:
+            try:
+                success = conn.rebind(userDN, password, read_server_info=False)
+            except exc.LDAPBindError:
+                success = False
+            bindUser = ldapconf["connection"].get("bindUser")
+            if bindUser:
+                restored = conn.rebind(bindUser, ldapconf["connection"].get("bindPass"), read_server_info=False)
+            else:
+                conn.user = conn.password = None
+                restored = conn.rebind(authentication=ldap3.ANONYMOUS, read_server_info=False)
+            if not restored:
+                raise exc.LDAPBindError("Failed to restore service account bind")
+            return success
+
+    def search(self, *args, **kwargs):
+        """Run search on a pooled connection.
+
+        Returns
+        -------
+        list
+            Search response
+        list of ldap3.abstract.entry.Entry
+            Entries of the search response
+        """
+        for attempt in range(2):
+            try:
+                with self.connection() as conn:
+                    conn.search(*args, **kwargs)
+                    return conn.response, conn.entries
+            except self._socketErrors:
+                if attempt:
+                    raise
+                logging.warn("LDAP socket error - reconnecting")
+
+
+_bindPool = None
+_bindPoolLock = threading.Lock()
+_connLock = threading.Lock()  # Serializes searches on LDAPConn
+
+
+def _afterFork():
+    global _bindPool, _bindPoolLock, _connLock
+    _bindPool = None  # Connections of the parent must not be shared
+    _bindPoolLock = threading.Lock()
+    _connLock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_afterFork)
+
+
+def _getBindPool():
+    global _bindPool
+    size = Config["ldapPool"]["size"]
+    if size <= 0:
+        return None
+    if _bindPool is None:
+        with _bindPoolLock:
+            if _bindPool is None:
+                _bindPool = BindPool(size)
+    return _bindPool
+
+
 _defaultProps = {"storagequotalimit": mconf.LDAP.get("users", {}).get("defaultQuota", 42)}
 _unescapeRe = re.compile(rb"\\(?P<value>[a-fA-F0-9]{2})")
 _userAttributes = None
@@ -163,6 +336,32 @@ def _searchBase():
     return ldapconf["baseDn"]
 
 
+def _search(*args, **kwargs):
+    """Run LDAP search.
+
+    The results of a search are stored in the connection, so concurrent searches must not share a connection. If the
+    connection pool is enabled, the search runs on a pooled connection, otherwise searches on `LDAPConn` are serialized.
+
+    Returns
+    -------
+    list
+        Search response
+    list of ldap3.abstract.entry.Entry
+        Entries of the search response
+    """
+    pool = _getBindPool()
+    if pool is None:
+        with _connLock:
+            LDAPConn.search(*args, **kwargs)
+            return LDAPConn.response, LDAPConn.entries
+    start = perf_counter()
+    try:
+        with tracing.span("LDAP search", tracing.KIND_CLIENT, **{"db.system": "ldap"}):
+            return pool.search(*args, **kwargs)
+    finally:
+        ldapMetric.observe(perf_counter()-start, "search")
+
+
 def unescapeFilterChars(text):
     """Reverse escape_filter_chars function.
 
@@ -205,12 +404,25 @@ def authUser(ID, password):
     """
     if not LDAP_available:
         return "LDAP not configured"
-    LDAPConn.search(_searchBase(), _matchFilters(ID))
-    if len(LDAPConn.response) == 0:
+    if not password:
+        return "Invalid Username or password"
+    pool = _getBindPool()
+    if pool is None:
+        response, _ = _search(_searchBase(), _matchFilters(ID))
+    else:
+        start = perf_counter()
+        try:
+            with tracing.span("LDAP authUser", tracing.KIND_CLIENT, **{"db.system": "ldap"}):
+                response, _ = pool.search(_searchBase(), _matchFilters(ID))
+                if len(response) == 1:
+                    return None if pool.authenticate(response[0]["dn"], password) else "Invalid username or Password"
+        finally:
+            ldapMetric.observe(perf_counter()-start, "authUser")
+    if len(response) == 0:
         return "Invalid Username or password"
-    if len(LDAPConn.response) > 1:
+    if len(response) > 1:
         return "Multiple entries found - please contact your administrator"
-    userDN = LDAPConn.response[0]["dn"]
+    userDN = response[0]["dn"]
     try:
         ldap3.Connection(ldapconf["connection"].get("server"), user=userDN, password=password, auto_bind=True)
     except exc.LDAPBindError:
@@ -233,13 +445,13 @@ def getUserInfo(ID):
         return None
     users = ldapconf["users"]
     username, name = users["username"], users["displayName"]
-    LDAPConn.search(_searchBase(), _matchFilters(ID), attributes=[username, name, ldapconf["objectID"]])
-    if len(LDAPConn.response) != 1:
+    response, entries = _search(_searchBase(), _matchFilters(ID), attributes=[username, name, ldapconf["objectID"]])
+    if len(response) != 1:
         return None
-    return GenericObject(ID=LDAPConn.entries[0][ldapconf["objectID"]].raw_values[0],
-                         username=LDAPConn.entries[0][username].value,
-                         name=LDAPConn.entries[0][name].value,
-                         email=LDAPConn.entries[0][username].value)
+    return GenericObject(ID=entries[0][ldapconf["objectID"]].raw_values[0],
+                         username=entries[0][username].value,
+                         name=entries[0][name].value,
+                         email=entries[0][username].value)
 
 
 def getAll(IDs):
@@ -261,12 +473,12 @@ def getAll(IDs):
         return []
     users = ldapconf["users"]
     username, name= users["username"], users["displayName"]
-    LDAPConn.search(_searchBase(), _matchFiltersMulti(IDs), attributes=[username, name, ldapconf["objectID"]])
+    _, entries = _search(_searchBase(), _matchFiltersMulti(IDs), attributes=[username, name, ldapconf["objectID"]])
     return [GenericObject(ID=entry[ldapconf["objectID"]].raw_values[0],
                           username=entry[username].value,
                           name=entry[name].value,
                           email=entry[username].value)
-            for entry in LDAPConn.entries]
+            for entry in entries]
 
 
 def downsyncUser(ID, props=None):
@@ -293,12 +505,12 @@ def downsyncUser(ID, props=None):
     """
     if not LDAP_available:
         return None
-    LDAPConn.search(_searchBase(), _matchFilters(ID), attributes=["*", ldapconf["objectID"]])
-    if len(LDAPConn.response) == 0:
+    response, entries = _search(_searchBase(), _matchFilters(ID), attributes=["*", ldapconf["objectID"]])
+    if len(response) == 0:
         return None
-    if len(LDAPConn.response) > 1:
+    if len(response) > 1:
         raise RuntimeError("Multiple entries found - aborting")
-    ldapuser = LDAPConn.entries[0]
+    ldapuser = entries[0]
     userdata = dict(username=ldapuser[ldapconf["users"]["username"]].value)
     userdata["properties"] = props or _defaultProps.copy()
     userdata["properties"].update({prop: ldapuser[attr].value for attr, prop in _userAttributes.items() if attr in ldapuser})
@@ -329,14 +541,14 @@ def searchUsers(query, domains=None):
         exact = [] if exact is None else [exact]
     except:
         exact = []
-    LDAPConn.search(_searchBase(),
-                    _searchFilters(query, domains),
-                    attributes=[IDattr, name, email],
-                    paged_size=25)
+    _, entries = _search(_searchBase(),
+                         _searchFilters(query, domains),
+                         attributes=[IDattr, name, email],
+                         paged_size=25)
     return exact+[GenericObject(ID=result[IDattr].raw_values[0],
                                 email=result[email].value,
                                 name=result[name].value)
-                  for result in LDAPConn.entries]
+                  for result in entries]
 
 
 def dumpUser(ID):
@@ -352,8 +564,8 @@ def dumpUser(ID):
     ldap3.abstract.entry.Entry
         LDAP object or None if not found or ambiguous
     """
-    LDAPConn.search(_searchBase(), _matchFilters(ID), attributes=["*", ldapconf["objectID"]])
-    return LDAPConn.entries[0] if len(LDAPConn.entries) == 1 else None
+    _, entries = _search(_searchBase(), _matchFilters(ID), attributes=["*", ldapconf["objectID"]])
+    return entries[0] if len(entries) == 1 else None
 
 
 def _createConnection(server, bindUser, bindPass, starttls):
@@ -414,6 +626,8 @@ def reloadConfig(conf=None):
         LDAPConn, _userAttributes = _testConfig(conf)
         ldapconf = conf
         LDAP_available = LDAPConn is not None
+        if _bindPool is not None:
+            _bindPool.clear()
         return
     except KeyError as err:
         return "Incomplete LDAP configuration: "+err.args[0]
@@ -428,6 +642,8 @@ def disable():
     global LDAPConn, LDAP_available
     LDAPConn = None
     LDAP_available = False
+    if _bindPool is not None:
+        _bindPool.clear()
 
 
 def _init():
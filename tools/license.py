@@ -2,9 +2,6 @@
 # SPDX-License-Identifier: AGPL-3.0-or-later
 # SPDX-FileCopyrightText: 2020 grammm GmbH
 
-from cryptography import x509
-from cryptography.hazmat.backends import default_backend
-
 from datetime import datetime, MINYEAR, MAXYEAR
 
 import logging
@@ -42,6 +39,8 @@ def _defaultLicense():
 
 
 def _processCertificate(data):
+    from cryptography import x509
+    from cryptography.hazmat.backends import default_backend
     try:
         cert = x509.load_pem_x509_certificate(data, default_backend())
         GrammmLicense.validate(cert)
@@ -76,7 +75,7 @@ def loadCertificate():
         logging.warn("Could not load license: "+err.args[1])
 
 
-_license = loadCertificate() or _defaultLicense()
+_license = None  # Loaded on first access
 
 
 def updateCertificate(data):
@@ -98,6 +97,8 @@ def updateCertificate(data):
 
 def getLicense():
     global _license
+    if _license is None:
+        _license = loadCertificate() or _defaultLicense()
     if _license.error:
         _license = _defaultLicense()
     return _license
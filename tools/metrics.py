@@ -0,0 +1,342 @@
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# SPDX-FileCopyrightText: 2021 grammm GmbH
+"""
+Process-local metrics registry with Prometheus text exposition.
+
+Metrics are kept in memory and updated under a per-metric lock, which is uncontended in the common case.
+
+When running with multiple worker processes, each process periodically writes its values to a file in
+`options.metricsDir`. The exposition then aggregates the files of all processes: counters and histograms are summed
+over all files, gauges only over processes that are still alive.
+The directory should be emptied when the service is (re-)started.
+"""
+
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from bisect import bisect_left
+from functools import wraps
+from inspect import isfunction
+from time import perf_counter
+
+from .config import Config
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+_metrics = {}
+_fileName = None
+_lastFlush = 0
+
+
+class _Metric:
+    """Base class for all metrics."""
+
+    type = None
+
+    def __init__(self, name, documentation, labelNames=()):
+        """Create and register metric.
+
+        Parameters
+        ----------
+        name : str
+            Name of the metric
+        documentation : str
+            Help text
+        labelNames : tuple of str, optional
+            Names of the labels. The default is ().
+        """
+        if name in _metrics:
+            raise ValueError("Duplicate metric '{}'".format(name))
+        self.name = name
+        self.documentation = documentation
+        self.labelNames = tuple(labelNames)
+        self._lock = threading.Lock()
+        self._values = {}
+        _metrics[name] = self
+
+    def _add(self, labels, value):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0)+value
+
+    def _reset(self):
+        with self._lock:
+            self._values = {}
+
+    def snapshot(self):
+        """Return copy of the current values, mapping label value tuples to values."""
+        with self._lock:
+            return {labels: value.copy() if isinstance(value, list) else value for labels, value in self._values.items()}
+
+
+class Counter(_Metric):
+    """Monotonically increasing counter."""
+
+    type = "counter"
+
+    def inc(self, *labels, value=1):
+        """Increment counter.
+
+        Parameters
+        ----------
+        *labels : str
+            Label values, in the order of the label names
+        value : float, optional
+            Value to add. The default is 1.
+        """
+        self._add(labels, value)
+
+
+class Gauge(_Metric):
+    """Value that can go up and down."""
+
+    type = "gauge"
+
+    def inc(self, *labels, value=1):
+        self._add(labels, value)
+
+    def dec(self, *labels, value=1):
+        self._add(labels, -value)
+
+
+class Histogram(_Metric):
+    """Distribution of observed values, counted in buckets."""
+
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelNames=(), buckets=DEFAULT_BUCKETS):
+        """Create and register histogram.
+
+        Parameters
+        ----------
+        name : str
+            Name of the metric
+        documentation : str
+            Help text
+        labelNames : tuple of str, optional
+            Names of the labels. The default is ().
+        buckets : tuple of float, optional
+            Sorted upper bounds of the buckets. An additional +Inf bucket is added automatically.
+            The default is DEFAULT_BUCKETS.
+        """
+        super().__init__(name, documentation, labelNames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        """Record observation.
+
+        Parameters
+        ----------
+        value : float
+            Observed value
+        *labels : str
+            Label values, in the order of the label names
+        """
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            data = self._values.get(labels)
+            if data is None:  # Non-cumulative bucket counts, +Inf bucket, sum
+                data = self._values[labels] = [0]*(len(self.buckets)+2)
+            data[index] += 1
+            data[-1] += value
+
+    def time(self, *labels):
+        """Return context manager observing the duration of the enclosed block."""
+        return _Timer(self, labels)
+
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "start")
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = perf_counter()
+
+    def __exit__(self, *args):
+        self.histogram.observe(perf_counter()-self.start, *self.labels)
+
+
+def instrument(cls, histogram):
+    """Time all public methods of a class.
+
+    Parameters
+    ----------
+    cls : type
+        Class to instrument. Methods are replaced in place.
+    histogram : Histogram
+        Histogram to record durations in. Must have a single label, which is set to the method name.
+    """
+    def timed(name, func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                histogram.observe(perf_counter()-start, name)
+        return wrapper
+
+    for name, attr in list(vars(cls).items()):
+        if not name.startswith("_") and isfunction(attr):
+            setattr(cls, name, timed(name, attr))
+
+
+def _metricsDir():
+    return Config["options"].get("metricsDir")
+
+
+def _afterFork():
+    """Reset metrics in a newly forked process, values of the parent are reported by the parent."""
+    global _fileName, _lastFlush
+    _fileName = None
+    _lastFlush = 0
+    for metric in _metrics.values():
+        metric._lock = threading.Lock()
+        metric._values = {}
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_afterFork)
+
+
+def _dump():
+    """Create JSON serializable representation of all metric values."""
+    return {"pid": os.getpid(),
+            "metrics": {name: [[list(labels), value] for labels, value in metric.snapshot().items()]
+                        for name, metric in _metrics.items()}}
+
+
+def flush(force=False):
+    """Write metrics of the current process to the metrics directory.
+
+    Does nothing if no directory is configured or if the last write was less than `options.metricsFlushInterval`
+    seconds ago (unless `force` is set).
+
+    Parameters
+    ----------
+    force : bool, optional
+        Ignore flush interval. The default is False.
+    """
+    global _fileName, _lastFlush
+    metricsDir = _metricsDir()
+    if metricsDir is None:
+        return
+    now = time.monotonic()
+    if not force and now-_lastFlush < Config["options"]["metricsFlushInterval"]:
+        return
+    _lastFlush = now
+    if _fileName is None:
+        _fileName = "{}-{}.json".format(os.getpid(), int(time.time()*1000000))
+    try:
+        os.makedirs(metricsDir, mode=0o755, exist_ok=True)
+        fd, tmpPath = tempfile.mkstemp(dir=metricsDir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as file:
+                json.dump(_dump(), file, separators=(",", ":"))
+            os.replace(tmpPath, os.path.join(metricsDir, _fileName))
+        except:
+            os.unlink(tmpPath)
+            raise
+    except Exception as err:
+        logging.warn("Could not write metrics file: {}".format(err))
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _collect():
+    """Collect metric values of all processes.
+
+    Returns
+    -------
+    dict
+        Mapping of metric names to dicts mapping label value tuples to values
+    """
+    metricsDir = _metricsDir()
+    if metricsDir is None:
+        return {name: metric.snapshot() for name, metric in _metrics.items()}
+    flush(True)
+    values = {name: {} for name in _metrics}
+    try:
+        files = [entry.path for entry in os.scandir(metricsDir) if entry.name.endswith(".json")]
+    except FileNotFoundError:
+        files = []
+    for path in files:
+        try:
+            with open(path) as file:
+                data = json.load(file)
+        except Exception as err:
+            logging.warn("Could not read metrics file '{}': {}".format(path, err))
+            continue
+        alive = data["pid"] == os.getpid() or _alive(data["pid"])
+        for name, samples in data["metrics"].items():
+            metric = _metrics.get(name)
+            if metric is None or (metric.type == "gauge" and not alive):
+                continue
+            target = values[name]
+            for labels, value in samples:
+                labels = tuple(labels)
+                if labels not in target:
+                    target[labels] = value
+                elif isinstance(value, list):
+                    target[labels] = [a+b for a, b in zip(target[labels], value)]
+                else:
+                    target[labels] += value
+    return values
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _labelString(names, values, extra=None):
+    pairs = ["{}=\"{}\"".format(name, _escape(value)) for name, value in zip(names, values)]
+    if extra is not None:
+        pairs.append("{}=\"{}\"".format(*extra))
+    return "{"+",".join(pairs)+"}" if pairs else ""
+
+
+def _formatValue(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def exposition():
+    """Generate Prometheus text exposition of all metrics.
+
+    Returns
+    -------
+    str
+        Metrics in Prometheus text format (version 0.0.4)
+    """
+    lines = []
+    for name, samples in _collect().items():
+        metric = _metrics[name]
+        lines.append("# HELP {} {}".format(name, metric.documentation.replace("\\", "\\\\").replace("\n", "\\n")))
+        lines.append("# TYPE {} {}".format(name, metric.type))
+        for labels, value in sorted(samples.items()):
+            if metric.type != "histogram":
+                lines.append("{}{} {}".format(name, _labelString(metric.labelNames, labels), _formatValue(value)))
+                continue
+            cumulative = 0
+            for bound, count in zip(metric.buckets+("+Inf",), value):
+                cumulative += count
+                lines.append("{}_bucket{} {}".format(name, _labelString(metric.labelNames, labels, ("le", bound)),
+                                                     cumulative))
+            lines.append("{}_sum{} {}".format(name, _labelString(metric.labelNames, labels), _formatValue(value[-1])))
+            lines.append("{}_count{} {}".format(name, _labelString(metric.labelNames, labels), cumulative))
+    return "\n".join(lines)+"\n"
@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# SPDX-FileCopyrightText: 2021 grammm GmbH
+"""
+Password hashing.
+
+New passwords are hashed with the scheme configured by `passwords.scheme`:
+    - md5: MD5-crypt
+    - sha512: SHA512-crypt with `passwords.sha512Rounds` rounds
+    - bcrypt: bcrypt with 2^`passwords.bcryptRounds` rounds (requires the bcrypt module or a bcrypt capable crypt(3))
+    - argon2: Argon2id (requires the argon2-cffi module)
+
+Existing hashes of all schemes can be verified independent of the configured scheme. `needsUpdate` reports hashes
+using a weaker scheme or a lower cost than configured, so they can be replaced after a successful login. Hashes using a
+stronger scheme are never replaced.
+
+Hashing and verification run in a dedicated pool of `passwords.workers` threads, so slow hashes cannot occupy more
+CPU than intended. At most `passwords.queue` operations wait for a free worker, further operations fail with
+`PasswordHashBusy`.
+"""
+
+import crypt
+import hmac
+import logging
+import os
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+from .config import Config
+
+try:
+    import bcrypt
+except ImportError:
+    bcrypt = None
+
+try:
+    import argon2
+except ImportError:
+    argon2 = None
+
+_executor = None
+_slots = None
+_lock = threading.Lock()
+_argon2Hasher = None
+_schemeUsable = None
+_strength = {"des": 0, "md5": 1, "sha256": 2, "sha512": 2, "bcrypt": 3, "argon2": 4}
+
+
+class PasswordHashBusy(RuntimeError):
+    pass
+
+
+def _afterFork():
+    global _executor, _slots, _lock
+    _executor = _slots = None
+    _lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_afterFork)
+
+
+def _argon2():
+    global _argon2Hasher
+    if _argon2Hasher is None:
+        config = Config["passwords"]
+        _argon2Hasher = argon2.PasswordHasher(time_cost=config["argon2TimeCost"],
+                                              memory_cost=config["argon2MemoryCost"],
+                                              parallelism=config["argon2Parallelism"])
+    return _argon2Hasher
+
+
+def _schemeHash(password):
+    """Hash password with the configured scheme. Returns None if the scheme is not available."""
+    config = Config["passwords"]
+    scheme = config["scheme"]
+    if scheme == "argon2":
+        return None if argon2 is None else _argon2().hash(password)
+    if scheme == "bcrypt" and bcrypt is not None:
+        return bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt(config["bcryptRounds"])).decode("ascii")
+    if scheme == "bcrypt":
+        return crypt.crypt(password, crypt.mksalt(crypt.METHOD_BLOWFISH, rounds=1 << config["bcryptRounds"]))
+    if scheme == "sha512":
+        return crypt.crypt(password, crypt.mksalt(crypt.METHOD_SHA512, rounds=config["sha512Rounds"]))
+    return crypt.crypt(password, crypt.mksalt(crypt.METHOD_MD5))
+
+
+def _usable():
+    """Check once whether the configured scheme is available and fits into `passwords.maxLength`."""
+    global _schemeUsable
+    if _schemeUsable is None:
+        config = Config["passwords"]
+        hashed = _schemeHash("")
+        _schemeUsable = hashed is not None and len(hashed) <= config["maxLength"]
+        if not _schemeUsable:
+            logging.warn("Cannot create {} password hashes{} - using md5".format(
+                config["scheme"], "" if hashed is None else " fitting into passwords.maxLength"))
+    return _schemeUsable
+
+
+def _hash(password):
+    if _usable():
+        return _schemeHash(password)
+    return crypt.crypt(password, crypt.mksalt(crypt.METHOD_MD5))
+
+
+def _verify(password, hashed):
+    if not hashed:
+        return False
+    if hashed.startswith("$argon2"):
+        if argon2 is None:
+            logging.error("Cannot verify argon2 password hash: argon2-cffi is not installed")
+            return False
+        try:
+            return _argon2().verify(hashed, password)
+        except argon2.exceptions.VerificationError:
+            return False
+        except argon2.exceptions.InvalidHash:
+            return False
+    if hashed[:4] in ("$2a$", "$2b$", "$2y$") and bcrypt is not None:
+        try:
+            return bcrypt.checkpw(password.encode("utf-8"), hashed.encode("ascii"))
+        except ValueError:
+            return False
+    result = crypt.crypt(password, hashed)
+    return result is not None and hmac.compare_digest(result, hashed)
+
+
+def _hashScheme(hashed):
+    """Determine scheme of a password hash. Returns None for unknown schemes."""
+    if hashed.startswith("$argon2"):
+        return "argon2"
+    if hashed[:4] in ("$2a$", "$2b$", "$2y$"):
+        return "bcrypt"
+    if not hashed.startswith("$"):
+        return "des"
+    return {"$1$": "md5", "$5$": "sha256", "$6$": "sha512"}.get(hashed[:3])
+
+
+def _rounds(hashed, default):
+    """Get rounds parameter of a SHA-crypt hash."""
+    rounds = hashed.split("$")[2]
+    return int(rounds[7:]) if rounds.startswith("rounds=") else default
+
+
+def _run(func, *args):
+    """Execute function in the hashing pool and wait for the result."""
+    global _executor, _slots
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                config = Config["passwords"]
+                _slots = threading.BoundedSemaphore(config["workers"]+config["queue"])
+                _executor = ThreadPoolExecutor(config["workers"], "passwd")
+    if not _slots.acquire(False):
+        raise PasswordHashBusy("Too many concurrent password operations")
+    try:
+        return _executor.submit(func, *args).result()
+    finally:
+        _slots.release()
+
+
+def hash(password):
+    """Hash password using the configured scheme.
+
+    Parameters
+    ----------
+    password : str
+        Clear text password
+
+    Returns
+    -------
+    str
+        Password hash
+
+    Raises
+    ------
+    PasswordHashBusy
+        The hashing pool is exhausted
+    """
+    return _run(_hash, password)
+
+
+def verify(password, hashed):
+    """Check password against hash.
+
+    Parameters
+    ----------
+    password : str
+        Clear text password
+    hashed : str
+        Password hash
+
+    Returns
+    -------
+    bool
+        True if the password matches, False otherwise
+
+    Raises
+    ------
+    PasswordHashBusy
+        The hashing pool is exhausted
+    """
+    return _run(_verify, password, hashed)
+
+
+def needsUpdate(hashed):
+    """Check whether a hash should be replaced by a hash using the configured scheme.
+
+    Hashes are only replaced if the configured scheme is stronger, or if it is the same scheme with a higher cost
+    (any different parameters for argon2). Hashes of unknown or stronger schemes are kept.
+
+    Parameters
+    ----------
+    hashed : str
+        Password hash
+
+    Returns
+    -------
+    bool
+        True if the hash should be replaced, False otherwise
+    """
+    if not hashed:
+        return False
+    config = Config["passwords"]
+    scheme = config["scheme"] if _usable() else "md5"
+    current = _hashScheme(hashed)
+    if current is None:
+        return False
+    if current != scheme:
+        return _strength[current] < _strength[scheme]
+    try:
+        if scheme == "argon2":
+            return _argon2().check_needs_rehash(hashed)
+        if scheme == "bcrypt":
+            return int(hashed[4:6]) < config["bcryptRounds"]
+        if scheme == "sha512":
+            return _rounds(hashed, 5000) < config["sha512Rounds"]
+    except Exception:
+        return False
+    return False
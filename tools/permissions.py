@@ -6,6 +6,9 @@ class Permissions:
     """Central Permissions class.
 
     Functions as a permission factory and provides easy permission checking.
+
+    System and domain admin permissions are compiled into a sysadmin flag, a wildcard domain flag and a set of domain
+    IDs on initialization, so checking them does not depend on the number of held permissions.
     """
 
     preg = {}
@@ -19,6 +22,11 @@ class Permissions:
             Permissions held by the object
         """
         self.permissions = args
+        self.sysadmin = any(isinstance(permission, SystemAdminPermission) for permission in args)
+        domains = {permission.domainID for permission in args if isinstance(permission, DomainAdminPermission)}
+        self.wildcard = "*" in domains
+        self.domains = frozenset(domains-{"*"})
+        self._capabilities = frozenset().union(*(permission.capabilities() for permission in args))
 
     @classmethod
     def fromDB(cls, permissionsData=[]):
@@ -51,8 +59,26 @@ class Permissions:
         bool
             True if the requested permission is represented, False otherwise
         """
+        if self.sysadmin:
+            return True
+        permission_t = type(permission)
+        if permission_t == SystemAdminPermission:
+            return False
+        if permission_t == DomainAdminPermission:
+            domainID = permission.domainID
+            return self.wildcard or (len(self.domains) > 0 if domainID == "*" else domainID in self.domains)
         return any(perm.permits(permission) for perm in self.permissions)
 
+    def domainIDs(self):
+        """Return IDs of the domains the permissions grant admin access to.
+
+        Returns
+        -------
+        frozenset or None
+            Set of domain IDs, or None if access to all domains is granted
+        """
+        return None if self.sysadmin or self.wildcard else self.domains
+
     def __contains__(self, permission):
         """Convenience alias for `has`.
 
@@ -152,7 +178,7 @@ class Permissions:
         set
             Union of capabilities from all permissions
         """
-        return set.union(*(permission.capabilities() for permission in self.permissions))
+        return set(self._capabilities)
 
 
 class PermissionBase:
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# SPDX-FileCopyrightText: 2021 grammm GmbH
+"""
+Token bucket rate limiting.
+
+Each combination of route class and client (user name or address) has a bucket holding up to `burst` tokens, which is
+refilled with `rate` tokens per second. Every request takes one token and is rejected if the bucket is empty.
+
+The buckets are stored in a memory mapped file in `options.cacheDir`, so all worker processes share them. Buckets are
+mapped to pairs of slots by a hash of their key. If both slots of a pair are occupied by other keys, the least recently
+used one is replaced. If the file cannot be used, buckets are kept per process.
+"""
+
+import fcntl
+import hashlib
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+
+from .config import Config
+
+_slots = 4096  # Must be even
+_slotFormat = struct.Struct("Qdd")  # Key hash, tokens, last update
+_lock = threading.Lock()
+
+_file = None
+_map = bytearray(_slots*_slotFormat.size)
+
+
+def _afterFork():
+    global _lock
+    _lock = threading.Lock()
+
+
+def _init():
+    """Open and map bucket file."""
+    global _file, _map
+    cacheDir = Config["options"].get("cacheDir")
+    if cacheDir is None or not Config["rateLimit"]["enabled"]:
+        return
+    try:
+        os.makedirs(cacheDir, mode=0o755, exist_ok=True)
+        fd = os.open(os.path.join(cacheDir, "ratelimit.buckets"), os.O_RDWR | os.O_CREAT, 0o644)
+        fcntl.lockf(fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(fd).st_size < len(_map):
+                os.ftruncate(fd, len(_map))
+        finally:
+            fcntl.lockf(fd, fcntl.LOCK_UN)
+        _map = mmap.mmap(fd, len(_map))
+        _file = fd
+    except Exception as err:
+        logging.warn("Could not initialize shared rate limit buckets: {} - using per process buckets".format(err))
+    if hasattr(os, "register_at_fork"):
+        os.register_at_fork(after_in_child=_afterFork)
+
+
+def _take(keyHash, rate, burst, now):
+    """Take token from bucket. Must be called with the slot pair locked."""
+    base = keyHash % (_slots//2)*2
+    slots = [(base+i)*_slotFormat.size for i in (0, 1)]
+    entries = [_slotFormat.unpack_from(_map, offset) for offset in slots]
+    for offset, (slotHash, tokens, last) in zip(slots, entries):
+        if slotHash == keyHash:
+            elapsed = now-last
+            tokens = burst if elapsed < 0 else min(burst, tokens+elapsed*rate)  # Clock reset after reboot
+            break
+    else:  # Replace least recently used slot
+        offset = slots[0] if entries[0][2] <= entries[1][2] else slots[1]
+        tokens = burst
+    retry = 0 if tokens >= 1 else (1-tokens)/rate
+    if not retry:
+        tokens -= 1
+    _slotFormat.pack_into(_map, offset, keyHash, tokens, now)
+    return retry
+
+
+def acquire(routeClass, client):
+    """Take a token from the bucket of a client.
+
+    Parameters
+    ----------
+    routeClass : str
+        Name of the route class. If it is not configured in `rateLimit.classes`, the `default` class is used.
+    client : str
+        Client identifier (e.g. user name)
+
+    Returns
+    -------
+    float
+        0 if the request is allowed, otherwise the number of seconds until a token becomes available
+    """
+    classes = Config["rateLimit"]["classes"]
+    limits = classes.get(routeClass) or classes.get("default")
+    if not limits:
+        return 0
+    rate, burst = limits["rate"], limits["burst"]
+    if rate <= 0:
+        return 0
+    keyHash = struct.unpack("Q", hashlib.blake2b("{}\0{}".format(routeClass, client).encode("utf-8"),
+                                                  digest_size=8).digest())[0]
+    with _lock:
+        if _file is None:
+            return _take(keyHash, rate, burst, time.monotonic())
+        offset = keyHash % (_slots//2)*2*_slotFormat.size
+        fcntl.lockf(_file, fcntl.LOCK_EX, 2*_slotFormat.size, offset)
+        try:
+            return _take(keyHash, rate, burst, time.monotonic())
+        finally:
+            fcntl.lockf(_file, fcntl.LOCK_UN, 2*_slotFormat.size, offset)
+
+
+_init()
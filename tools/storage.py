@@ -15,6 +15,7 @@ from tools.exmdb.user import User as UserExmdb
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 
+from tools import tracing
 from tools.config import Config
 from tools.constants import PropTags, ConfigIDs, PublicFIDs, PrivateFIDs, Permissions, Misc, FolderNames
 from tools.rop import ntTime
@@ -151,6 +152,7 @@ class DomainSetup(SetupContext):
         self.success = False
         self.error = self.errorCode = None
 
+    @tracing.traced("DomainSetup.run")
     def run(self):
         """Run domain home directory initialization."""
         try:
@@ -169,6 +171,7 @@ class DomainSetup(SetupContext):
             self.error = "Unknown error"
             self.errorCode = 500
 
+    @tracing.traced("DomainSetup.createHomedir")
     def createHomedir(self):
         """Set up directory structure for a domain.
 
@@ -190,6 +193,7 @@ class DomainSetup(SetupContext):
         os.mkdir(self.domain.homedir+"/log")
         os.mkdir(self.domain.homedir+"/tmp")
 
+    @tracing.traced("DomainSetup.createExmdb")
     def createExmdb(self):
         """Create exchange SQLite database for domain.
 
@@ -264,6 +268,7 @@ class UserSetup(SetupContext):
         self.success = False
         self.error = self.errorCode = None
 
+    @tracing.traced("UserSetup.run")
     def run(self):
         """Run user home directory initialization."""
         try:
@@ -284,6 +289,7 @@ class UserSetup(SetupContext):
             self.error = "Unknown error"
             self.errorCode = 500
 
+    @tracing.traced("UserSetup.createHomedir")
     def createHomedir(self):
         """Set up directory structure for a user.
 
@@ -342,6 +348,7 @@ class UserSetup(SetupContext):
         self.exmdb.add(self.schema.FolderProperties(folderID=folderID, proptag=PropTags.CHANGEKEY, propval=xidData))
         self.exmdb.add(self.schema.FolderProperties(folderID=folderID, proptag=PropTags.PREDECESSORCHANGELIST, propval=b'\x16'+xidData))
 
+    @tracing.traced("UserSetup.createExmdb")
     def createExmdb(self):
         """Create exchange SQLite database for user.
 
@@ -420,6 +427,7 @@ class UserSetup(SetupContext):
         self.exmdb.commit()
         self.exmdb = None
 
+    @tracing.traced("UserSetup.createMidb")
     def createMidb(self):
         """Create midb SQLite database for user.
 
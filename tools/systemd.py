@@ -3,12 +3,12 @@
 # SPDX-FileCopyrightText: 2020 grammm GmbH
 
 import threading
-import dbus
-import dbus.mainloop.glib
 
-from gi.repository import GLib
 from datetime import datetime
 
+dbus = GLib = None  # Imported on first use
+_setupLock = threading.Lock()
+
 class Future:
     def __init__(self):
         self._event = threading.Event()
@@ -22,7 +22,24 @@ class Future:
         return self._value
 
 
-dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)
+def _setupDBus():
+    """Import DBus and GLib modules and install the GLib main loop.
+
+    Deferred until the first Systemd object is created, as the imports are expensive and most processes never use
+    systemd.
+    """
+    global dbus, GLib
+    if dbus is not None:
+        return
+    with _setupLock:
+        if dbus is not None:
+            return
+        import dbus as _dbus
+        import dbus.mainloop.glib as _mainloop  # Binds the local name only
+        from gi.repository import GLib as _GLib
+        _mainloop.DBusGMainLoop(set_as_default=True)
+        GLib = _GLib
+        dbus = _dbus  # Set last, marks setup as complete
 
 
 class Systemd:
@@ -43,6 +60,7 @@ class Systemd:
             Whether connect to system DBus. By default, the session DBus is used.
 
         """
+        _setupDBus()
         self._runEventLoop()
         self.bus = (dbus.SystemBus if system else dbus.SessionBus)()
         systemd = self.bus.get_object(self.DBusSystemd, "/org/freedesktop/systemd1")
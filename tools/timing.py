@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# SPDX-FileCopyrightText: 2021 grammm GmbH
+
+from time import perf_counter
+
+
+class PhaseTimer:
+    """Measure durations of consecutive processing phases.
+
+    Phases are ended by calling `mark`, which attributes the time since the last mark to the phase.
+    Nested phases (e.g. JSON encoding during endpoint execution) can be recorded with `add` and are excluded from the
+    enclosing phase.
+    """
+
+    def __init__(self):
+        """Initialize timer and start the first phase."""
+        self.phases = {}
+        self.start = self._last = perf_counter()
+        self._nested = 0
+
+    def mark(self, name):
+        """End current phase.
+
+        Parameters
+        ----------
+        name : str
+            Name of the phase. Durations of phases with the same name are added.
+        """
+        now = perf_counter()
+        self.phases[name] = self.phases.get(name, 0)+now-self._last-self._nested
+        self._last = now
+        self._nested = 0
+
+    def add(self, name, duration):
+        """Record nested phase.
+
+        Parameters
+        ----------
+        name : str
+            Name of the phase. Durations of phases with the same name are added.
+        duration : float
+            Duration in seconds
+        """
+        self.phases[name] = self.phases.get(name, 0)+duration
+        self._nested += duration
+
+    def total(self):
+        """Return time since the timer was started (in seconds)."""
+        return perf_counter()-self.start
+
+    def serverTiming(self):
+        """Generate Server-Timing header value.
+
+        Returns
+        -------
+        str
+            Header value containing all phases and the total duration in milliseconds
+        """
+        return ", ".join("{};dur={:.3f}".format(name, duration*1000)
+                         for name, duration in tuple(self.phases.items())+(("total", self.total()),))
+
+    def todict(self):
+        """Return dictionary mapping phase names to durations in milliseconds."""
+        times = {name: round(duration*1000, 3) for name, duration in self.phases.items()}
+        times["total"] = round(self.total()*1000, 3)
+        return times
+
+
+class NullTimer:
+    """Timer stub doing nothing."""
+
+    def mark(self, name):
+        pass
+
+    def add(self, name, duration):
+        pass
+
+
+nullTimer = NullTimer()
@@ -0,0 +1,344 @@
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# SPDX-FileCopyrightText: 2021 grammm GmbH
+"""
+Lightweight tracing following the OpenTelemetry data model.
+
+Spans are collected per thread and exported in batches by a background thread in OTLP/JSON format, either appended to
+a local file (one batch per line, readable by the OpenTelemetry collector's `otlpjsonfile` receiver) or sent to an
+OTLP/HTTP collector endpoint.
+
+Incoming W3C `traceparent` headers are honored, so API spans can be part of an existing trace.
+
+If tracing is disabled, `span` returns a no-op context manager and instrumented functions are called directly.
+"""
+
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+import urllib.request
+
+from functools import wraps
+from inspect import isfunction
+
+from .config import Config
+
+KIND_INTERNAL = 1
+KIND_SERVER = 2
+KIND_CLIENT = 3
+
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+_config = Config["tracing"]
+enabled = _config["enabled"]
+if enabled and _config["exporter"] == "file" and not _config.get("file"):
+    logging.warn("Tracing enabled with file exporter, but no file configured - tracing disabled")
+    enabled = False
+
+_local = threading.local()
+_queue = None
+_exporter = None
+_lock = threading.Lock()
+
+
+def _now():
+    return int(time.time()*1000000000)
+
+
+class Span:
+    """Traced operation."""
+
+    __slots__ = ("traceID", "spanID", "parentID", "name", "kind", "start", "end", "attributes", "status", "message",
+                 "sampled")
+
+    def __init__(self, name, parent=None, kind=KIND_INTERNAL, attributes=None, traceID=None, parentID=None,
+                 sampled=None):
+        """Start span.
+
+        Parameters
+        ----------
+        name : str
+            Name of the span
+        parent : Span, optional
+            Parent span. The default is None, creating a root span.
+        kind : int, optional
+            Span kind. The default is KIND_INTERNAL.
+        attributes : dict, optional
+            Initial span attributes. The default is None.
+        traceID : str, optional
+            Trace ID of a remote parent. The default is None.
+        parentID : str, optional
+            Span ID of a remote parent. The default is None.
+        sampled : bool, optional
+            Sampling decision of a remote parent. The default is None.
+        """
+        if parent is not None:
+            traceID, parentID, sampled = parent.traceID, parent.spanID, parent.sampled
+        elif traceID is None:
+            traceID = "{:032x}".format(random.getrandbits(128))
+        if sampled is None:
+            sampled = random.random() < _config["sampleRate"]
+        self.traceID = traceID
+        self.spanID = "{:016x}".format(random.getrandbits(64))
+        self.parentID = parentID
+        self.name = name
+        self.kind = kind
+        self.attributes = attributes or {}
+        self.status = None
+        self.message = None
+        self.sampled = sampled
+        self.start = _now()
+        self.end = None
+
+    def setAttribute(self, key, value):
+        self.attributes[key] = value
+
+    def finish(self, error=None):
+        """End span and queue it for export.
+
+        Parameters
+        ----------
+        error : str or Exception, optional
+            Error that occurred during the operation. The default is None.
+        """
+        if self.end is not None:
+            return
+        self.end = _now()
+        if error is not None:
+            self.status = STATUS_ERROR
+            self.message = str(error)
+        if self.sampled:
+            _export(self)
+
+    def __enter__(self):
+        _stack().append(self)
+        return self
+
+    def __exit__(self, excType, exc, tb):
+        stack = _stack()
+        if stack and stack[-1] is self:
+            stack.pop()
+        self.finish(exc)
+
+    def toOTLP(self):
+        data = {"traceId": self.traceID, "spanId": self.spanID, "name": self.name, "kind": self.kind,
+                "startTimeUnixNano": str(self.start), "endTimeUnixNano": str(self.end),
+                "attributes": [_attribute(key, value) for key, value in self.attributes.items()]}
+        if self.parentID is not None:
+            data["parentSpanId"] = self.parentID
+        if self.status is not None:
+            data["status"] = {"code": self.status, "message": self.message or ""}
+        return data
+
+
+class _NullSpan:
+    """Span stub used when tracing is disabled."""
+
+    def setAttribute(self, key, value):
+        pass
+
+    def finish(self, error=None):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+nullSpan = _NullSpan()
+
+
+def _attribute(key, value):
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+def _stack():
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+
+def current():
+    """Return the active span of the current thread, or None."""
+    stack = getattr(_local, "stack", None)
+    return stack[-1] if stack else None
+
+
+def startSpan(name, kind=KIND_INTERNAL, attributes=None):
+    """Start span as child of the active span, without activating it.
+
+    The span must be ended explicitly by calling `finish`.
+
+    Returns
+    -------
+    Span
+        The new span, or a no-op span if tracing is disabled or the trace is not sampled
+    """
+    if not enabled:
+        return nullSpan
+    parent = current()
+    if parent is not None and not parent.sampled:
+        return nullSpan
+    return Span(name, parent, kind, attributes)
+
+
+def span(name, kind=KIND_INTERNAL, **attributes):
+    """Create span as child of the active span.
+
+    To be used as context manager, which activates the span for the enclosed block.
+
+    Returns
+    -------
+    Span
+        The new span, or a no-op span if tracing is disabled
+    """
+    if not enabled:
+        return nullSpan
+    return Span(name, current(), kind, attributes)
+
+
+def startTrace(name, traceparent=None, kind=KIND_SERVER, attributes=None):
+    """Start and activate root span, continuing a remote trace if a valid W3C traceparent header is given.
+
+    The span must be ended with `endTrace`.
+
+    Returns
+    -------
+    Span
+        The new span, or a no-op span if tracing is disabled
+    """
+    if not enabled:
+        return nullSpan
+    traceID = parentID = sampled = None
+    if traceparent:
+        parts = traceparent.strip().split("-")
+        if len(parts) >= 4 and len(parts[1]) == 32 and len(parts[2]) == 16:
+            try:
+                traceID, parentID, sampled = parts[1], parts[2], bool(int(parts[3], 16) & 1)
+            except ValueError:
+                traceID = parentID = sampled = None
+    span = Span(name, None, kind, attributes, traceID, parentID, sampled)
+    _local.stack = [span]
+    return span
+
+
+def endTrace(span, error=None):
+    """End root span started with `startTrace`."""
+    if span is nullSpan:
+        return
+    _local.stack = []
+    span.finish(error)
+
+
+def traced(name):
+    """Decorator creating a span around each call of the function."""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return func(*args, **kwargs)
+            with Span(name, current()):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def instrument(cls, prefix, kind=KIND_CLIENT):
+    """Trace all public methods of a class.
+
+    Parameters
+    ----------
+    cls : type
+        Class to instrument. Methods are replaced in place.
+    prefix : str
+        Prefix of the span names, the method name is appended.
+    kind : int, optional
+        Span kind. The default is KIND_CLIENT.
+    """
+    if not enabled:
+        return
+    def trace(name, func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with Span(name, current(), kind):
+                return func(*args, **kwargs)
+        return wrapper
+
+    for name, attr in list(vars(cls).items()):
+        if not name.startswith("_") and isfunction(attr):
+            setattr(cls, name, trace(prefix+" "+name, attr))
+
+
+def _afterFork():
+    global _queue, _exporter, _lock
+    _queue = _exporter = None
+    _lock = threading.Lock()
+    _local.stack = []
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_afterFork)
+
+
+def _export(span):
+    global _queue, _exporter
+    if _exporter is None:
+        with _lock:
+            if _exporter is None:
+                _queue = queue.Queue(_config["maxQueueSize"])
+                _exporter = threading.Thread(target=_exportLoop, args=(_queue,), name="trace-exporter", daemon=True)
+                _exporter.start()
+    try:
+        _queue.put_nowait(span)
+    except queue.Full:
+        pass
+
+
+def _exportLoop(spanQueue):
+    while True:
+        batch = [spanQueue.get()]
+        deadline = time.monotonic()+_config["flushInterval"]
+        while len(batch) < 512:
+            timeout = deadline-time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(spanQueue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        try:
+            _write(batch)
+        except Exception as err:
+            logging.warn("Failed to export {} spans: {}".format(len(batch), err))
+
+
+def _write(batch):
+    data = {"resourceSpans": [{"resource": {"attributes": [_attribute("service.name", _config["serviceName"]),
+                                                           _attribute("process.pid", os.getpid())]},
+                               "scopeSpans": [{"scope": {"name": "grammm-admin"},
+                                               "spans": [span.toOTLP() for span in batch]}]}]}
+    payload = json.dumps(data, separators=(",", ":"))
+    if _config["exporter"] == "file":
+        fd = os.open(_config["file"], os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o640)
+        try:
+            os.write(fd, (payload+"\n").encode("utf-8"))  # Single write, so lines of multiple processes do not mix
+        finally:
+            os.close(fd)
+    else:
+        request = urllib.request.Request(_config["endpoint"], payload.encode("utf-8"),
+                                         {"Content-Type": "application/json"})
+        urllib.request.urlopen(request, timeout=10).close()